@@ -34,6 +34,7 @@ parser.add_argument("--input", dest="input", required=False, default=None, type=
 # optional arguments
 parser.add_argument("--min_nAUC_to_beConsideredGrowing", dest="min_nAUC_to_beConsideredGrowing", required=False, type=float, default=0.02, help="A float that indicates the minimum nAUC to be considered growing in susceptibility measures. This may depend on the experiment. This is added in the 'is_growing' field.")
 parser.add_argument("--hours_experiment", dest="hours_experiment", required=False, type=float, default=24.0, help="A float that indicates the total experiment hours that are used to calculate the fitness estimates.")
+parser.add_argument("--plate_format", dest="plate_format", required=False, type=int, default=96, help="The number of spots of each plate. It can be 96 (8x12), 384 (16x24) or 1536 (32x48). The plate layout excels should have the corresponding number of rows and columns.")
 parser.add_argument("--enhance_image_contrast", dest="enhance_image_contrast", required=False,  type=str, default='True', help="True/False. Enhances contrast of images. Only for developers.")
 parser.add_argument("--auto_accept", dest="auto_accept", required=False, default=False, action="store_true", help="Automatically accepts all the coordinates and bad spots. Only for developers.")
 
@@ -44,6 +45,19 @@ parser.add_argument("--reference_plate", dest="reference_plate", required=False,
 parser.add_argument("--break_after", dest="break_after", required=False, type=str, default=None, help="Break after some steps. Only for developers.")
 parser.add_argument("--coords_1st_plate", dest="coords_1st_plate", required=False, default=False, action="store_true", help="Automatically transfers the coordinates of the 1st plate. Only for developers.")
 parser.add_argument("--contrast_enhancement_image", dest="contrast_enhancement_image", required=False,  type=str, default='auto', help="The plate to take as reference for contrast correction. It can be 'image_high_contrast' or 'auto'. Our testing suggests that 'auto' is better. Only for developers.")
+parser.add_argument("--timepoint_subsampling", dest="timepoint_subsampling", required=False,  type=str, default="none", help="How many images of each plate are quantified. It can be 'none' (all images), 'adaptive' (a coarse subset of images, refined in the intervals where growth changes fast) or 'adaptive_check' (like 'adaptive', also running a full-resolution analysis and reporting the drift in K, r, nAUC and DT_h in extended_outputs/timepoint_subsampling_drift.csv). Only for developers.")
+parser.add_argument("--fitness_engine", dest="fitness_engine", required=False,  type=str, default="R", help="The engine used to fit the growth curves. It can be 'R' (the qfa package, one plate at a time) or 'python' (a vectorized fit of all spots at once). Only for developers.")
+parser.add_argument("--fitness_engine_parity", dest="fitness_engine_parity", required=False, default=False, action="store_true", help="After STEP 3, compare the fitness estimates of the python and R engines (writing extended_outputs/fitness_engine_parity.csv), failing if they are different. Requires --fitness_engine R. Only for developers.")
+parser.add_argument("--growth_curve_plots", dest="growth_curve_plots", required=False,  type=str, default="end", help="When the growth curve plots of each plate (extended_outputs/growth_curves) are rendered. It can be 'end' (at the end of the run, after the fitness and susceptibility measurements), 'background' (in STEP 3, in parallel to the detection of bad spots) or 'none' (no plots). Only for developers.")
+parser.add_argument("--interim_fitness_hours", dest="interim_fitness_hours", required=False,  type=str, default="none", help="Comma-separated times (in hours, <--hours_experiment) at which to get interim fitness measurements (for example '12,18'), as if the experiment had stopped there. They are written into extended_outputs/interim_fitness, fitting with the python engine and warm-starting each fit from the previous one. By default ('none') there are no interim measurements. Only for developers.")
+parser.add_argument("--extra_table_formats", dest="extra_table_formats", required=False,  type=str, default="none", help="Comma-separated formats (among 'parquet', 'feather' and 'xlsx') in which the large tables (extended_outputs/fitness_measurements and extended_outputs/susceptibility_measurements) are written, in addition to the .csv. By default ('none') only the .csv tables are written. The summary tables are always written as .csv and .xlsx. Only for developers.")
+parser.add_argument("--bad_spot_features", dest="bad_spot_features", required=False,  type=str, default="nAUC", help="Comma-separated fitness estimates (among 'nAUC', 'DT_h' and 'K') used to detect potential bad spots. A spot is a potential bad spot if any of them is an outlier for its strain in the plate. Only for developers.")
+parser.add_argument("--montage_image_scale", dest="montage_image_scale", required=False,  type=float, default=1.0, help="A float (>0 and <=1) by which the plate images are resized in the plots with growth curves and images (extended_outputs/growth_curves_and_images). The default (1) keeps the original resolution. Lower values (e.g. 0.5) make these plots faster and smaller. Only for developers.")
+parser.add_argument("--plots", dest="plots", required=False,  type=str, default="summary", help="The plots of extended_outputs rendered in STEP 5. It can be 'summary' (only the nAUC plots that are copied into summary_plots, and the raw fitness heatmaps) or 'all' (all types of plots, for all fitness estimates). Note that the plots with growth curves and images (extended_outputs/growth_curves_and_images) are only rendered with 'all'. The other plots can be rendered later with --render_plots ('growth_curves_and_images' only if the run was done with 'all' or --keep_tmp_files). Only for developers.")
+parser.add_argument("--render_plots", dest="render_plots", required=False,  type=str, default=None, help="Render these plots, for all fitness estimates, from the tables of a finished run in --output (without running the pipeline again). It can be 'all' or comma-separated types among 'growth_curves_and_images', 'drug_vs_fitness_heatmaps', 'drug_vs_fitness_lines', 'drug_vs_fitness_lines_all_spots', 'susceptibility_heatmaps', 'susceptibility_heatmaps_log_scale' and 'drug_vs_raw_fitness_heatmaps'. 'growth_curves_and_images' requires a run with '--plots all' or --keep_tmp_files, and the --montage_image_scale of the run. Only for developers.")
+parser.add_argument("--fit_cache_dir", dest="fit_cache_dir", required=False,  type=str, default=None, help="A folder with a cache of the growth curve fits, which can be shared across runs. Spots (or plates, with --fitness_engine R) whose growth curves and fitting parameters did not change are not fit again. By default there is no cache. Only for developers.")
+parser.add_argument("--fit_cache_max_mb", dest="fit_cache_max_mb", required=False,  type=float, default=500.0, help="The maximum size (in Mb) of --fit_cache_dir. The least recently used fits are removed when it is larger. Only for developers.")
+parser.add_argument("--trusted_mode", dest="trusted_mode", required=False, default=False, action="store_true", help="Skip the validation of the intermediate tables (types, NaNs, infs, negative values and duplicates) in the image analysis, which may be useful for large, already tested, datasets. Only for developers.")
 parser.add_argument("--parms_colonyzer", dest="parms_colonyzer", required=False,  type=str, default="greenlab,lc,diffims", help="Set of extra parameters to pass to colonyzer as --<parm>.")
 
 
@@ -106,7 +120,22 @@ if opt.output is None: raise ValueError("You should provide a string in --output
 opt.input = fun.get_fullpath(opt.input)
 opt.output = fun.get_fullpath(opt.output)
 if not os.path.isdir(opt.input): raise ValueError("The folder provided in --input does not exist")
+if opt.plate_format not in fun.plate_format_to_nrows_and_ncols: raise ValueError("plate_format should be one of %s"%sorted(fun.plate_format_to_nrows_and_ncols))
 if opt.contrast_enhancement_image not in {"image_high_contrast", "auto"}: raise ValueError("contrast_enhancement_image should be 'image_high_contrast' or 'auto'")
+if opt.timepoint_subsampling not in {"none", "adaptive", "adaptive_check"}: raise ValueError("timepoint_subsampling should be 'none', 'adaptive' or 'adaptive_check'")
+if opt.fitness_engine not in {"R", "python"}: raise ValueError("fitness_engine should be 'R' or 'python'")
+if opt.fitness_engine_parity is True and opt.fitness_engine!="R": raise ValueError("--fitness_engine_parity requires --fitness_engine R")
+if opt.interim_fitness_hours!="none":
+    try: interim_fitness_hours = [float(x) for x in opt.interim_fitness_hours.split(",")]
+    except: raise ValueError("interim_fitness_hours should be 'none' or comma-separated numbers")
+    if any([h<=0 or h>=opt.hours_experiment for h in interim_fitness_hours]): raise ValueError("interim_fitness_hours should be between 0 and --hours_experiment")
+if opt.fit_cache_max_mb<=0: raise ValueError("fit_cache_max_mb should be >0")
+if opt.growth_curve_plots not in {"end", "background", "none"}: raise ValueError("growth_curve_plots should be 'end', 'background' or 'none'")
+if len(set(opt.bad_spot_features.split(",")).difference({"nAUC", "DT_h", "K"}))>0: raise ValueError("bad_spot_features should be comma-separated fitness estimates among 'nAUC', 'DT_h' and 'K'")
+if opt.montage_image_scale<=0 or opt.montage_image_scale>1: raise ValueError("montage_image_scale should be >0 and <=1")
+if opt.plots not in {"summary", "all"}: raise ValueError("plots should be 'summary' or 'all'")
+if opt.render_plots is not None and opt.replace is True: raise ValueError("--render_plots can't be combined with --replace")
+if opt.extra_table_formats!="none" and len(set(opt.extra_table_formats.split(",")).difference({"parquet", "feather", "xlsx"}))>0: raise ValueError("extra_table_formats should be 'none' or comma-separated formats among 'parquet', 'feather' and 'xlsx'")
 
 # check parms colonyzer
 set_parms = set(opt.parms_colonyzer.split(","))
@@ -127,8 +156,10 @@ if not opt.os in {"linux", "mac", "windows"}: raise ValueError("--os should have
 fun.print_with_runtime("Writing results into the output folder '%s', using input files from '%s'"%(opt.output, opt.input))
 
 # print the cmd
-arguments = " ".join(["--%s %s"%(arg_name, arg_val) for arg_name, arg_val in [("os", opt.os), ("input", opt.input), ("output", opt.output), ("docker_image", opt.docker_image), ("min_nAUC_to_beConsideredGrowing", opt.min_nAUC_to_beConsideredGrowing), ("hours_experiment", opt.hours_experiment), ("enhance_image_contrast", opt.enhance_image_contrast), ("parms_colonyzer", opt.parms_colonyzer)]])
+arguments = " ".join(["--%s %s"%(arg_name, arg_val) for arg_name, arg_val in [("os", opt.os), ("input", opt.input), ("output", opt.output), ("docker_image", opt.docker_image), ("min_nAUC_to_beConsideredGrowing", opt.min_nAUC_to_beConsideredGrowing), ("hours_experiment", opt.hours_experiment), ("plate_format", opt.plate_format), ("enhance_image_contrast", opt.enhance_image_contrast), ("parms_colonyzer", opt.parms_colonyzer), ("timepoint_subsampling", opt.timepoint_subsampling), ("fitness_engine", opt.fitness_engine), ("growth_curve_plots", opt.growth_curve_plots), ("interim_fitness_hours", opt.interim_fitness_hours), ("bad_spot_features", opt.bad_spot_features), ("montage_image_scale", opt.montage_image_scale), ("plots", opt.plots), ("extra_table_formats", opt.extra_table_formats)]])
 if opt.auto_accept is True: arguments += " --auto_accept"
+if opt.trusted_mode is True: arguments += " --trusted_mode"
+if opt.fit_cache_dir is not None: arguments += " --fit_cache_dir %s --fit_cache_max_mb %s"%(fun.get_fullpath(opt.fit_cache_dir), opt.fit_cache_max_mb)
 
 full_command = "%s %s%smain.py %s"%(sys.executable, pipeline_dir, os_sep, arguments)
 fun.print_with_runtime("Executing the following command (you may use it to reproduce the analysis):\n---\n%s\n---"%full_command)
@@ -150,7 +181,7 @@ fun.make_folder(opt.output)
 
 # define final file
 final_file = "%s%sextended_outputs%sQ-PHAST_end_report.txt"%(opt.output, fun.get_os_sep(), fun.get_os_sep())
-if not fun.file_is_empty(final_file): 
+if not fun.file_is_empty(final_file) and opt.render_plots is None: 
     print("WARNING: The file Q-PHAST_end_report.txt exists, so that Q-PHAST was previously run in this output directory. If you want to re-run here, first remove the output directory. Exiting...")
     sys.exit(0)
 
@@ -173,6 +204,24 @@ fun.delete_folder(tmp_input_dir); fun.make_folder(tmp_input_dir)
 # init command with general features
 docker_cmd = 'docker run --rm -it -e contrast_enhancement_image=%s -e hours_experiment=%s -e KEEP_TMP_FILES=%s -e min_nAUC_to_beConsideredGrowing=%s -e enhance_image_contrast=%s -e reference_plate=%s -e PARMS_COLONYZER=%s -v "%s":/small_inputs -v "%s":/output -v "%s":/images'%(opt.contrast_enhancement_image, opt.hours_experiment, opt.keep_tmp_files, opt.min_nAUC_to_beConsideredGrowing, opt.enhance_image_contrast, str(opt.reference_plate), opt.parms_colonyzer, tmp_input_dir, opt.output, opt.input)
 
+# add the developer options
+docker_cmd += ' -e timepoint_subsampling=%s -e fitness_engine=%s -e growth_curve_plots=%s -e interim_fitness_hours=%s'%(opt.timepoint_subsampling, opt.fitness_engine, opt.growth_curve_plots, opt.interim_fitness_hours)
+
+# add the cache of fits
+if opt.fit_cache_dir is not None:
+    opt.fit_cache_dir = fun.get_fullpath(opt.fit_cache_dir)
+    fun.make_folder(opt.fit_cache_dir)
+    docker_cmd += ' -v "%s":/fit_cache -e FIT_CACHE_DIR=/fit_cache'%(opt.fit_cache_dir)
+
+else: docker_cmd += ' -e FIT_CACHE_DIR=None'
+docker_cmd += ' -e FIT_CACHE_MAX_MB=%s'%(opt.fit_cache_max_mb)
+docker_cmd += ' -e TRUSTED_MODE=%s'%(opt.trusted_mode)
+docker_cmd += ' -e extra_table_formats=%s'%(opt.extra_table_formats)
+docker_cmd += ' -e plate_format=%s'%(opt.plate_format)
+docker_cmd += ' -e bad_spot_features=%s'%(opt.bad_spot_features)
+docker_cmd += ' -e montage_image_scale=%s'%(opt.montage_image_scale)
+docker_cmd += ' -e plots=%s'%(opt.plots)
+
 # add the scripts from outside
 docker_cmd += ' -v "%s%sscripts":/workdir_app/scripts'%(pipeline_dir, fun.get_os_sep())
 
@@ -182,6 +231,17 @@ fun.copy_file(plate_layout_file, copied_plate_layout)
 # write command into tmp file
 open(full_command_file, "w").write(full_command+"\n")
 
+# render plots of a finished run, and exit
+if opt.render_plots is not None:
+    if fun.file_is_empty(final_file): raise ValueError("--render_plots requires a finished run in --output")
+    print("\n")
+    fun.print_with_runtime("Rendering the plots '%s' of the run in '%s'..."%(opt.render_plots, opt.output))
+    fun.run_docker_cmd("%s -e MODULE=render_plots -e render_plots=%s"%(docker_cmd, opt.render_plots), ["%s%srender_plots_correct_finish.txt"%(opt.output, fun.get_os_sep())])
+    fun.remove_file("%s%srender_plots_correct_finish.txt"%(opt.output, fun.get_os_sep()))
+    fun.delete_folder(tmp_input_dir)
+    fun.print_with_runtime("main.py rendered the plots successfully in %.2f seconds!"%(time.time()-start_time))
+    sys.exit(0)
+
 # get the corrected images
 print("\n")
 fun.print_with_runtime("STEP 1/5: Getting cropped, flipped images...")
@@ -201,6 +261,11 @@ print("\n")
 fun.print_with_runtime("STEP 3/5: Getting fitness measurements...")
 fun.run_docker_cmd("%s -e MODULE=get_fitness_measurements"%(docker_cmd), ["%s%sget_fitness_measurements_correct_finish.txt"%(opt.output, fun.get_os_sep())])
 
+# check the parity of the fitness engines
+if opt.fitness_engine_parity is True: 
+    fun.print_with_runtime("Comparing the python and R fitness engines...")
+    fun.run_docker_cmd("%s -e MODULE=compare_fitness_engines"%(docker_cmd), ["%s%scompare_fitness_engines_correct_finish.txt"%(opt.output, fun.get_os_sep())])
+
 # validate bad spots
 print("\n")
 fun.print_with_runtime("STEP 4/5: Manually-curating bad spots...")
@@ -216,7 +281,7 @@ fun.print_with_runtime("STEP 5/5: Getting integrated fitness and susceptibility
 fun.run_docker_cmd("%s -e MODULE=get_rel_fitness_and_susceptibility_measurements"%(docker_cmd), ["%s%sget_rel_fitness_and_susceptibility_measurements_correct_finish.txt"%(opt.output, fun.get_os_sep())])
 
 # clean
-for f in ['analyze_images_run_colonyzer_subset_images_correct_finish.txt', 'analyze_images_process_images_correct_finish.txt', 'get_fitness_measurements_correct_finish.txt', 'get_rel_fitness_and_susceptibility_measurements_correct_finish.txt']: fun.remove_file("%s%s%s"%(opt.output, fun.get_os_sep(), f))
+for f in ['compare_fitness_engines_correct_finish.txt', 'analyze_images_run_colonyzer_subset_images_correct_finish.txt', 'analyze_images_process_images_correct_finish.txt', 'get_fitness_measurements_correct_finish.txt', 'get_rel_fitness_and_susceptibility_measurements_correct_finish.txt']: fun.remove_file("%s%s%s"%(opt.output, fun.get_os_sep(), f))
 fun.delete_folder(tmp_input_dir)
 #fun.delete_folder("%s%sextended_outputs%sreduced_input_dir.zip"%(opt.output, fun.get_os_sep(), fun.get_os_sep()))
 
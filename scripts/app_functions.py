@@ -3,7 +3,7 @@
 # Functions of the image analysis pipeline. This should be imported from the main_env
 
 # imports
-import os, sys, time, random, string, shutil, math, itertools, pickle, scipy, zipfile, matplotlib
+import os, sys, time, random, string, shutil, math, itertools, pickle, scipy, zipfile, matplotlib, hashlib, sqlite3, zlib, io
 import copy as cp
 from datetime import date
 import pandas as pd
@@ -24,6 +24,7 @@ import matplotlib.patches as patches
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import traceback
 from PIL import ImageFile, ImageStat
+from shared_functions import get_md5_file, get_colonyzer_subset_run_is_up_to_date, plate_format_to_nrows_and_ncols
 
 # set parms for matplotlib
 #plt.rcParams['font.family'] = 'Arial'
@@ -37,10 +38,35 @@ CondaDir =  "/opt/conda"
 PipelineName = "Q-PHAST"
 blank_spot_names = {"h2o", "h20", "water", "empty", "blank"}
 allowed_image_endings = {"tiff", "jpg", "jpeg", "png", "tif", "gif"}
+colonyzer_dat_fields = ["Image.Name", "Row", "Column", "X.Offset", "Y.Offset", "Area", "Trimmed", "Threshold", "Intensity", "Edge.Pixels", "redMean", "greenMean", "blueMean", "redMeanBack", "greenMeanBack", "blueMeanBack", "Edge.Length", "Tile.Dimensions.X", "Tile.Dimensions.Y", "x", "y", "Diameter"] # fields of the .dat files generated by colonyzer
 #parms_colonyzer = ("greenlab", "lc", "diffims") # original, most testing based on this
 #parms_colonyzer = ("") # no extra parms
+fit_cache_dir = None # a dir with the cache of fits (None means no cache). Set by run_app.py
+fit_cache_max_mb = 500.0 # the maximum size of the cache of fits
+fit_cache_version = 2 # the version of the fitness engines, which is part of the keys of the fit cache. It should be increased when the fits of any engine change, so that older cached fits are not reused
+trusted_mode = False # if True, the schema validation of the intermediate tables is skipped. Set by run_app.py
+plate_format = 96 # the number of spots in each plate (96, 384 or 1536). Set by run_app.py
 
 # functions
+
+####### PLATE FORMAT #######
+
+def get_plate_nrows_and_ncols():
+
+    """Returns the number of rows and columns of the plates, according to plate_format"""
+
+    if plate_format not in plate_format_to_nrows_and_ncols: raise ValueError("plate_format should be one of %s"%sorted(plate_format_to_nrows_and_ncols))
+    return plate_format_to_nrows_and_ncols[plate_format]
+
+def get_plate_row_letters():
+
+    """Returns the letters of the plate rows (A-H for 96-spot plates, A-P for 384 and A-Z plus AA-AF for 1536)"""
+
+    nrows = get_plate_nrows_and_ncols()[0]
+    return [string.ascii_uppercase[I] if I<26 else "A%s"%string.ascii_uppercase[I-26] for I in range(nrows)]
+
+############################
+
 def get_date_and_time_for_print():
 
     """Gets the date of today"""
@@ -187,8 +213,9 @@ def save_colored_plate_layout(df, filename):
                 elif value.lower() in blank_spot_names: color = "white"
                 else:
 
-                    if (real_Icol in {0, 1, 2, 3, 4, 5} and real_Irow in {0, 1, 2, 3}): color = "c"
-                    elif (real_Icol in {6, 7, 8, 9, 10, 11} and real_Irow in {4, 5, 6, 7}): color = "c"
+                    nrows, ncols = get_plate_nrows_and_ncols()
+                    if (real_Icol<(ncols/2) and real_Irow<(nrows/2)): color = "c"
+                    elif (real_Icol>=(ncols/2) and real_Irow>=(nrows/2)): color = "c"
                     else: color = "orange"
 
                 # format
@@ -227,7 +254,7 @@ def run_get_plate_layout(strains_excel, drugs_excel, outdir):
     # debug and format
     if set(df_strains.columns)!={"strain"}: raise ValueError("The strains excel should have these columns: 'strain'")
     if set(df_drugs.columns)!={"plate_batch", "plate", "drug", "concentration"}: raise ValueError("The strains excel should have these columns: 'plate_batch', 'plate', 'drug', 'concentration'")
-    if len(df_strains)!=24: raise ValueError("the strains excel should have 24 strains")
+    if len(df_strains)!=(plate_format/4): raise ValueError("the strains excel should have %i strains"%(plate_format/4))
     if len(df_drugs)!=len(df_drugs[["plate_batch", "plate"]].drop_duplicates()): raise ValueError("The combination of plate_batch and plate should be unique")
     if len(df_drugs)!=len(df_drugs[["drug", "concentration"]].drop_duplicates()): raise ValueError("The combination of drug and concentration should be unique")
 
@@ -259,33 +286,41 @@ def run_get_plate_layout(strains_excel, drugs_excel, outdir):
     #print_with_runtime("Getting plate layout...")
 
     # create df
-    df_plate_layout = pd.DataFrame(index=list("ABCDEFGH"), columns=list(range(1, 13)))
+    nrows, ncols = get_plate_nrows_and_ncols()
+    row_letters = get_plate_row_letters()
+    df_plate_layout = pd.DataFrame(index=row_letters, columns=list(range(1, ncols+1)))
 
     # define all strains
     all_strains = list(df_strains.strain)
 
+    # define the rows and columns of each half of the plate
+    upper_rows = row_letters[0:int(nrows/2)]
+    lower_rows = row_letters[int(nrows/2):]
+    left_cols = list(range(1, int(ncols/2)+1))
+    right_cols = list(range(int(ncols/2)+1, ncols+1))
+
     # fill the first quadrant
     I = 0
-    for row in ["A", "B", "C", "D"]:
-        for col in range(1, 6+1):
+    for row in upper_rows:
+        for col in left_cols:
             df_plate_layout.loc[row, col] = all_strains[I]; I+=1
 
     # fill the second quadrant, mirror of the first
     I = 0
-    for row in ["A", "B", "C", "D"]:
-        for col in reversed(range(7, 12+1)):
+    for row in upper_rows:
+        for col in reversed(right_cols):
             df_plate_layout.loc[row, col] = all_strains[I]; I+=1
 
     # fill the thiird quadrant, mirror of the first
     I = 0
-    for row in ["E", "F", "G", "H"]:
-        for col in reversed(range(1, 6+1)):
+    for row in lower_rows:
+        for col in reversed(left_cols):
             df_plate_layout.loc[row, col] = all_strains[I]; I+=1
 
     # fill the fourth quadrant, which is the same as the first
     I = 0
-    for row in ["E", "F", "G", "H"]:
-        for col in range(7, 12+1):
+    for row in lower_rows:
+        for col in right_cols:
             df_plate_layout.loc[row, col] = all_strains[I]; I+=1
 
     # save excel colored
@@ -298,10 +333,10 @@ def run_get_plate_layout(strains_excel, drugs_excel, outdir):
     #print_with_runtime("Getting plate layout in long format...")
 
     # change the index
-    df_plate_layout.index = list(range(1, 9))
+    df_plate_layout.index = list(range(1, nrows+1))
 
     # create the long df for the plate
-    df_plate_layout_long_core = pd.concat([pd.DataFrame({"column":[col]*8, "strain":df_plate_layout[col], "row":list(df_plate_layout.index)}) for col in df_plate_layout.columns]).sort_values(by=["row", "column"]).reset_index(drop=True)
+    df_plate_layout_long_core = pd.concat([pd.DataFrame({"column":[col]*nrows, "strain":df_plate_layout[col], "row":list(df_plate_layout.index)}) for col in df_plate_layout.columns]).sort_values(by=["row", "column"]).reset_index(drop=True)
 
     # create a single df_plate_layout_long with a copy of df_plate_layout_long_core for each combination of plate_batch, plate
     def get_df_plate_layout_long_one_row_df_drugs(r):
@@ -606,7 +641,7 @@ def get_automatic_coords(colonizer_coordinates_one_spot, coordinate_obtention_di
     colonyzer_std = "%s/colonyzer.std"%coordinate_obtention_dir_plate
     try: 
 
-        run_cmd("colonyzer --fmt 96 --remove > %s 2>&1"%colonyzer_std, env="colonyzer_env")
+        run_cmd("colonyzer --fmt %i --remove > %s 2>&1"%(plate_format, colonyzer_std), env="colonyzer_env")
         auto_colonyzer_worked = True
 
     except:
@@ -621,13 +656,14 @@ def get_automatic_coords(colonizer_coordinates_one_spot, coordinate_obtention_di
 
         # define the coordinates of the upper left and bottom right spots
         df_coords = get_tab_as_df_or_empty_df("%s/Output_Data/%s.out"%(coordinate_obtention_dir_plate, latest_image.rstrip(".tif"))).set_index(["Row", "Column"], drop=True)
-        automatic_coords_str = ",".join([str(int(round(pos, 0))) for pos in (df_coords.loc[1, 1].x, df_coords.loc[1, 1].y, df_coords.loc[8, 12].x, df_coords.loc[8, 12].y)])
+        nrows, ncols = get_plate_nrows_and_ncols()
+        automatic_coords_str = ",".join([str(int(round(pos, 0))) for pos in (df_coords.loc[1, 1].x, df_coords.loc[1, 1].y, df_coords.loc[nrows, ncols].x, df_coords.loc[nrows, ncols].y)])
 
         # create the colonizer_coordinates_one_spot file as parametryzer does
         lines_parametryzer_output = ["# misc", 
-                                     "default,96,%s,%s"%(automatic_coords_str, date.today().strftime("%Y-%m-%d")), 
+                                     "default,%i,%s,%s"%(plate_format, automatic_coords_str, date.today().strftime("%Y-%m-%d")), 
                                      "#",
-                                     "%s,96,%s"%(latest_image, automatic_coords_str)]
+                                     "%s,%i,%s"%(latest_image, plate_format, automatic_coords_str)]
 
         open(colonizer_coordinates_one_spot, "w").write("\n".join(lines_parametryzer_output)+"\n")
 
@@ -698,7 +734,7 @@ def generate_colonyzer_coordinates_one_plate_batch_and_plate(dest_processed_imag
 
         # define the wells
         wells = last_line_split[1]
-        if wells!="96": raise ValueError("You set the analysis for %s-well plates, which is incompatible. Make sure that you press 'g' to save the coordinates."%wells)
+        if wells!=str(plate_format): raise ValueError("You set the analysis for %s-well plates, which is incompatible with the plate format (%i). Make sure that you press 'g' to save the coordinates."%(wells, plate_format))
 
         # get the coordinates
         coordinates_str = ",".join(last_line_split[2:])
@@ -797,7 +833,7 @@ def run_colonyzer_one_set_of_parms(parms, outdir_all, image_names_withoutExtensi
         # run colonizer, which will generate data under . (images_folder)
         colonyzer_exec = "%s/envs/colonyzer_env/bin/colonyzer"%CondaDir
         colonyzer_std = "%s.running_colonyzer.std"%outdir_tmp
-        colonyzer_cmd = "%s %s --plots --remove --initpos --fmt 96 > %s 2>&1"%(colonyzer_exec, extra_cmds_parmCombination, colonyzer_std) # --slopefill 0.9 is default, --slopefill 0.5 gave more simialr patterns of growth at high concentrations. slopefill 0.7 did not change
+        colonyzer_cmd = "%s %s --plots --remove --initpos --fmt %i > %s 2>&1"%(colonyzer_exec, extra_cmds_parmCombination, plate_format, colonyzer_std) # --slopefill 0.9 is default, --slopefill 0.5 gave more simialr patterns of growth at high concentrations. slopefill 0.7 did not change
         run_cmd(colonyzer_cmd, env="colonyzer_env")
         remove_file(colonyzer_std)
 
@@ -863,6 +899,89 @@ def save_df_as_tab(df, file):
     df.to_csv(file_tmp, sep="\t", index=False, header=True)
     os.rename(file_tmp, file)
 
+####### OUTPUT TABLES #######
+
+table_format_to_extension = {"tab":"csv", "parquet":"parquet", "feather":"feather", "xlsx":"xlsx"}
+
+def check_table_formats(table_formats):
+
+    """Raises a ValueError if some of the table_formats are not valid or can't be written in this environment"""
+
+    for table_format in table_formats:
+        if table_format not in table_format_to_extension: raise ValueError("Invalid table format '%s'. It should be one of %s"%(table_format, sorted(table_format_to_extension)))
+
+        if table_format in {"parquet", "feather"}:
+            try: import pyarrow
+            except ImportError: raise ValueError("Writing tables in the '%s' format requires the python package pyarrow, which is not installed. You may use 'tab' or 'xlsx' instead"%table_format)
+
+def save_df_in_format(df, filename, table_format):
+
+    """Saves df with the path of filename (changing the extension to the one of table_format), through a tmp file"""
+
+    file = "%s.%s"%(os.path.splitext(filename)[0], table_format_to_extension[table_format])
+    if table_format=="tab": save_df_as_tab(df, file); return
+
+    # write the tmp file (keeping the extension, which defines the excel engine)
+    file_tmp = "%s.tmp.%s"%(os.path.splitext(file)[0], table_format_to_extension[table_format])
+
+    if table_format=="xlsx": df.to_excel(file_tmp, index=False)
+
+    else:
+
+        # the binary formats can't have tuples (like spotID), which are written as in the .csv tables
+        df = df.reset_index(drop=True)
+        for k in df.keys():
+            if df[k].dtype==object and any(df[k].apply(lambda x: type(x)==tuple)): df[k] = df[k].apply(str)
+
+        if table_format=="parquet": df.to_parquet(file_tmp, index=False)
+        elif table_format=="feather": df.to_feather(file_tmp)
+
+    os.rename(file_tmp, file)
+
+def run_table_writer(tables_queue, errors_queue):
+
+    """Runs in the table writer process (see start_table_writer). It writes each (df, filename, table_format) of tables_queue with save_df_in_format until it gets None, and then puts the tables that could not be written into errors_queue."""
+
+    errors = []
+    for df, filename, table_format in iter(tables_queue.get, None):
+        try: save_df_in_format(df, filename, table_format)
+        except Exception:
+            print_with_runtime("Error writing %s (%s):\n%s"%(filename, table_format, traceback.format_exc()))
+            errors.append("%s (%s)"%(filename, table_format))
+
+    errors_queue.put(errors)
+
+def start_table_writer():
+
+    """Starts a table writer, which is one process that writes the tables sent with write_table in the background, so that the tables are written while other things are done (i.e. plots). A forked process (started before the large tables are generated) is used instead of a thread, as a running thread may leave locks held in the workers of the multiprocessing pools that are forked for the plots. The queues are SimpleQueues, which do not start feeder threads. The process is a daemon, so that it is terminated if the parent fails before finish_table_writer. It returns a dict with the process and the queues."""
+
+    context = multiproc.get_context("fork")
+    table_writer = {"tables_queue":context.SimpleQueue(), "errors_queue":context.SimpleQueue()}
+    table_writer["process"] = context.Process(target=run_table_writer, args=(table_writer["tables_queue"], table_writer["errors_queue"]), daemon=True)
+    table_writer["process"].start()
+
+    return table_writer
+
+def write_table(df, filename, table_formats, table_writer=None):
+
+    """Writes df in each of the table_formats, with the path of filename (changing the extension). If table_writer is provided, the table is sent to the table writer process, which writes it in the background."""
+
+    for table_format in table_formats:
+        if table_writer is None: save_df_in_format(df, filename, table_format)
+        else: table_writer["tables_queue"].put((df, filename, table_format))
+
+def finish_table_writer(table_writer):
+
+    """Waits until all the tables of table_writer are written, raising an error if some of them failed"""
+
+    table_writer["tables_queue"].put(None)
+    errors = table_writer["errors_queue"].get()
+    table_writer["process"].join()
+
+    if len(errors)>0: raise ValueError("Some tables could not be written (see the errors above):\n%s"%("\n".join(errors)))
+
+#############################
+
 def get_tab_as_df_or_empty_df(file):
 
     """Gets df from file or empty df"""
@@ -872,6 +991,50 @@ def get_tab_as_df_or_empty_df(file):
     if nlines==0: return pd.DataFrame()
     else: return pd.read_csv(file, sep="\t")
 
+####### TABLE BUILDING #######
+
+# These functions build dfs incrementally (instead of row-by-row DataFrame.append, which is quadratic). A table collects either rows (into one list per column) or dfs, and it is converted into a df once, with get_df_from_table.
+
+def init_table():
+
+    """Returns an empty table, to be filled with add_row_to_table or add_df_to_table"""
+
+    return {"columns":{}, "nrows":0, "dfs":[]}
+
+def add_row_to_table(table, row_dict):
+
+    """Adds a row (a dict mapping each column to a value) to table. Missing values are filled with NaNs."""
+
+    if len(table["dfs"])>0: raise ValueError("You can't add rows to a table with dfs")
+
+    # add new columns
+    for k in row_dict:
+        if k not in table["columns"]: table["columns"][k] = [np.nan]*table["nrows"]
+
+    # add the values
+    for k, values in table["columns"].items(): values.append(row_dict.get(k, np.nan))
+    table["nrows"] += 1
+
+def add_df_to_table(table, df):
+
+    """Adds the rows of df to table (keeping the index, as DataFrame.append)"""
+
+    if table["nrows"]>0: raise ValueError("You can't add dfs to a table with rows")
+    table["dfs"].append(df)
+
+def get_df_from_table(table, reset_index=False):
+
+    """Returns the df of a table (an empty df if there are no rows)"""
+
+    if table["nrows"]>0: df = pd.DataFrame(table["columns"])
+    elif len(table["dfs"])>0: df = pd.concat(table["dfs"], sort=False)
+    else: df = pd.DataFrame()
+
+    if reset_index is True: df = df.reset_index(drop=True)
+    return df
+
+##############################
+
 
 def get_df_fitness_measurements_one_parm_set(outdir_all, outdir_name, plate_batch, plate, df_plate_layout):
 
@@ -896,141 +1059,947 @@ def get_df_fitness_measurements_one_parm_set(outdir_all, outdir_name, plate_batc
     return get_tab_as_df_or_empty_df(df_fitness_measurements_file)
 
 
-def get_growth_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_folder, outdir_all, plate_batch, plate, sorted_image_names, processed_images_dir_each_plate, reference_plate, df_plate_layout, hours_experiment):
+def get_growth_matrix_from_colonyzer_output(data_path, sorted_image_names_withoutExtension):
 
-    """For one plate batch and plate, runs colonyzer to get raw growth and fitness measurements."""
+    """Returns an array (images x spots) with the growth (trimmed intensity divided by the tile area) of each spot in the colonyzer .dat files of data_path, for the sorted images"""
 
-    print_with_runtime("Getting fitness measurements for plate_batch-plate %i/%i: %s-plate%i"%(Ibatch, nbatches, plate_batch, plate))
+    growth_rows = []
+    for img in sorted_image_names_withoutExtension:
+        df = pd.read_csv("%s/%s.dat"%(data_path, img), sep="\t", header=None, names=colonyzer_dat_fields).sort_values(by=["Row", "Column"])
+        growth_rows.append((df.Trimmed / (df["Tile.Dimensions.X"]*df["Tile.Dimensions.Y"]*255)).values)
 
-    # define final file
+    return np.array(growth_rows)
+
+def run_colonyzer_on_subset_of_images(images_folder, pass_dir, image_names, processed_images_dir_each_plate, reference_plate):
+
+    """Runs colonyzer (from pass_dir) on a subset of the images (image_names, with extension) of images_folder. The results are written into pass_dir/output_<parms>"""
+
+    # make a folder with links to the images and the coordinates
+    make_folder(pass_dir)
+    for f in list(image_names) + ["Colonyzer.txt"]: soft_link_files("%s/%s"%(images_folder, f), "%s/%s"%(pass_dir, f))
+
+    # run colonyzer from pass_dir
+    initial_dir = os.getcwd()
+    os.chdir(pass_dir)
+    run_colonyzer_one_set_of_parms(parms_colonyzer, pass_dir, set({x.split(".")[0] for x in image_names}), processed_images_dir_each_plate, reference_plate)
+    os.chdir(initial_dir)
+
+def run_colonyzer_adaptive_timepoint_subsampling(images_folder, outdir_all, sorted_image_names, processed_images_dir_each_plate, reference_plate, n_coarse_timepoints=12, min_fraction_growth_change_to_refine=0.1):
+
+    """Runs colonyzer on a coarse subset of the images of one plate and then on all the images of the intervals where the growth changes fast (the 90th percentile of the change across spots is >min_fraction_growth_change_to_refine of the maximum growth). The results are merged into outdir_all/output_<parms>, as if colonyzer had been run on the selected images. The first and last images are quantified in each pass, so that all passes have the same references."""
+
+    # define dirs
+    outdir = "%s/output_%s"%(outdir_all, "_".join(sorted(parms_colonyzer)))
+    subsampling_dir = "%s/timepoint_subsampling"%outdir_all
+    if os.path.isdir(outdir): return
+
+    # define the coarse images
+    nimages = len(sorted_image_names)
+    coarse_idxs = sorted(set(np.round(np.linspace(0, nimages-1, min(nimages, n_coarse_timepoints))).astype(int)))
+    coarse_images = [sorted_image_names[I] for I in coarse_idxs]
+
+    # run colonyzer on the coarse images
+    coarse_dir = "%s/coarse"%subsampling_dir
+    run_colonyzer_on_subset_of_images(images_folder, coarse_dir, coarse_images, processed_images_dir_each_plate, reference_plate)
+
+    # get the growth of the coarse images
+    coarse_data_path = "%s/output_%s/Output_Data"%(coarse_dir, "_".join(sorted(parms_colonyzer)))
+    growth_coarse = get_growth_matrix_from_colonyzer_output(coarse_data_path, [x.split(".")[0] for x in coarse_images])
+
+    # define the images of the intervals where growth changes fast
+    max_growth = max(np.percentile(growth_coarse, 90, axis=1))
+    refined_idxs = []
+    if max_growth>0:
+        for Ic, (Ia, Ib) in enumerate(zip(coarse_idxs[0:-1], coarse_idxs[1:])):
+            if (Ib-Ia)>1 and (np.percentile(np.abs(growth_coarse[Ic+1] - growth_coarse[Ic]), 90)/max_growth)>=min_fraction_growth_change_to_refine: refined_idxs += list(range(Ia+1, Ib))
+
+    # run colonyzer on the refined images (together with the first and last images)
+    refined_dir = "%s/refined"%subsampling_dir
+    if len(refined_idxs)>0: run_colonyzer_on_subset_of_images(images_folder, refined_dir, [sorted_image_names[I] for I in sorted(set(refined_idxs + [0, nimages-1]))], processed_images_dir_each_plate, reference_plate)
+
+    # merge the outputs of each pass into outdir, keeping the coarse one for repeated images
+    outdir_tmp = "%s_tmp"%outdir
+    delete_folder(outdir_tmp); make_folder(outdir_tmp)
+
+    for folder in ["Output_Images", "Output_Data", "Output_Reports"]: 
+        make_folder("%s/%s"%(outdir_tmp, folder))
+
+        for pass_dir in [coarse_dir, refined_dir]:
+            pass_folder = "%s/output_%s/%s"%(pass_dir, "_".join(sorted(parms_colonyzer)), folder)
+            if not os.path.isdir(pass_folder): continue
+
+            for f in os.listdir(pass_folder):
+                if not os.path.isfile("%s/%s/%s"%(outdir_tmp, folder, f)): os.rename("%s/%s"%(pass_folder, f), "%s/%s/%s"%(outdir_tmp, folder, f))
+
+    # write which images were quantified in each pass
+    image_to_pass = {**{I:"refined" for I in refined_idxs}, **{I:"coarse" for I in coarse_idxs}}
+    df_subsampling = pd.DataFrame({"image":sorted_image_names, "quantification_pass":[image_to_pass.get(I, "skipped") for I in range(nimages)]})
+    save_df_as_tab(df_subsampling, "%s/timepoint_subsampling.tab"%outdir_tmp)
+    print_with_runtime("Adaptive timepoint subsampling quantified %i/%i images of %s"%(sum(df_subsampling.quantification_pass!="skipped"), nimages, images_folder))
+
+    # clean and keep
+    delete_folder(subsampling_dir)
+    os.rename(outdir_tmp, outdir)
+
+def get_df_timepoint_subsampling_drift(fits_file_subsampled, fits_file_full_resolution, plate_batch, plate):
+
+    """Returns a df with the fitness estimates of each spot in a run with timepoint subsampling and a full-resolution one, together with the relative drift (absolute difference / absolute full-resolution value)"""
+
+    # define the estimates to compare
+    fitness_estimates = ["K", "r", "nAUC", "DT_h"]
+
+    # merge
+    df_subsampled = get_tab_as_df_or_empty_df(fits_file_subsampled)[["Row", "Column"] + fitness_estimates]
+    df_full = get_tab_as_df_or_empty_df(fits_file_full_resolution)[["Row", "Column"] + fitness_estimates]
+    df = df_subsampled.merge(df_full, on=["Row", "Column"], how="inner", suffixes=("_subsampled", "_full_resolution"), validate="one_to_one")
+    if len(df)!=len(df_full): raise ValueError("The subsampled and full-resolution runs should have the same spots")
+
+    # add the drifts
+    for fe in fitness_estimates: df["%s_rel_drift"%fe] = (df["%s_subsampled"%fe] - df["%s_full_resolution"%fe]).apply(abs) / df["%s_full_resolution"%fe].apply(abs)
+
+    # add fields
+    df["plate_batch"] = plate_batch
+    df["plate"] = plate
+
+    return df.rename(columns={"Row":"row", "Column":"column"})
+
+####### FIT CACHE #######
+
+# The fit cache is a sqlite database (<fit_cache_dir>/fit_cache.sqlite) with compressed fit results, so that growth curves that did not change are not fit again. The least recently used entries are removed when it is larger than fit_cache_max_mb.
+
+def get_fit_cache_key(*values):
+
+    """Returns the key of the fit cache for some values (numpy arrays, numbers or strings), which includes the fit_cache_version"""
+
+    md5 = hashlib.md5(("fit_cache_version_%i|"%fit_cache_version).encode())
+    for v in values:
+        if type(v)==np.ndarray: md5.update(np.ascontiguousarray(v, dtype=float).tobytes())
+        else: md5.update(str(v).encode())
+        md5.update(b"|")
+
+    return md5.hexdigest()
+
+def get_fit_cache_connection():
+
+    """Returns a connection to the fit cache database, creating it if necessary"""
+
+    make_folder(fit_cache_dir)
+    connection = sqlite3.connect("%s/fit_cache.sqlite"%fit_cache_dir, timeout=600)
+    connection.execute("CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_access REAL)")
+
+    return connection
+
+def get_fit_cache_values(keys):
+
+    """Returns a dict with the values of the keys that are in the fit cache, marking them as recently used. It returns an empty dict if there is no fit cache."""
+
+    if fit_cache_dir is None or len(keys)==0: return {}
+
+    # get the values in chunks (sqlite has a limit of variables)
+    connection = get_fit_cache_connection()
+    key_to_value = {}
+    unique_keys = sorted(set(keys))
+    for I in range(0, len(unique_keys), 500):
+        chunk_keys = unique_keys[I:I+500]
+        for key, value in connection.execute("SELECT key, value FROM fits WHERE key IN (%s)"%(",".join(["?"]*len(chunk_keys))), chunk_keys).fetchall(): key_to_value[key] = pickle.loads(zlib.decompress(value))
+
+    # mark as used
+    current_time = time.time()
+    with connection: connection.executemany("UPDATE fits SET last_access=? WHERE key=?", [(current_time, key) for key in key_to_value])
+    connection.close()
+
+    return key_to_value
+
+def save_fit_cache_values(key_to_value):
+
+    """Saves the values of key_to_value into the fit cache (if any), removing the least recently used entries if it is larger than fit_cache_max_mb"""
+
+    if fit_cache_dir is None or len(key_to_value)==0: return
+
+    # save
+    connection = get_fit_cache_connection()
+    current_time = time.time()
+    rows = []
+    for key, value in key_to_value.items():
+        compressed_value = zlib.compress(pickle.dumps(value))
+        rows.append((key, compressed_value, len(compressed_value), current_time))
+
+    with connection: connection.executemany("INSERT OR REPLACE INTO fits VALUES (?,?,?,?)", rows)
+
+    # evict the least recently used entries
+    max_size = fit_cache_max_mb*1e6
+    total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM fits").fetchone()[0]
+    if total_size>max_size:
+
+        keys_to_remove = []
+        for key, size in connection.execute("SELECT key, size FROM fits ORDER BY last_access ASC").fetchall():
+            if total_size<=max_size: break
+            keys_to_remove.append(key)
+            total_size -= size
+
+        with connection: connection.executemany("DELETE FROM fits WHERE key=?", [(key,) for key in keys_to_remove])
+        connection.execute("VACUUM")
+
+    connection.close()
+
+#########################
+
+####### PYTHON FITNESS ENGINE #######
+
+# These functions are a vectorized python equivalent of get_fitness_measurements.R (colonyzer.read, qfa.fit with a logistic model, makeFitness, rsquare and DT_h). They fit all spots of all plates at once.
+
+def get_df_growth_qfa_python(outdir_colonyzer):
+
+    """Python equivalent of colonyzer.read + the Growth calculation in get_fitness_measurements.R. It takes the qfa inputs of one plate and returns the processed_all_data df."""
+
+    # load the colonyzer data
+    df = pd.read_csv("%s/all_images_data.dat"%outdir_colonyzer, sep="\t", header=None, names=colonyzer_dat_fields)
+    df["Barcode"] = df["Image.Name"].apply(lambda x: x[0:-20])
+    df["Date.Time"] = df["Image.Name"].apply(lambda x: x[-19:])
+
+    # add the experiment and library descriptions
+    exp_df = pd.read_csv("%s/ExptDescription.txt"%outdir_colonyzer, sep="\t").rename(columns={"Start.Time":"Inoc.Time", "Treatment":"Treatments", "Screen":"Screen.Name", "Library":"Library.Name", "Plate":"MasterPlate.Number"})
+    df = df.merge(exp_df, how="left", on="Barcode", validate="many_to_one")
+
+    lib_df = pd.read_csv("%s/LibraryDescriptions.txt"%outdir_colonyzer, sep="\t")[["Plate", "Row", "Column", "ORF"]].rename(columns={"Plate":"MasterPlate.Number"})
+    df = df.merge(lib_df, how="left", on=["MasterPlate.Number", "Row", "Column"], validate="many_to_one")
+    orf_to_gene = dict(pd.read_csv("%s/ORF2GENE.txt"%outdir_colonyzer, sep="\t", header=None).values)
+    df["Gene"] = df.ORF.map(orf_to_gene)
+
+    # add the times (in days)
+    date_time_format = "%Y-%m-%d_%H-%M-%S"
+    df["Expt.Time"] = (pd.to_datetime(df["Date.Time"], format=date_time_format) - pd.to_datetime(df["Inoc.Time"], format=date_time_format)).dt.total_seconds() / (24*3600)
+    df["Timeseries.order"] = df.groupby("Barcode")["Date.Time"].rank(method="dense").astype(int)
+
+    # get Growth
+    df["Growth"] = df.Trimmed / (df["Tile.Dimensions.X"]*df["Tile.Dimensions.Y"]*255)
+    if any(df.Growth<0): raise ValueError("There are spots with <0 Growth")
+    if any(df[df["Timeseries.order"]==1].Growth>0): raise ValueError("There are spots with >0 growth in t=0")
+    if any(pd.isna(df.Growth)): raise ValueError("There are nans in Growth")
+
+    # add pseudocount
+    pseudocount_g = 0.001
+    df["Growth"] = df.Growth*1e7 + pseudocount_g
+
+    return df.drop(columns=["Image.Name"]).sort_values(by=["Barcode", "Row", "Column", "Expt.Time"]).reset_index(drop=True)
+
+def get_loess_smoother_matrix(times, span):
+
+    """Returns the matrix S (times x times) so that Y.dot(S.T) are the values of a local quadratic regression with tricube weights (like R's loess with degree=2) of each row of Y, evaluated at times"""
+
+    # define the number of neighbours of each point
+    ntimes = len(times)
+    q = max(int(np.floor(ntimes*span)), 1)
+
+    S = np.zeros((ntimes, ntimes))
+    for I, t in enumerate(times):
+
+        # get the weights
+        distances = np.abs(times - t)
+        max_distance = np.sort(distances)[q-1]*(1+1e-10)
+        if span>1: max_distance = max_distance*span
+        weights = np.where(distances<max_distance, (1 - (distances/max_distance)**3)**3, 0.0)
+
+        # local weighted quadratic regression
+        X = np.vstack([np.ones(ntimes), times-t, (times-t)**2]).T
+        S[I] = np.linalg.pinv(X.T.dot(weights[:,None]*X)).dot(X.T*weights)[0]
+
+    return S
+
+def get_linear_interpolation_matrix(times, x):
+
+    """Returns the matrix L (x x times) so that Y.dot(L.T) are the values of the linear interpolation of each row of Y (defined at times) at x, with constant extrapolation (like R's approxfun with rule=2)"""
+
+    x = np.clip(x, times[0], times[-1])
+    idxs = np.clip(np.searchsorted(times, x, side="right")-1, 0, len(times)-2)
+    weights = (x - times[idxs]) / (times[idxs+1] - times[idxs])
+
+    L = np.zeros((len(x), len(times)))
+    L[np.arange(len(x)), idxs] = 1 - weights
+    L[np.arange(len(x)), idxs+1] += weights
+
+    return L
+
+def get_max_slope_smoothed_values(times, Y, span, nBrute=1000):
+
+    """Python equivalent of the brute-force search of qfa's numerical_r. For each row of Y, it returns the maximum slope of the linear interpolation of the loess-smoothed values and the first time (out of nBrute times) where it is reached."""
+
+    # get the slopes of each segment of the smoothed values
+    Y_smooth = Y.dot(get_loess_smoother_matrix(times, span).T)
+    slopes_segments = np.diff(Y_smooth, axis=1) / np.diff(times)
+
+    # get the slopes at the brute-force times, where the extremes only have half of the slope (constant extrapolation)
+    stimes = np.linspace(times[0], times[-1], nBrute)
+    slopes_stimes = slopes_segments[:, np.clip(np.searchsorted(times, stimes, side="right")-1, 0, len(times)-2)]
+    slopes_stimes[:,0] = slopes_stimes[:,0]/2
+    slopes_stimes[:,-1] = slopes_stimes[:,-1]/2
+
+    # get the maximum
+    Imax = np.argmax(slopes_stimes, axis=1)
+    return slopes_stimes[np.arange(len(Y)), Imax], stimes[Imax]
+
+def get_logistic_and_jacobian(fit_params, T):
+
+    """Takes an array of (a, log(r), log(g)) for each spot (where K = g*(2+exp(a)), so that K>2g and the doubling time is defined) and the times of each spot. It returns the logistic model K/(1+(K/g-1)*exp(-r*t)) and its jacobian on the fit parameters"""
+
+    exp_a, r, g = [np.exp(fit_params[:,I])[:,None] for I in range(3)]
+
+    u = np.exp(-r*T)
+    s = 1 + (1+exp_a)*u
+    f = g*(2+exp_a)/s
+
+    J = np.stack([g*exp_a*(1-u)/s**2, r*(g*(2+exp_a)*(1+exp_a)*u*T/s**2), f], axis=2)
+
+    return f, J
+
+def get_fit_params_from_log_params(log_params):
+
+    """Converts an array of (log(K), log(r), log(g)) into the parameters used by fit_logistic_batched"""
+
+    with np.errstate(all="ignore"): return np.vstack([np.log(np.maximum(np.exp(log_params[:,0] - log_params[:,2]) - 2, 1e-12)), log_params[:,1], log_params[:,2]]).T
+
+def get_log_params_from_fit_params(fit_params):
+
+    """Converts the parameters of fit_logistic_batched into an array of (log(K), log(r), log(g))"""
+
+    return np.vstack([fit_params[:,2] + np.logaddexp(np.log(2), fit_params[:,0]), fit_params[:,1], fit_params[:,2]]).T
+
+def fit_logistic_batched(T, Y, M, inocguess, log_params0, max_iter=200, max_step=1.0):
+
+    """Fits a logistic model (equivalent to qfa.fit with glog=FALSE and fixG=FALSE) to each row of Y (observations at times T, with M indicating which are valid) by minimizing the sum of squares with a Levenberg-Marquardt algorithm that runs on all spots at once. It returns the log(K), log(r), log(g) array, the sum of squares and the number of iterations of each spot. log_params0 are the initial values. K is constrained to be >2g, so that the doubling time is defined."""
+
+    # define the bounds of the fit parameters
+    max_growth = np.max(np.where(M, Y, -np.inf), axis=1)
+    lower_bounds = np.vstack([np.full(len(Y), -30.0), np.full(len(Y), np.log(1e-6)), np.log(inocguess*1e-3)]).T
+    upper_bounds = np.vstack([np.full(len(Y), 700.0), np.full(len(Y), np.log(1e3)), np.log(max_growth)]).T
+
+    def get_sum_squares(fit_params, idxs):
+        f, _ = get_logistic_and_jacobian(fit_params, T[idxs])
+        return np.sum(np.where(M[idxs], f - Y[idxs], 0.0)**2, axis=1)
+
+    # init
+    fit_params = np.clip(get_fit_params_from_log_params(np.array(log_params0, dtype=float)), lower_bounds, upper_bounds)
+    damping = np.full(len(Y), 1.0)
+    niters = np.zeros(len(Y), dtype=int)
+    active = np.ones(len(Y), dtype=bool)
+
+    with np.errstate(all="ignore"):
+
+        sum_squares = get_sum_squares(fit_params, np.arange(len(Y)))
+
+        for Iter in range(max_iter):
+
+            # keep only the spots that have not converged
+            idxs = np.where(active)[0]
+            if len(idxs)==0: break
+
+            f, J = get_logistic_and_jacobian(fit_params[idxs], T[idxs])
+            residuals = np.where(M[idxs], f - Y[idxs], 0.0)
+            J = np.where(M[idxs][:,:,None], J, 0.0)
+
+            # get the damped step
+            A = np.einsum("nti,ntj->nij", J, J)
+            b = np.einsum("nti,nt->ni", J, residuals)
+            A_diag = np.einsum("nii->ni", A)
+            A_damped = A + (damping[idxs][:,None]*A_diag + 1e-12*A_diag.sum(axis=1)[:,None] + 1e-300)[:,:,None]*np.eye(3)[None,:,:]
+            step = np.clip(-np.linalg.solve(A_damped, b[:,:,None])[:,:,0], -max_step, max_step)
+
+            # evaluate the new parameters
+            new_fit_params = np.clip(fit_params[idxs] + step, lower_bounds[idxs], upper_bounds[idxs])
+            new_sum_squares = get_sum_squares(new_fit_params, idxs)
+            improved = new_sum_squares<sum_squares[idxs]
+            converged = (~improved & (damping[idxs]>1e10)) | (improved & ((sum_squares[idxs] - new_sum_squares)<=(1e-10*sum_squares[idxs])))
+
+            # update
+            fit_params[idxs[improved]] = new_fit_params[improved]
+            sum_squares[idxs[improved]] = new_sum_squares[improved]
+            damping[idxs] = np.where(improved, damping[idxs]/3, damping[idxs]*2)
+            niters[idxs] += 1
+            active[idxs[converged]] = False
+
+    return get_log_params_from_fit_params(fit_params), sum_squares, niters
+
+def get_fit_flags_qfa_checkSlow(T, Y, M, detect_thresh, inocguess, log_params):
+
+    """Returns, for each spot (rows of the observations Y at times T, with M indicating which are valid), whether the logistic fit (log_params, see get_log_params_from_fit_params) is one that qfa.fit with checkSlow=TRUE replaces: 'not_growing' if there are <3 observations above detect_thresh or the growth never doubles inocguess, 'slow' if the fitted curve is <95% of K at the last observation (so that K is extrapolated beyond the data) and '' otherwise. The parameters of these spots are replaced by get_params_qfa_checkSlow."""
+
+    # get the growth and fitted curve at the last observation
+    last_idxs = M.sum(axis=1)-1
+    T_last = T[np.arange(len(T)), last_idxs]
+    K, r, g = [np.exp(log_params[:,I]) for I in range(3)]
+    with np.errstate(all="ignore"): growth_last_fitted = K/(1 + (K/g - 1)*np.exp(-r*T_last))
+
+    # define the flags
+    not_growing = ((M & (Y>=detect_thresh[:,None])).sum(axis=1)<3) | (np.max(np.where(M, Y, -np.inf), axis=1)<(2*inocguess))
+    slow = ~not_growing & ~(growth_last_fitted>=(0.95*K))
+
+    return np.where(not_growing, "not_growing", np.where(slow, "slow", ""))
+
+def get_params_qfa_checkSlow(T, Y, M, detect_thresh, inocguess, log_params, fit_flags):
+
+    """Returns the K, r and g of each spot (see get_fit_flags_qfa_checkSlow), replacing the logistic fit of the flagged spots as qfa.fit with checkSlow=TRUE does. K is the maximum observed growth, and r and g are re-estimated with this K ('slow' spots, by least squares of log(K/growth - 1) vs time on the observations above detect_thresh and below K) or set to r=0 and g=inocguess ('not_growing' spots, or 'slow' spots where r can't be re-estimated)."""
+
+    # get the logistic fit
+    K, r, g = [np.exp(log_params[:,I]) for I in range(3)]
+    max_growth = np.max(np.where(M, Y, -np.inf), axis=1)
+    is_flagged = fit_flags!=""
+
+    # re-estimate r and g of the slow spots with K fixed to the maximum growth, from the linearized logistic model
+    M_slow = M & (Y>=detect_thresh[:,None]) & (Y<max_growth[:,None]) & (fit_flags=="slow")[:,None]
+    with np.errstate(all="ignore"):
+        nobs = M_slow.sum(axis=1)
+        Z = np.where(M_slow, np.log(max_growth[:,None]/Y - 1), 0.0)
+        T_mean = np.where(M_slow, T, 0.0).sum(axis=1)/nobs
+        Z_mean = Z.sum(axis=1)/nobs
+        slope = np.where(M_slow, (T - T_mean[:,None])*(Z - Z_mean[:,None]), 0.0).sum(axis=1) / np.where(M_slow, (T - T_mean[:,None])**2, 0.0).sum(axis=1)
+        intercept = Z_mean - slope*T_mean
+
+    re_estimated = (fit_flags=="slow") & (nobs>=2) & (slope<0)
+    r_checkSlow = np.where(re_estimated, -slope, 0.0)
+    with np.errstate(all="ignore"): g_checkSlow = np.where(re_estimated, max_growth/(1 + np.exp(intercept)), inocguess)
+
+    return np.where(is_flagged, max_growth, K), np.where(is_flagged, r_checkSlow, r), np.where(is_flagged, g_checkSlow, g)
+
+def get_df_fitness_python(df_growth_all, days_experiment, log_params0=None, max_iter=200):
+
+    """Python equivalent of the fitting part of get_fitness_measurements.R. It takes the growth df of all plates (with an 'outdir_colonyzer' field) and returns the logRegression_fits df of all plates. log_params0 can be a df with the initial (log(K), log(r), log(g)) of some spots (indexed by outdir_colonyzer, Barcode, Row, Column). As in qfa.fit with detectThresh=inocguess/2, the observations below the detection threshold are not used in the fit. As in qfa.fit with checkSlow=TRUE, the logistic fit of the slow and not growing spots (marked in the 'fit_flag' field) is replaced (see get_params_qfa_checkSlow). The 'log_K', 'log_r' and 'log_g' fields keep the logistic fit of all spots, which is used to warm-start later fits."""
+
+    # define the spot fields
+    spot_fields = ["outdir_colonyzer", "Barcode", "Row", "Column"]
+
+    # get the arrays of growth and times of all spots (padded with invalid values)
+    df_growth_all = df_growth_all.sort_values(by=spot_fields + ["Expt.Time"]).reset_index(drop=True)
+    df_spots = df_growth_all.groupby(spot_fields).size().reset_index().rename(columns={0:"ntimes"})
+    max_ntimes = max(df_spots.ntimes)
+    M = np.arange(max_ntimes)[None,:]<df_spots.ntimes.values[:,None]
+    T = np.zeros(M.shape); T[M] = df_growth_all["Expt.Time"].values
+    Y = np.zeros(M.shape); Y[M] = df_growth_all.Growth.values
+
+    # get the fields of the spots
+    df_last_time = df_growth_all.drop_duplicates(subset=spot_fields, keep="last").reset_index(drop=True)
+    df_fit = df_last_time[spot_fields + ["Treatments", "Medium", "Screen.Name", "ORF", "Gene", "Inoc.Time", "X.Offset", "Y.Offset"]].rename(columns={"X.Offset":"XOffset", "Y.Offset":"YOffset"})
+    df_fit["d0"] = Y[:,0]
+
+    # init the numeric estimates
+    for f in ["nAUC", "nSTP", "nr", "nr_t", "maxslp", "maxslp_t", "nr_log2", "inocguess"]: df_fit[f] = np.nan
+
+    # get the model-free estimates for each plate, where all spots have the same times
+    for outdir_colonyzer in sorted(set(df_fit.outdir_colonyzer)):
+
+        # get the spots and times
+        idxs = np.where(df_fit.outdir_colonyzer==outdir_colonyzer)[0]
+        times = T[idxs[0], M[idxs[0]]]
+        if any(M[idxs].sum(axis=1)!=len(times)) or np.any(T[idxs][:, 0:len(times)]!=times): raise ValueError("All spots of %s should have the same times"%outdir_colonyzer)
+        Y_plate = Y[idxs][:, 0:len(times)]
+
+        # numerical AUC and growth at the single timepoint, interpolating linearly
+        auc_times = np.array(sorted(set([0.0, days_experiment] + [t for t in times if t<days_experiment])))
+        Y_auc_times = Y_plate.dot(get_linear_interpolation_matrix(times, auc_times).T)
+        df_fit.loc[idxs, "nAUC"] = np.sum((Y_auc_times[:,1:] + Y_auc_times[:,0:-1])/2 * np.diff(auc_times), axis=1)
+        df_fit.loc[idxs, "nSTP"] = Y_plate.dot(get_linear_interpolation_matrix(times, np.array([days_experiment])).T)[:,0]
+
+        # numerical rates (as in qfa.fit, with the default span of 0.5) and the log2 rate used for DT_h (with span 0.3)
+        df_fit.loc[idxs, "nr"], df_fit.loc[idxs, "nr_t"] = get_max_slope_smoothed_values(times, np.log(Y_plate), 0.5)
+        df_fit.loc[idxs, "maxslp"], df_fit.loc[idxs, "maxslp_t"] = get_max_slope_smoothed_values(times, Y_plate, 0.5)
+        df_fit.loc[idxs, "nr_log2"], _ = get_max_slope_smoothed_values(times, np.log2(Y_plate), 0.3)
+
+        # the initial guess of growth is the median of the first timepoint
+        df_fit.loc[idxs, "inocguess"] = np.median(Y_plate[:,0])
+
+    # define the initial parameters
+    inocguess = df_fit.inocguess.values
+    detect_thresh = inocguess/2
+    log_params_init = np.vstack([np.log(np.maximum(np.max(np.where(M, Y, -np.inf), axis=1), 2.5*inocguess)), np.log(np.clip(df_fit.nr.values, 0.1, 1e3)), np.log(inocguess)]).T
+    if log_params0 is not None:
+        df_log_params0 = df_fit[spot_fields].merge(log_params0.reset_index(), how="left", on=spot_fields, validate="one_to_one")
+        has_log_params0 = ~pd.isna(df_log_params0[["log_K", "log_r", "log_g"]]).any(axis=1).values
+        log_params_init[has_log_params0] = df_log_params0[has_log_params0][["log_K", "log_r", "log_g"]].values
+
+    # get the cached fits, keyed by the growth curve of each spot and the fitting parameters (the detection threshold is inocguess/2)
+    fit_cache_keys = [get_fit_cache_key("python", T[I, M[I]], Y[I, M[I]], days_experiment, inocguess[I], inocguess[I]/2, max_iter) for I in range(len(df_fit))]
+    key_to_cached_fit = get_fit_cache_values(fit_cache_keys)
+    is_cached = np.array([k in key_to_cached_fit for k in fit_cache_keys], dtype=bool)
+
+    log_params, sum_squares, niters = np.zeros((len(df_fit), 3)), np.zeros(len(df_fit)), np.zeros(len(df_fit), dtype=int)
+    if any(is_cached):
+        cached_fits = [key_to_cached_fit[k] for k in np.array(fit_cache_keys)[is_cached]]
+        log_params[is_cached] = np.array([x[0] for x in cached_fits])
+        sum_squares[is_cached] = np.array([x[1] for x in cached_fits])
+        niters[is_cached] = np.array([x[2] for x in cached_fits])
+        print_with_runtime("Using the cached fits of %i/%i spots"%(sum(is_cached), len(is_cached)))
+
+    # fit the logistic model in the spots that are not cached, only with the observations above the detection threshold (all observations if there are <3 of them, as these spots are flagged as not growing)
+    M_fit = M & (Y>=detect_thresh[:,None])
+    M_fit = np.where((M_fit.sum(axis=1)>=3)[:,None], M_fit, M)
+    if not all(is_cached):
+        log_params[~is_cached], sum_squares[~is_cached], niters[~is_cached] = fit_logistic_batched(T[~is_cached], Y[~is_cached], M_fit[~is_cached], inocguess[~is_cached], log_params_init[~is_cached], max_iter=max_iter)
+        save_fit_cache_values({k : (list(log_params[I]), sum_squares[I], niters[I]) for I, k in enumerate(fit_cache_keys) if not is_cached[I]})
+    df_fit["log_K"], df_fit["log_r"], df_fit["log_g"] = log_params[:,0], log_params[:,1], log_params[:,2]
+    df_fit["v"] = 1.0
+    df_fit["objval"] = sum_squares
+    df_fit["fit_iterations"] = niters
+
+    # replace the fits of the slow and not growing spots, as checkSlow in qfa.fit
+    df_fit["fit_flag"] = get_fit_flags_qfa_checkSlow(T, Y, M, detect_thresh, inocguess, log_params)
+    df_fit["K"], df_fit["r"], df_fit["g"] = get_params_qfa_checkSlow(T, Y, M, detect_thresh, inocguess, log_params, df_fit.fit_flag.values)
+
+    # makeFitness estimates (for v=1), which are NaN or inf for the spots replaced as in checkSlow (as in qfa)
+    K, r, g = df_fit.K.values, df_fit.r.values, df_fit.g.values
+    with np.errstate(all="ignore"):
+        df_fit["MDR"] = r / np.log(1 - 1/(2*g/K - 1))
+        df_fit["MDP"] = np.log(K/g)/np.log(2)
+        df_fit["MDRMDP"] = df_fit.MDR * df_fit.MDP
+        df_fit["glog_maxslp"] = r*K/4
+        df_fit["DT"] = np.log((K/g - 1)/(K/(2*g) - 1))/r
+        df_fit["AUC"] = (K/r)*np.logaddexp(np.log(1 - g/K), np.log(g/K) + r*days_experiment)
+
+    # rsquare between the data and the model
+    with np.errstate(all="ignore"):
+        Y_pred = K[:,None]/(1 + (K[:,None]/g[:,None] - 1)*np.exp(-r[:,None]*T))
+        ntimes = M.sum(axis=1)
+        Y_centered = np.where(M, Y - (np.where(M, Y, 0).sum(axis=1)/ntimes)[:,None], 0)
+        Y_pred_centered = np.where(M, Y_pred - (np.where(M, Y_pred, 0).sum(axis=1)/ntimes)[:,None], 0)
+        df_fit["rsquare"] = (np.sum(Y_centered*Y_pred_centered, axis=1) / np.sqrt(np.sum(Y_centered**2, axis=1)*np.sum(Y_pred_centered**2, axis=1)))**2
+
+        # minimum doubling time in hours
+        DT_h = 24/df_fit.nr_log2.values
+        df_fit["DT_h"] = np.where(DT_h>maxDT_h, maxDT_h, DT_h)
+
+    return df_fit.drop(columns=["nr_log2", "inocguess"])
+
+def plot_growth_curves_one_plate_python(df_growth, df_fit, days_experiment, filename):
+
+    """Python equivalent of qfa.plot. It plots the data and the fitted logistic curve of each spot of one plate (df_growth and df_fit) into a pdf"""
+
+    # define the grid
+    nrows, ncols = max(df_fit.Row), max(df_fit.Column)
+    fig, axs = plt.subplots(nrows, ncols, figsize=(ncols*2, nrows*1.6), sharex=True, sharey=True)
+    axs = np.array(axs).reshape(nrows, ncols)
+    times_model = np.linspace(0, days_experiment, 100)
+
+    for (row, col), df_g in df_growth.groupby(["Row", "Column"]):
+        r_fit = df_fit[(df_fit.Row==row) & (df_fit.Column==col)].iloc[0]
+        ax = axs[row-1, col-1]
+        ax.plot(df_g["Expt.Time"], df_g.Growth, "o", color="black", markersize=2)
+        ax.plot(times_model, r_fit.K/(1 + (r_fit.K/r_fit.g - 1)*np.exp(-r_fit.r*times_model)), "-", color="red", linewidth=1)
+        ax.set_title("%s R%iC%i"%(r_fit.Gene, row, col), fontsize=6)
+        ax.tick_params(labelsize=5)
+
+    fig.suptitle("%s. Time (days) vs Growth"%(df_growth.Barcode.iloc[0]))
+    filename_tmp = "%s.tmp.pdf"%filename
+    fig.savefig(filename_tmp, format="pdf", bbox_inches="tight")
+    plt.close(fig)
+    os.rename(filename_tmp, filename)
+
+def get_log_params_from_fit_state_files(outdirs_colonyzer):
+
+    """Returns a df with the log(K), log(r) and log(g) of the spots in the fit_state.tab of outdirs_colonyzer (written by run_fitness_engine_python), which can be used as log_params0 in get_df_fitness_python. It returns None if there are no such files."""
+
+    fit_state_files = ["%s/fit_state.tab"%d for d in outdirs_colonyzer if not file_is_empty("%s/fit_state.tab"%d)]
+    if len(fit_state_files)==0: return None
+
+    return pd.concat([get_tab_as_df_or_empty_df(f) for f in fit_state_files]).set_index(["outdir_colonyzer", "Barcode", "Row", "Column"])[["log_K", "log_r", "log_g"]]
+
+def run_fitness_engine_python(outdirs_colonyzer, days_experiment, make_plots=True, log_params0=None):
+
+    """Python equivalent of get_fitness_measurements.R. For each dir of outdirs_colonyzer (with the qfa inputs of one plate), it writes processed_all_data.tbl, logRegression_fits.tbl and (if make_plots) output_plots.pdf. The logistic model is fit for all spots of all plates at once, warm-starting from log_params0 (see get_df_fitness_python) or, if not provided, from the fit_state.tab of a previous fit (i.e. with less images)."""
+
+    # get the growth of all plates
+    df_growth_all = pd.concat([get_df_growth_qfa_python(d).assign(outdir_colonyzer=d) for d in outdirs_colonyzer]).reset_index(drop=True)
+
+    # fit
+    if log_params0 is None: log_params0 = get_log_params_from_fit_state_files(outdirs_colonyzer)
+    df_fit_all = get_df_fitness_python(df_growth_all, days_experiment, log_params0=log_params0)
+
+    # write the outputs of each plate
+    for d in outdirs_colonyzer:
+        df_growth = df_growth_all[df_growth_all.outdir_colonyzer==d].drop(columns=["outdir_colonyzer"])
+        df_fit = df_fit_all[df_fit_all.outdir_colonyzer==d].drop(columns=["outdir_colonyzer", "log_K", "log_r", "log_g", "fit_iterations", "fit_flag"])
+
+        if make_plots is True: plot_growth_curves_one_plate_python(df_growth, df_fit, days_experiment, "%s/output_plots.pdf"%d)
+        save_df_as_tab(df_fit_all[df_fit_all.outdir_colonyzer==d][["outdir_colonyzer", "Barcode", "Row", "Column", "log_K", "log_r", "log_g", "fit_flag"]], "%s/fit_state.tab"%d)
+        save_df_as_tab(df_fit, "%s/logRegression_fits.tbl"%d)
+        save_df_as_tab(df_growth, "%s/processed_all_data.tbl"%d)
+
+def get_df_fitness_engine_parity(df_R, df_python, fitness_estimates):
+
+    """Takes the fits of one plate of the R and python engines (with 'Row', 'Column' and the fitness_estimates, and 'fit_flag' in df_python) and returns a df with the estimates of both engines and the relative difference of each spot. The '_merge' field indicates the spots that are missing in one of the engines."""
+
+    # merge, keeping the spots that are missing in one engine
+    df_parity = df_R[["Row", "Column"] + fitness_estimates].merge(df_python[["Row", "Column", "fit_flag"] + fitness_estimates], on=["Row", "Column"], how="outer", suffixes=("_R", "_python"), validate="one_to_one", indicator=True)
+    df_parity["_merge"] = df_parity["_merge"].astype(str)
+    df_parity["fit_flag"] = df_parity.fit_flag.fillna("")
+
+    # get the relative differences (0 if the values are equal, also for 0s, and NaN if any of them is NaN)
+    for fe in fitness_estimates:
+        values_R = df_parity["%s_R"%fe].values.astype(float)
+        values_python = df_parity["%s_python"%fe].values.astype(float)
+        with np.errstate(all="ignore"): df_parity["%s_rel_diff"%fe] = np.where(values_R==values_python, 0.0, np.abs(values_python - values_R) / np.abs(values_R))
+
+    return df_parity
+
+def check_fitness_engine_parity(df_parity, fitness_estimates, max_rel_diff=0.05):
+
+    """Takes the df of get_df_fitness_engine_parity (of all plates, with a 'plate' field) and raises an error if any spot is missing in one engine, if any estimate is NaN in only one engine or if, for any estimate, the relative difference of any spot is >max_rel_diff. All spots are compared, including the ones with a fit_flag (see get_fit_flags_qfa_checkSlow), and the spots with the largest differences are reported."""
+
+    # check that all spots are in both engines
+    missing_spots = df_parity[df_parity["_merge"]!="both"]
+    if len(missing_spots)>0: raise ValueError("These spots are not in both fitness engines:\n%s"%(missing_spots[["plate", "Row", "Column", "_merge"]].to_string(index=False)))
+
+    # report the spots replaced as in checkSlow
+    for fit_flag, df_f in df_parity[df_parity.fit_flag!=""].groupby("fit_flag"): print("There are %i/%i %s spots (fit replaced as in checkSlow of qfa.fit)"%(len(df_f), len(df_parity), fit_flag))
+
+    # check each estimate
+    bad_estimates = []
+    for fe in fitness_estimates:
+
+        # the NaNs should be the same
+        nan_mismatch = pd.isna(df_parity["%s_R"%fe])!=pd.isna(df_parity["%s_python"%fe])
+        if any(nan_mismatch): 
+            print("%s is NaN in only one engine in %i spots"%(fe, sum(nan_mismatch)))
+            bad_estimates.append(fe)
+            continue
+
+        # the relative differences of all spots should be small
+        df_fe = df_parity[~pd.isna(df_parity["%s_rel_diff"%fe])]
+        if len(df_fe)==0: continue
+        print("Maximum relative difference python vs R engine in %s: %.4f"%(fe, max(df_fe["%s_rel_diff"%fe])))
+
+        df_diverging = df_fe[df_fe["%s_rel_diff"%fe]>max_rel_diff].sort_values(by="%s_rel_diff"%fe, ascending=False)
+        if len(df_diverging)>0:
+            print("%s differs by >%s in %i spots. The most different are:\n%s"%(fe, max_rel_diff, len(df_diverging), df_diverging[["plate", "Row", "Column", "fit_flag", "%s_R"%fe, "%s_python"%fe, "%s_rel_diff"%fe]].head(10).to_string(index=False)))
+            bad_estimates.append(fe)
+
+    if len(bad_estimates)>0: raise ValueError("The python fitness engine does not match the R one for %s"%bad_estimates)
+
+fitness_estimates_engine_parity = ["K", "r", "g", "v", "nAUC", "nSTP", "nr", "nr_t", "maxslp", "MDR", "MDP", "MDRMDP", "DT", "AUC", "rsquare", "DT_h"] # the estimates compared between the fitness engines
+
+def get_df_fitness_engine_parity_plates(plate_to_R_dir, parity_dir, hours_experiment):
+
+    """Takes a dict that maps each plate to a dir with its qfa inputs and the logRegression_fits.tbl of get_fitness_measurements.R. It runs the python engine on a copy of the inputs in parity_dir and returns the df of get_df_fitness_engine_parity of all plates (with a 'plate' field)."""
+
+    # copy the inputs of each plate
+    delete_folder(parity_dir); make_folder(parity_dir)
+    plates = sorted(plate_to_R_dir)
+    for plate in plates:
+        make_folder("%s/%s"%(parity_dir, plate))
+        for f in ["all_images_data.dat", "ExptDescription.txt", "LibraryDescriptions.txt", "ORF2GENE.txt"]: copy_file("%s/%s"%(plate_to_R_dir[plate], f), "%s/%s/%s"%(parity_dir, plate, f))
+
+    # run the python engine
+    run_fitness_engine_python(["%s/%s"%(parity_dir, plate) for plate in plates], hours_experiment/24, make_plots=False)
+
+    # compare
+    table_parity = init_table()
+    for plate in plates:
+        df_R = get_tab_as_df_or_empty_df("%s/logRegression_fits.tbl"%plate_to_R_dir[plate])
+        df_python = get_tab_as_df_or_empty_df("%s/%s/logRegression_fits.tbl"%(parity_dir, plate)).merge(get_tab_as_df_or_empty_df("%s/%s/fit_state.tab"%(parity_dir, plate))[["Row", "Column", "fit_flag"]], on=["Row", "Column"], how="left", validate="one_to_one")
+        add_df_to_table(table_parity, get_df_fitness_engine_parity(df_R, df_python, fitness_estimates_engine_parity).assign(plate=plate))
+
+    return get_df_from_table(table_parity)
+
+def run_compare_fitness_engines(outdir, hours_experiment, max_rel_diff=0.05):
+
+    """Parity test of the python fitness engine. It runs the python engine on the qfa inputs of each plate in <outdir>/tmp/growth_calculations and compares the fitness estimates of each spot with the ones of get_fitness_measurements.R, writing <outdir>/extended_outputs/fitness_engine_parity.csv. It raises an error if the engines are different (see check_fitness_engine_parity)."""
+
+    # get the parity of all plates
+    outdir_growth_calculations = "%s/tmp/growth_calculations"%outdir
     outdir_name = "output_%s"%("_".join(sorted(parms_colonyzer)))
-    integrated_growth_df_file = "%s/%s/all_images_data.tab"%(outdir_all, outdir_name)
-    if file_is_empty(integrated_growth_df_file):
+    plate_to_R_dir = {d : "%s/%s/%s"%(outdir_growth_calculations, d, outdir_name) for d in os.listdir(outdir_growth_calculations) if not d.startswith(".")}
+    df_parity = get_df_fitness_engine_parity_plates(plate_to_R_dir, "%s/tmp/fitness_engine_parity"%outdir, hours_experiment)
+    save_df_as_tab(df_parity, "%s/extended_outputs/fitness_engine_parity.csv"%outdir)
 
-        ########## RUN COLONYZER #############
+    # check
+    check_fitness_engine_parity(df_parity, fitness_estimates_engine_parity, max_rel_diff=max_rel_diff)
 
-        # prepare dirs
-        make_folder(outdir_all)
+#####################################
 
-        # clean the hidden files from images_folder
-        for f in os.listdir(images_folder):
-            if f.startswith("."): remove_file("%s/%s"%(images_folder, f))
 
-        # move into the images dir
-        initial_dir = os.getcwd()
-        os.chdir(images_folder)
+def run_fitness_engine_R(outdirs_colonyzer, days_experiment, threads=1, make_plots=False):
 
-        # check 
-        if file_is_empty("./Colonyzer.txt"): raise ValueError("Colonyzer.txt should exist in %s"%images_folder)
+    """Runs get_fitness_measurements.R on all dirs of outdirs_colonyzer (with the qfa inputs of one plate each) in a single R session, forking across plates on threads. It writes processed_all_data.tbl, logRegression_fits.tbl and (if make_plots) output_plots.pdf into each dir."""
 
-        # define the image names that you expect
-        image_names_withoutExtension = set({x.split(".")[0] for x in sorted_image_names})
+    # write the plates that are in the fit cache (keyed by the R script and the qfa inputs, which define the growth curves, inocguess and detection threshold of each plate)
+    output_tables = ["logRegression_fits.tbl", "processed_all_data.tbl"] # processed_all_data.tbl is the last one, indicating that the plate is finished
+    outdir_to_fit_cache_key = {}
+    if fit_cache_dir is not None and make_plots is False:
 
-        # run colonyzer for all parameters
-        run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
+        outdir_to_fit_cache_key = {d : get_fit_cache_key("R", get_md5_file("%s/get_fitness_measurements.R"%ScriptsDir), days_experiment, *[get_md5_file("%s/%s"%(d, f)) for f in ["all_images_data.dat", "ExptDescription.txt", "LibraryDescriptions.txt", "ORF2GENE.txt"]]) for d in outdirs_colonyzer}
+        key_to_cached_tables = get_fit_cache_values(list(outdir_to_fit_cache_key.values()))
+        for d, key in outdir_to_fit_cache_key.items():
+            if key in key_to_cached_tables:
+                for f in output_tables:
+                    open("%s/%s.tmp"%(d, f), "wb").write(key_to_cached_tables[key][f])
+                    os.rename("%s/%s.tmp"%(d, f), "%s/%s"%(d, f))
 
-        # go back to the initial dir
-        os.chdir(initial_dir)
+        if len(key_to_cached_tables)>0: print_with_runtime("Using the cached fits of %i/%i plates"%(len([d for d in outdirs_colonyzer if outdir_to_fit_cache_key[d] in key_to_cached_tables]), len(outdirs_colonyzer)))
+        outdirs_colonyzer = [d for d in outdirs_colonyzer if outdir_to_fit_cache_key[d] not in key_to_cached_tables]
+        if len(outdirs_colonyzer)==0: return
 
-        ######################################
+    # write the plates into a file
+    plates_file = "%s.fitness_engine_R_plates.txt"%outdirs_colonyzer[0]
+    open(plates_file, "w").write("".join(["%s\n"%d for d in outdirs_colonyzer]))
 
-        ############ CREATE DAT FILE ##############
+    # run
+    fitness_measurements_std = "%s.fitness_measurements.std"%outdirs_colonyzer[0]
+    try: run_cmd("/workdir_app/scripts/get_fitness_measurements.R --plates_file %s %s %i %s > %s 2>&1"%(plates_file, days_experiment, threads, {True:"plots", False:"no_plots"}[make_plots], fitness_measurements_std), env="main_env")
+    except: raise ValueError("Error in get_fitness_measurements.R. This is the log:\n---\n%s\n---"%("".join(open(fitness_measurements_std, "r").readlines())))
 
-        # get the data path
-        data_path = "%s/%s/Output_Data"%(outdir_all, outdir_name)
+    # clean
+    for f in [plates_file, fitness_measurements_std]: remove_file(f)
 
-        # generate a df with fitness info of all images
-        all_df = pd.DataFrame()
+    # keep the tables in the fit cache
+    save_fit_cache_values({outdir_to_fit_cache_key[d] : {f : open("%s/%s"%(d, f), "rb").read() for f in output_tables} for d in outdirs_colonyzer if d in outdir_to_fit_cache_key})
 
-        for f in [x for x in os.listdir(data_path) if x.endswith(".dat")]: 
-            df = pd.read_csv("%s/%s"%(data_path, f), sep="\t", header=None)
-            all_df = all_df.append(df)
+def run_fitness_engine(fitness_engine, outdirs_colonyzer, days_experiment, threads=1, make_plots=False, log_params0=None):
 
-        # add barcode in the first place, instead of the filename
-        all_df[0] = get_barcode_for_filenames(all_df[0])
+    """Runs the fitting of growth curves on all dirs of outdirs_colonyzer with the fitness_engine ('R' or 'python'). The growth curve plots are only made if make_plots, as they are typically rendered afterwards by run_plot_growth_curves. log_params0 is used to warm-start the python engine."""
 
-        # sort the values
-        all_df = all_df.sort_values(by=[0,1,2])
+    if fitness_engine=="R": run_fitness_engine_R(outdirs_colonyzer, days_experiment, threads=threads, make_plots=make_plots)
+    elif fitness_engine=="python": run_fitness_engine_python(outdirs_colonyzer, days_experiment, make_plots=make_plots, log_params0=log_params0)
+    else: raise ValueError("invalid fitness_engine: %s"%fitness_engine)
 
-        # change the NaN by "NA"
-        def change_NaN_to_str(cell):
-            if pd.isna(cell): return "NA"
-            else: return cell
+def run_interim_fitness_measurements(outdir_colonyzer_to_plate, interim_fitness_hours, df_plate_layout, interim_fitness_dir):
 
-        all_df = all_df.applymap(change_NaN_to_str)
+    """Gets the fitness measurements with the images taken until each of interim_fitness_hours (in increasing order), as if the experiment had stopped there. The fits are done with the python engine, warm-starting each of them from the previous one. outdir_colonyzer_to_plate maps each dir with the qfa inputs of one plate to (plate_batch, plate). It writes <interim_fitness_dir>/fitness_measurements_<hours>h.csv and returns the log_params (see get_df_fitness_python) of the last interim fit, which can be used to warm-start the final fit."""
 
-        # use qfa to generate the df with growth
-        integrated_growth_df_dat_file = "%s/%s/all_images_data.dat"%(outdir_all, outdir_name)
-        all_df.to_csv(integrated_growth_df_dat_file, sep="\t", index=False, header=False)
+    # get the growth of all plates
+    df_growth_all = pd.concat([get_df_growth_qfa_python(d).assign(outdir_colonyzer=d) for d in sorted(outdir_colonyzer_to_plate)]).reset_index(drop=True)
+    spot_fields = ["outdir_colonyzer", "Barcode", "Row", "Column"]
 
-        ###########################################
+    # go through each time, appending images
+    log_params0 = None
+    for hours in sorted(interim_fitness_hours):
 
-        ######### CREATE EXTRA FIELDS ########
+        # fit the growth until hours
+        df_growth = df_growth_all[df_growth_all["Expt.Time"]<=(hours/24)]
+        if len(set(df_growth["Expt.Time"]))<4: raise ValueError("There should be at least 4 images in the first %g hours to get interim fitness measurements"%hours)
+        df_fit = get_df_fitness_python(df_growth, hours/24, log_params0=log_params0)
+        print_with_runtime("Interim fitness measurements at %g hours, with %i images. Mean iterations per spot: %.1f"%(hours, len(set(df_growth["Expt.Time"])), np.mean(df_fit.fit_iterations)))
 
-        # create the files that are necessary for the R qfa package to generate the output files
+        # keep the fit state for the next time
+        log_params0 = df_fit.set_index(spot_fields)[["log_K", "log_r", "log_g"]]
 
-        # keep the plate layout that is interesting here
-        df_plate_layout = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].set_index(["row", "column"])
+        # get the fitness measurements as in the final df_fitness_measurements
+        df_fit["plate_batch"] = df_fit.outdir_colonyzer.apply(lambda d: outdir_colonyzer_to_plate[d][0])
+        df_fit["plate"] = df_fit.outdir_colonyzer.apply(lambda d: outdir_colonyzer_to_plate[d][1])
+        df_fit = get_df_fitness_with_derived_spot_fields(df_fit.rename(columns={"Row":"row", "Column":"column"}))
+        df_fit["interim_hours"] = hours
 
-        # checks
-        if len(df_plate_layout[["drug", "concentration"]].drop_duplicates())!=1: raise ValueError("There should be only one plate and concentration")
-        drug = df_plate_layout.drug.iloc[0]
-        concentration = df_plate_layout.concentration.iloc[0]
+        merge_fields = ["plate_batch", "plate", "row", "column"]
+        df_fit = df_fit[merge_fields + ["spotID", "interim_hours", "K", "r", "g", "nAUC", "nSTP", "nr", "maxslp", "MDR", "MDP", "DT", "AUC", "rsquare", "DT_h", "DT_h_goodR2", "inv_DT_h_goodR2"]].merge(df_plate_layout, how="left", on=merge_fields, validate="one_to_one")
+        save_df_as_tab(df_fit, "%s/fitness_measurements_%gh.csv"%(interim_fitness_dir, hours))
 
-        # experiment descrption: file describing the inoculation times, library and plate number for unique plates. 
-        exp_df = pd.DataFrame()
+    return log_params0
 
-        # get all plates
-        for I, plateBarcode in enumerate(set([x.split("-")[0] for x in all_df[0]])): 
+def plot_growth_curves_one_plate_python_from_files(outdir_colonyzer, days_experiment):
 
-            startTime = min(all_df[all_df[0].apply(lambda x: x.startswith(plateBarcode))][0].apply(lambda y: "-".join(y.split("-")[1:])))
-            dict_data = {"Barcode":plateBarcode, "Start.Time":startTime, "Treatment": plate_batch, "Medium":"[%s]=%s"%(drug, concentration) ,"Screen":"screen", "Library":"strain", "Plate": plate, "RepQuad":1}
+    """Writes <outdir_colonyzer>/output_plots.pdf from the tables written by run_fitness_engine_python (processed_all_data.tbl may have been renamed to all_images_data.tab)."""
 
-            exp_df = exp_df.append(pd.DataFrame({k: {I+1 : v} for k, v in dict_data.items()}))
+    data_file = "%s/all_images_data.tab"%outdir_colonyzer
+    if file_is_empty(data_file): data_file = "%s/processed_all_data.tbl"%outdir_colonyzer
+    plot_growth_curves_one_plate_python(get_tab_as_df_or_empty_df(data_file), get_tab_as_df_or_empty_df("%s/logRegression_fits.tbl"%outdir_colonyzer), days_experiment, "%s/output_plots.pdf"%outdir_colonyzer)
 
-        # write
-        exp_df.to_csv("%s/%s/ExptDescription.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=True)
+def run_plot_growth_curves(fitness_engine, outdirs_colonyzer, days_experiment, threads=1):
 
-        # library description: where you state, for each plate (from 1, 2, 3 ... and as many plates defined in ExptDescription.Plate, the name and the ORF, if interestning)
-        lib_df = pd.DataFrame()
+    """Renders output_plots.pdf (one panel per spot) in each dir of outdirs_colonyzer, where run_fitness_engine was already run with the same fitness_engine. The plates are plotted in parallel on threads."""
 
-        # define the rows and cols
-        nWells_ro_NrowsNcols = {96:(8, 12)}
+    if fitness_engine=="R":
 
-        for barcode, plateID in exp_df[["Barcode", "Plate"]].values:
-            for row in range(1, nWells_ro_NrowsNcols[96][0]+1):
-                for col in range(1, nWells_ro_NrowsNcols[96][1]+1):
+        # write the plates into a file
+        plates_file = "%s.plot_growth_curves_R_plates.txt"%outdirs_colonyzer[0]
+        open(plates_file, "w").write("".join(["%s\n"%d for d in outdirs_colonyzer]))
 
-                    # get the strain
-                    strain = df_plate_layout.loc[(row, col), "strain"]
+        # run
+        plots_std = "%s.plot_growth_curves.std"%outdirs_colonyzer[0]
+        try: run_cmd("/workdir_app/scripts/get_fitness_measurements.R --plots_only %s %s %i > %s 2>&1"%(plates_file, days_experiment, threads, plots_std), env="main_env")
+        except: raise ValueError("Error in get_fitness_measurements.R --plots_only. This is the log:\n---\n%s\n---"%("".join(open(plots_std, "r").readlines())))
 
-                    # add to df
-                    dict_data = {"Library":"strain", "ORF":strain, "Plate":plateID, "Row":row, "Column":col, "Notes":""}
-                    lib_df = lib_df.append(pd.DataFrame({k: {plateID : v} for k, v in dict_data.items()}))
+        # clean
+        for f in [plates_file, plots_std]: remove_file(f)
 
-        # write
-        lib_df.to_csv("%s/%s/LibraryDescriptions.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=True)
+    elif fitness_engine=="python": run_function_in_parallel([(d, days_experiment) for d in outdirs_colonyzer], plot_growth_curves_one_plate_python_from_files)
+    else: raise ValueError("invalid fitness_engine: %s"%fitness_engine)
+
+def generate_growth_curves_plots(outdir, fitness_engine, hours_experiment):
+
+    """Generates <outdir>/extended_outputs/growth_curves/batch_<plate_batch>-plate<plate>.pdf for each plate in <outdir>/tmp/growth_calculations, rendering only the plates that are missing."""
+
+    # define dirs
+    outdir_growth_calculations = "%s/tmp/growth_calculations"%outdir
+    growth_curves_dir = "%s/extended_outputs/growth_curves"%outdir; make_folder(growth_curves_dir) # a dir with a plot for each growth curve
+
+    # define the plates that have no plots
+    plate_batch_and_plate_to_outdir_colonyzer = {}
+    for d in sorted([x for x in os.listdir(outdir_growth_calculations) if not x.startswith(".")]):
+        plate_batch, plate = d.split("_plate"); plate = int(plate)
+        if file_is_empty("%s/batch_%s-plate%i.pdf"%(growth_curves_dir, plate_batch, plate)): plate_batch_and_plate_to_outdir_colonyzer[(plate_batch, plate)] = "%s/%s/output_%s"%(outdir_growth_calculations, d, "_".join(sorted(parms_colonyzer)))
+
+    # render the missing plots
+    outdirs_colonyzer_missing = [d for d in plate_batch_and_plate_to_outdir_colonyzer.values() if file_is_empty("%s/output_plots.pdf"%d)]
+    if len(outdirs_colonyzer_missing)>0:
+        print_with_runtime("Plotting growth curves of %i plates on %i threads..."%(len(outdirs_colonyzer_missing), multiproc.cpu_count()))
+        run_plot_growth_curves(fitness_engine, outdirs_colonyzer_missing, hours_experiment/24, threads=multiproc.cpu_count())
+
+    # keep the growth curves in the final output
+    for (plate_batch, plate), outdir_colonyzer in plate_batch_and_plate_to_outdir_colonyzer.items(): copy_file("%s/output_plots.pdf"%outdir_colonyzer, "%s/batch_%s-plate%i.pdf"%(growth_curves_dir, plate_batch, plate))
+
+def generate_qfa_inputs_from_colonyzer_output(outdir_colonyzer, plate_batch, plate, df_plate_layout):
+
+    """Takes the colonyzer output in outdir_colonyzer for one plate and creates the inputs of the qfa package (all_images_data.dat, ExptDescription.txt, LibraryDescriptions.txt and ORF2GENE.txt), which are used by run_fitness_engine."""
+
+    ############ CREATE DAT FILE ##############
+
+    # get the data path
+    data_path = "%s/Output_Data"%outdir_colonyzer
+
+    # generate a df with fitness info of all images
+    table_all = init_table()
+    for f in [x for x in os.listdir(data_path) if x.endswith(".dat")]: add_df_to_table(table_all, pd.read_csv("%s/%s"%(data_path, f), sep="\t", header=None))
+    all_df = get_df_from_table(table_all)
+
+    # add barcode in the first place, instead of the filename
+    all_df[0] = get_barcode_for_filenames(all_df[0])
+
+    # sort the values
+    all_df = all_df.sort_values(by=[0,1,2])
+
+    # change the NaN by "NA"
+    def change_NaN_to_str(cell):
+        if pd.isna(cell): return "NA"
+        else: return cell
+
+    all_df = all_df.applymap(change_NaN_to_str)
+
+    # use qfa to generate the df with growth
+    integrated_growth_df_dat_file = "%s/all_images_data.dat"%outdir_colonyzer
+    all_df.to_csv(integrated_growth_df_dat_file, sep="\t", index=False, header=False)
+
+    ###########################################
+
+    ######### CREATE EXTRA FIELDS ########
+
+    # create the files that are necessary for the R qfa package to generate the output files
+
+    # keep the plate layout that is interesting here
+    df_plate_layout = df_plate_layout[(df_plate_layout.plate_batch==plate_batch) & (df_plate_layout.plate==plate)].set_index(["row", "column"])
+
+    # checks
+    if len(df_plate_layout[["drug", "concentration"]].drop_duplicates())!=1: raise ValueError("There should be only one plate and concentration")
+    drug = df_plate_layout.drug.iloc[0]
+    concentration = df_plate_layout.concentration.iloc[0]
+
+    # experiment descrption: file describing the inoculation times, library and plate number for unique plates. 
+    table_exp = init_table()
+
+    # get all plates
+    for plateBarcode in set([x.split("-")[0] for x in all_df[0]]): 
+
+        startTime = min(all_df[all_df[0].apply(lambda x: x.startswith(plateBarcode))][0].apply(lambda y: "-".join(y.split("-")[1:])))
+        add_row_to_table(table_exp, {"Barcode":plateBarcode, "Start.Time":startTime, "Treatment": plate_batch, "Medium":"[%s]=%s"%(drug, concentration) ,"Screen":"screen", "Library":"strain", "Plate": plate, "RepQuad":1})
+
+    exp_df = get_df_from_table(table_exp)
+
+    # write
+    exp_df.to_csv("%s/ExptDescription.txt"%outdir_colonyzer, sep="\t", index=False, header=True)
+
+    # library description: where you state, for each plate (from 1, 2, 3 ... and as many plates defined in ExptDescription.Plate, the name and the ORF, if interestning)
+    table_lib = init_table()
+
+    # define the rows and cols
+    nrows, ncols = get_plate_nrows_and_ncols()
 
-        # orf-to-gene to get the strains in the plot
-        orf_to_gene_df = pd.DataFrame({0:list(df_plate_layout.strain), 1:list(df_plate_layout.strain)})
-        orf_to_gene_df.to_csv("%s/%s/ORF2GENE.txt"%(outdir_all, outdir_name), sep="\t", index=False, header=False)
+    for barcode, plateID in exp_df[["Barcode", "Plate"]].values:
+        for row in range(1, nrows+1):
+            for col in range(1, ncols+1):
+
+                # get the strain
+                strain = df_plate_layout.loc[(row, col), "strain"]
+
+                # add to df
+                add_row_to_table(table_lib, {"Library":"strain", "ORF":strain, "Plate":plateID, "Row":row, "Column":col, "Notes":""})
+
+    # write
+    lib_df = get_df_from_table(table_lib)
+    lib_df.to_csv("%s/LibraryDescriptions.txt"%outdir_colonyzer, sep="\t", index=False, header=True)
+
+    # orf-to-gene to get the strains in the plot
+    orf_to_gene_df = pd.DataFrame({0:list(df_plate_layout.strain), 1:list(df_plate_layout.strain)})
+    orf_to_gene_df.to_csv("%s/ORF2GENE.txt"%outdir_colonyzer, sep="\t", index=False, header=False)
+
+    ######################################
+
+def get_growth_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_folder, outdir_all, plate_batch, plate, sorted_image_names, processed_images_dir_each_plate, reference_plate, df_plate_layout, hours_experiment, timepoint_subsampling="none", fitness_engine="R"):
+
+    """For one plate batch and plate, runs colonyzer to get raw growth measurements and the inputs of the fitness engine. The fitting of all plates is done afterwards by run_fitness_engine (except for 'adaptive_check', which needs the fits of this plate). timepoint_subsampling can be 'none' (all images are quantified), 'adaptive' (see run_colonyzer_adaptive_timepoint_subsampling) or 'adaptive_check' (like 'adaptive', also running a full-resolution analysis to report the drift of the fitness estimates)."""
+
+    print_with_runtime("Getting fitness measurements for plate_batch-plate %i/%i: %s-plate%i"%(Ibatch, nbatches, plate_batch, plate))
+
+    # define final file
+    outdir_name = "output_%s"%("_".join(sorted(parms_colonyzer)))
+    integrated_growth_df_file = "%s/%s/all_images_data.tab"%(outdir_all, outdir_name)
+    if file_is_empty(integrated_growth_df_file):
+
+        ########## RUN COLONYZER #############
+
+        # prepare dirs
+        make_folder(outdir_all)
+
+        # clean the hidden files from images_folder
+        for f in os.listdir(images_folder):
+            if f.startswith("."): remove_file("%s/%s"%(images_folder, f))
+
+        # move into the images dir
+        initial_dir = os.getcwd()
+        os.chdir(images_folder)
+
+        # check 
+        if file_is_empty("./Colonyzer.txt"): raise ValueError("Colonyzer.txt should exist in %s"%images_folder)
+
+        # define the image names that you expect
+        image_names_withoutExtension = set({x.split(".")[0] for x in sorted_image_names})
+
+        # run colonyzer for all parameters, on all images
+        if timepoint_subsampling=="none": run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_all, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
+
+        # run colonyzer on a subset of images
+        elif timepoint_subsampling in {"adaptive", "adaptive_check"}: run_colonyzer_adaptive_timepoint_subsampling(images_folder, outdir_all, sorted_image_names, processed_images_dir_each_plate, reference_plate)
+
+        else: raise ValueError("invalid timepoint_subsampling: %s"%timepoint_subsampling)
+
+        # go back to the initial dir
+        os.chdir(initial_dir)
 
         ######################################
 
-        ########### GET GROWTH DF ##########
+        ########### GET QFA INPUTS ##########
 
-        # generate the plots with R
-        fitness_measurements_std = "%s/fitness_measurements.std"%data_path
-        days_experiment = hours_experiment/24
-        try: run_cmd("/workdir_app/scripts/get_fitness_measurements.R %s %s > %s 2>&1"%("%s/%s"%(outdir_all, outdir_name), days_experiment, fitness_measurements_std), env="main_env")
-        except: raise ValueError("Error in get_fitness_measurements.R. This is the log:\n---\n%s\n---"%("".join(open(fitness_measurements_std, "r").readlines())))
-        remove_file(fitness_measurements_std)
+        generate_qfa_inputs_from_colonyzer_output("%s/%s"%(outdir_all, outdir_name), plate_batch, plate, df_plate_layout)
 
-        # keep
-        os.rename("%s/%s/processed_all_data.tbl"%(outdir_all, outdir_name), integrated_growth_df_file)
+        ####################################
+
+        ####### CHECK SUBSAMPLING ##########
+
+        # run the full-resolution analysis and compare the fitness estimates
+        if timepoint_subsampling=="adaptive_check":
+
+            # run colonyzer on all images
+            outdir_full_resolution = "%s/full_resolution_check"%outdir_all; make_folder(outdir_full_resolution)
+            os.chdir(images_folder)
+            run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_full_resolution, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
+            os.chdir(initial_dir)
+
+            # get fitness of both runs
+            generate_qfa_inputs_from_colonyzer_output("%s/%s"%(outdir_full_resolution, outdir_name), plate_batch, plate, df_plate_layout)
+            run_fitness_engine(fitness_engine, ["%s/%s"%(outdir_all, outdir_name), "%s/%s"%(outdir_full_resolution, outdir_name)], hours_experiment/24, make_plots=False)
+
+            # write the drift
+            df_drift = get_df_timepoint_subsampling_drift("%s/%s/logRegression_fits.tbl"%(outdir_all, outdir_name), "%s/%s/logRegression_fits.tbl"%(outdir_full_resolution, outdir_name), plate_batch, plate)
+            save_df_as_tab(df_drift, "%s/%s/timepoint_subsampling_drift.tab"%(outdir_all, outdir_name))
 
         ####################################
-    
+
+        # keep (if the fitting was done)
+        if not file_is_empty("%s/%s/processed_all_data.tbl"%(outdir_all, outdir_name)): os.rename("%s/%s/processed_all_data.tbl"%(outdir_all, outdir_name), integrated_growth_df_file)
 
 def get_df_integrated_fitness_measurements_one_plate_batch_and_plate(Ibatch, nbatches, images_folder, outdir_all, plate_batch, plate, sorted_image_names, df_plate_layout, processed_images_dir_each_plate, reference_plate):
 
@@ -1125,7 +2094,43 @@ def check_no_nans_series(x):
 
     """Raise value error if nans"""
 
-    if any(pd.isna(x)): raise ValueError("There can't be nans in series %s"%x)
+    if np.any(pd.isna(x)): raise ValueError("There can't be nans in series %s"%x)
+
+
+####### SCHEMA VALIDATION #######
+
+def validate_df_schema(df, schema, table_name, unique_fields=None, sorted_fields=None):
+
+    """Checks that df follows schema, a dict that maps each field to a dict of rules: 'kind' (a string with the allowed numpy dtype kinds, like 'if'), 'nan' (False if NaNs are not allowed), 'inf' (False if infs are not allowed) and 'min' (the minimum allowed value). unique_fields is a list of fields whose combination should be unique, and sorted_fields a list of fields by which df should be sorted. Each check is one vectorized pass over a column, and all the violations are reported in one ValueError. Nothing is checked in trusted_mode."""
+
+    if trusted_mode is True: return
+
+    # get the violations
+    violations = []
+    for field, rules in schema.items():
+
+        if field not in df.keys(): 
+            violations.append("%s is missing"%field)
+            continue
+
+        values = df[field].values
+        is_numeric = values.dtype.kind in "biuf"
+
+        if "kind" in rules and values.dtype.kind not in rules["kind"]: violations.append("%s has dtype %s, and it should be of kind '%s'"%(field, values.dtype, rules["kind"]))
+        if rules.get("nan", True) is False and np.any(pd.isna(values)): violations.append("%s has %i NaNs"%(field, np.sum(pd.isna(values))))
+        if rules.get("inf", True) is False and is_numeric and np.any(np.isinf(values)): violations.append("%s has %i infs"%(field, np.sum(np.isinf(values))))
+        if "min" in rules and is_numeric and np.any(values<rules["min"]): violations.append("%s has %i values <%s"%(field, np.sum(values<rules["min"]), rules["min"]))
+
+    for fields in [unique_fields, sorted_fields]:
+        if fields is not None: violations += ["%s is missing"%f for f in fields if f not in df.keys() and f not in schema]
+
+    if unique_fields is not None and all([f in df.keys() for f in unique_fields]) and any(df.duplicated(subset=unique_fields)): violations.append("there are %i duplicated %s"%(sum(df.duplicated(subset=unique_fields)), "-".join(unique_fields)))
+    if sorted_fields is not None and all([f in df.keys() for f in sorted_fields]) and not df[sorted_fields].sort_values(by=sorted_fields, kind="mergesort").index.equals(df.index): violations.append("the table is not sorted by %s"%("-".join(sorted_fields)))
+
+    # report
+    if len(violations)>0: raise ValueError("The %s table is not valid:\n%s"%(table_name, "\n".join(["- %s"%v for v in violations])))
+
+#################################
 
 
 def copy_file(origin_file, dest_file):
@@ -1143,43 +2148,40 @@ def get_fitness_df_with_relativeFitnessEstimates(fitness_df, fitness_estimates):
 
     """This function adds a set of *_rel fields to fitness_df, which are, for each condition, the fitness relative to the concentration==0 spot."""
 
-    # correct the fitness estimates to avoid NaNs, 0s and infs
-    fitEstimate_to_maxNoNInf = {fe : max(fitness_df[fitness_df[fe]!=np.inf][fe]) for fe in fitness_estimates}
-
-    def get_correct_val(x, fitness_estimate):
-        
-        if x==np.inf: return fitEstimate_to_maxNoNInf[fitness_estimate]
-        elif x!=np.nan and type(x)==float: return x
-        else: raise ValueError("%s is not a valid %s"%(x, fitness_estimate))
-        
+    # correct the fitness estimates to avoid infs (replaced by the maximum non-inf value). Only float estimates are valid
     for fe in fitness_estimates: 
-        
-        # get the non nan and non inf vals
-        fitness_df[fe] = fitness_df[fe].apply(lambda x: get_correct_val(x, fe))
-        
+
+        # check that the values are floats
+        if fitness_df[fe].dtype.kind!="f": raise ValueError("%s should be a float field, and it is %s"%(fe, fitness_df[fe].dtype))
+
+        # replace the infs
+        values = fitness_df[fe].values.astype(float)
+        idx_inf = values==np.inf
+        if any(idx_inf): values = np.where(idx_inf, fitness_df[fe][~idx_inf].max(), values)
+
         # add a pseudocount that is equivalent to the minimum, if there are any negative values
-        if any(fitness_df[fe]<0): 
+        idx_negative = values<0
+        if any(idx_negative): 
             print_with_runtime("WARNING: There are some negative values in %s, modifying the data with a pseudocount"%fe)
-            fitness_df[fe] = fitness_df[fe] + abs(min(fitness_df[fitness_df[fe]<0][fe]))    
-
-    # define a df with the maximum growth rate (the one at concentration==0) for each combination of sampleID. Note that there is one baseline for all drugs
-    df_max_gr = fitness_df[fitness_df.concentration==0.0].set_index("sampleID", drop=False)[fitness_estimates]
-    all_sampleIDs = set(df_max_gr.index)
-    fitEstimate_to_sampleID_to_maxValue = {fe : {sampleID : df_max_gr.loc[sampleID, fe] for sampleID in all_sampleIDs} for fe in fitness_estimates}
+            values = values + abs(min(values[idx_negative]))
 
-    # add the relative fitness estimates
-    fitness_estimates_rel = ["%s_rel"%x for x in fitness_estimates]
+        fitness_df[fe] = values
 
-    def get_btw_0_and_1(x):
-            
-        if pd.isna(x): return 1.0
-        elif x==np.inf: return 1.0
-        elif x==-np.inf: return 0.0
-        elif x<0: raise ValueError("there can't be any negative values")
-        else: return x  
+    # get, for each spot, the maximum growth (the one at concentration==0) of its sample (sample_code). Note that there is one baseline for all drugs
+    df_max_gr = fitness_df[fitness_df.concentration==0.0].set_index("sample_code")[fitness_estimates]
+    if any(df_max_gr.index.duplicated()): raise ValueError("There should be one concentration==0 spot for each sampleID")
+    if not all(fitness_df.sample_code.isin(df_max_gr.index)): raise ValueError("There are some sampleIDs without a concentration==0 spot")
+    baseline_values = df_max_gr.loc[fitness_df.sample_code, fitness_estimates].values
 
+    # add the relative fitness estimates (the NaNs and infs are 1, and the -infs are 0)
     np.seterr(divide='ignore', invalid="ignore")
-    fitness_df[fitness_estimates_rel] = fitness_df.apply(lambda r: pd.Series({"%s_rel"%fe : get_btw_0_and_1(np.divide(r[fe], fitEstimate_to_sampleID_to_maxValue[fe][r["sampleID"]])) for fe in fitness_estimates}), axis=1)
+    rel_values = np.divide(fitness_df[fitness_estimates].values, baseline_values)
+    rel_values[pd.isna(rel_values) | (rel_values==np.inf)] = 1.0
+    rel_values[rel_values==-np.inf] = 0.0
+    if np.any(rel_values<0): raise ValueError("there can't be any negative values")
+
+    fitness_estimates_rel = ["%s_rel"%x for x in fitness_estimates]
+    for Ife, fe_rel in enumerate(fitness_estimates_rel): fitness_df[fe_rel] = rel_values[:,Ife]
 
     return fitness_df
 
@@ -1348,6 +2350,111 @@ def get_AUC_for_EUCASTreplicate(df, fitness_estimate, concs_info, concentration_
     return auc
 
 
+def get_sample_by_concentration_arrays(fitness_df_d, fields, sorted_concentrations):
+
+    """Takes the fitness df of one drug and returns the sorted sampleIDs, a dict that maps each field to a samples x sorted_concentrations array and a boolean array of the assayed concentrations of each sample"""
+
+    # checks
+    if any(fitness_df_d[["sampleID", "concentration"]].duplicated()): raise ValueError("the concentration should be unique for each sampleID")
+
+    # the columns of the arrays should be increasing concentrations, as the MIC, SMG and rAUC arrays (get_MIC_array, get_SMG_array and get_rAUC_array) take the first, previous and next concentrations by position
+    validate_df_schema(pd.DataFrame({"concentration":sorted_concentrations}), {"concentration":{"kind":"if", "nan":False, "inf":False, "min":0}}, "sorted concentrations", unique_fields=["concentration"], sorted_fields=["concentration"])
+
+    # pivot all fields at once (with a field that indicates which concentrations were assayed)
+    df_pivot = fitness_df_d[["sampleID", "concentration"] + fields].astype({f:float for f in fields}).assign(assayed=1.0).set_index(["sampleID", "concentration"]).unstack("concentration")
+
+    sampleIDs = np.array(df_pivot.index)
+    field_to_values = {f : df_pivot[f].reindex(columns=sorted_concentrations).values for f in fields}
+    assayed = ~pd.isna(df_pivot["assayed"].reindex(columns=sorted_concentrations).values)
+
+    return sampleIDs, field_to_values, assayed
+
+def get_MIC_array(rel_values, assayed, sorted_concentrations, fitness_estimate, mic_fraction):
+
+    """Array version of get_MIC_for_EUCASTreplicate. It takes a samples x sorted_concentrations array of relative fitness values (and a boolean array of the assayed concentrations) and returns the MIC of each sample, with the same rules for missing data"""
+
+    concentrations = np.array(sorted_concentrations)
+    nconcs = len(concentrations)
+    Iconcs = np.arange(nconcs)
+
+    # get the first assayed concentration with a fitness below 1-mic_fraction
+    idx_below_fraction = assayed & (rel_values<(1-mic_fraction))
+    has_mic = np.any(idx_below_fraction, axis=1)
+    I_mic = np.argmax(idx_below_fraction, axis=1)
+    mic = concentrations[I_mic]
+
+    # get the last assayed concentration before the mic
+    idx_before_mic = assayed & (Iconcs<np.expand_dims(I_mic, 1))
+    has_conc_before_mic = np.any(idx_before_mic, axis=1)
+    I_before_mic = nconcs - 1 - np.argmax(idx_before_mic[:,::-1], axis=1)
+
+    # define the real mic according to missing data (same as get_MIC_for_EUCASTreplicate)
+    mic_with_conc_before = np.where(np.abs(concentrations[I_before_mic]-concentrations[I_mic-1])>=0.001, np.nan, mic)
+    mic_without_conc_before = np.where(mic==concentrations[1], mic, np.where(mic==0.0, 0.001, np.nan))
+    mic_found = np.where(has_conc_before_mic, mic_with_conc_before, mic_without_conc_before)
+    mic_not_found = np.where(assayed[:,-1], concentrations[-1]*2, np.nan)
+    real_mic = np.where(has_mic, mic_found, mic_not_found)
+
+    if np.any(real_mic==0): raise ValueError("mic can't be 0. Check how you calculate %s"%fitness_estimate)
+
+    return real_mic
+
+def get_SMG_array(raw_values, assayed, MICs, sorted_concentrations, raw_fitness_estimate, mic_fraction, sampleIDs, spotIDs_conc0):
+
+    """Array version of get_SMG_for_EUCASTreplicate. It takes a samples x sorted_concentrations array of raw fitness values and the MIC of each sample, and returns the supra-MIC growth of each sample"""
+
+    # only samples with MIC have SMG
+    idx_mic = ~pd.isna(MICs)
+    if np.any(idx_mic & ~assayed[:,0]): raise ValueError("there should be only 1 row in df_conc0")
+
+    # check the fitness at conc0
+    fitness_conc0 = raw_values[:,0]
+    idx_wrong_conc0 = idx_mic & (pd.isna(fitness_conc0) | (fitness_conc0<=0) | (fitness_conc0==np.inf) | (fitness_conc0==-np.inf))
+    if np.any(idx_wrong_conc0):
+        I = np.where(idx_wrong_conc0)[0][0]
+        mic_string = "sampleID=%s|raw_fitness_estimate=%s|MIC_%.2f"%(sampleIDs[I], raw_fitness_estimate, mic_fraction)
+        raise ValueError("\n\nDuring the calculation of SMG for %s we found a problem. The fitness (%s) in concentration==0 is %s, which  means that SMG cannot be calculated. This either reflects a problem with this sample, or that some parameters are not properly set. There are two things to consider:\n\n- If you want to remove this spot, you may flag it's concentration==0 spot (%s) as a 'bad spot' in the plate layout excel.\n\n- If this %s at concentration==0 is 0.0 it suggests that the threshold min_nAUC_to_beConsideredGrowing may not be properly set. Q-PHAST automatically discards samples that do not grow at concentration==0 (i.e. they have an nAUC below min_nAUC_to_beConsideredGrowing). If you are getting this error it is because %s=0.0, but the spot has a sufficiently high nAUC to be considered growing. Some spots may have a very low nAUC, passing a too low min_nAUC_to_beConsideredGrowing threshold, but still have 0.0 values by other fitness estimates (%s in this case). It this is the case, you may set a higher min_nAUC_to_beConsideredGrowing threshold, and run again the pipeline."%(mic_string, raw_fitness_estimate, fitness_conc0[I], spotIDs_conc0[I], raw_fitness_estimate, raw_fitness_estimate, raw_fitness_estimate))
+
+    # get the mean fitness (skipping NaNs) of the assayed concentrations above MIC, for samples with at least 2 of them
+    np.seterr(divide='ignore', invalid="ignore")
+    idx_after_mic = assayed & (np.array(sorted_concentrations)>np.expand_dims(MICs, 1))
+    idx_after_mic_values = idx_after_mic & ~pd.isna(raw_values)
+    mean_fitness_after_mic = np.sum(np.where(idx_after_mic_values, raw_values, 0.0), axis=1) / np.sum(idx_after_mic_values, axis=1)
+
+    return np.where(idx_mic & (np.sum(idx_after_mic, axis=1)>=2), mean_fitness_after_mic/fitness_conc0, np.nan)
+
+def get_rAUC_array(rel_values, assayed, is_growing, sorted_concentration_values, fitness_estimate, min_points_to_calculate_auc=4):
+
+    """Array version of get_AUC_for_EUCASTreplicate. It takes a samples x concentrations array of relative fitness values, the assayed concentrations and whether each spot is growing, and returns the trapezoidal AUC (relative to the maximum one) of each sample. sorted_concentration_values are the values of the concentrations (i.e. concentration or log2_concentration)"""
+
+    x = np.array(sorted_concentration_values)
+    nconcs = len(x)
+    Isamples = np.arange(len(rel_values))
+
+    # when the max conc is not assayed and the last assayed one is growing, the auc is not calculated
+    I_last_assayed = nconcs - 1 - np.argmax(assayed[:,::-1], axis=1)
+    idx_discarded = ~assayed[:,-1] & (is_growing[Isamples, I_last_assayed]==1)
+
+    # define the points of the curve, which always start at the first concentration (with a fitness of 1 if it is not assayed)
+    idx_points = assayed.copy()
+    idx_points[:,0] = True
+    y = rel_values.copy()
+    y[:,0] = np.where(assayed[:,0], rel_values[:,0], 1.0)
+
+    # get the area of each trapezoid between each point and the previous one
+    I_previous_point = np.maximum.accumulate(np.where(idx_points, np.arange(nconcs), 0), axis=1)[:,:-1]
+    areas = (x[1:]-x[I_previous_point]) * (y[:,1:]+np.take_along_axis(y, I_previous_point, axis=1)) / 2.0
+    auc = np.sum(np.where(idx_points[:,1:], areas, 0.0), axis=1) / ((x[-1]-x[0])*1)
+
+    # define the auc according to the missing data (same as get_AUC_for_EUCASTreplicate)
+    idx_all0 = np.all(~assayed | (rel_values==0.0), axis=1)
+    auc = np.where(np.sum(assayed, axis=1)<min_points_to_calculate_auc, np.nan, np.where(idx_all0, 0.0, np.where(idx_discarded, np.nan, auc)))
+
+    if np.any(auc<0.0): raise ValueError("auc can't be 0. Check how you calculate %s"%fitness_estimate)
+
+    return auc
+
+
 def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate_auc, filename, experiment_name):
 
     """
@@ -1357,8 +2464,8 @@ def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate
 
     if file_is_empty(filename):
 
-        # init the df that will contain the susceptibility estimates
-        df_all = pd.DataFrame()
+        # init the table that will contain the susceptibility estimates
+        table_all = init_table()
 
         # keep
         fitness_df = cp.deepcopy(fitness_df)
@@ -1368,8 +2475,7 @@ def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate
             #print_with_runtime("getting susceptibility estimates for %s"%drug)
 
             # get the df for this drug, adding also the concentration==0 with this drug for normalization
-            fitness_df_d = fitness_df[(fitness_df.drug==drug) | (fitness_df.concentration==0.0)]
-            fitness_df_d["drug"] = drug
+            fitness_df_d = fitness_df[(fitness_df.drug==drug) | (fitness_df.concentration==0.0)].assign(drug=drug)
 
             # define the sorted_concentrations, and only continue if there are >=3
             sorted_concentrations = sorted(set(fitness_df_d.concentration))
@@ -1377,76 +2483,49 @@ def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate
                 print_with_runtime("WARNING: For drug=%s there are only %i concentrations. Skipping the susceptibility analysis since it needs >=3 concentrations (including 0)."%(drug, len(sorted_concentrations)))
                 continue
 
-            # define the log2_concentration
+            # define the log2 of the expected concentrations
             pseudocount_log2_concentration = sorted_concentrations[1]/2
-            fitness_df_d["log2_concentration"] = np.log2(fitness_df_d.concentration + pseudocount_log2_concentration)
-
-            # map each drug to the expected concentrations
-            concentrations_dict = {"max_conc":max(sorted_concentrations), "zero_conc":sorted_concentrations[0], "first_conc":sorted_concentrations[1], "conc_to_previous_conc":{c:sorted_concentrations[I-1] for I,c in enumerate(sorted_concentrations) if I>0}}
-
             sorted_log2_concentrations = [np.log2(c + pseudocount_log2_concentration) for c in sorted_concentrations]
-            concentrations_dict_log2 = {"max_conc":max(sorted_log2_concentrations), "zero_conc":sorted_log2_concentrations[0], "first_conc":sorted_log2_concentrations[1], "conc_to_previous_conc":{c:sorted_log2_concentrations[I-1] for I,c in enumerate(sorted_log2_concentrations) if I>0}}
-
 
             # filter out unsuited spots for relative fitness purposes
             fitness_df_d = fitness_df_d[fitness_df_d.idx_correct_rel_estimates]
             if len(fitness_df_d)==0: raise ValueError("There should be some rows in fitness_df_d. If this is not the case it may be because there are no correct spots in drug=%s"%drug)
 
-            # go through all the relative fitness estimates
+            # map each sampleID to the plate_batch, plate, row, column
+            sampleID_to_spotID_conc0 = fitness_df_d[fitness_df_d.concentration==0].set_index("sampleID").spotID
+            number_to_letter = dict(zip(range(1, get_plate_nrows_and_ncols()[0]+1), get_plate_row_letters()))
+            sampleID_to_spotID_conc0 = sampleID_to_spotID_conc0.apply(lambda x: "plate_batch=%s, plate=%i, row=%s, column=%s"%(x[0], x[1], number_to_letter[x[2]], x[3]))
+
+            if len(sampleID_to_spotID_conc0)!=len(set(sampleID_to_spotID_conc0.index)):
+                raise ValueError("the sampleID should be unique")
+
+            # get, for all fitness estimates, the samples x concentrations arrays of this drug
             relative_fitness_estimates = ["%s_rel"%f for f in fitness_estimates]
+            sampleIDs, field_to_values, assayed = get_sample_by_concentration_arrays(fitness_df_d, relative_fitness_estimates + list(fitness_estimates) + ["is_growing"], sorted_concentrations)
+            spotIDs_conc0 = sampleID_to_spotID_conc0.reindex(sampleIDs).values
+
+            # go through all the relative fitness estimates
             for fitness_estimate in relative_fitness_estimates:
 
                 # get the raw_fitness_estimate
                 raw_fitness_estimate = fitness_estimate.replace("_rel", "")
                 if "%s_rel"%raw_fitness_estimate!=fitness_estimate: raise ValueError("invalid fe")
 
-                # define a grouped df, where each index is a unique sample ID
-                grouped_df = fitness_df_d[["sampleID", "concentration", "is_growing", "log2_concentration", fitness_estimate, raw_fitness_estimate]].sort_values(by=["sampleID", "concentration"]).groupby("sampleID")
-
-                # map each sampleID to the plate_batch, plate, row, column
-                sampleID_to_spotID_conc0 = fitness_df_d[fitness_df_d.concentration==0].set_index("sampleID").spotID
-                number_to_letter = dict(zip(range(1,9), list("ABCDEFGH")))
-                sampleID_to_spotID_conc0 = sampleID_to_spotID_conc0.apply(lambda x: "plate_batch=%s, plate=%i, row=%s, column=%s"%(x[0], x[1], number_to_letter[x[2]], x[3]))
-
-                if len(sampleID_to_spotID_conc0)!=len(set(sampleID_to_spotID_conc0.index)):
-                    raise ValueError("the sampleID should be unique")
-
-                sampleID_to_spotID_conc0 = dict(sampleID_to_spotID_conc0)
-
                 # init a df with the MICs and AUCs for this concentration and fitness_estimate
-                df_f = pd.DataFrame()
+                df_f = pd.DataFrame(index=pd.Index(sampleIDs, name="sampleID"))
 
-                # add MIC:
+                # add MIC and SMG
                 for mic_fraction in [0.25, 0.5, 0.75, 0.9]:
-
-                    # add MIC
                     mic_field = "MIC_%i"%(mic_fraction*100)
-                    df_f[mic_field] = grouped_df.apply(lambda x: get_MIC_for_EUCASTreplicate(x, fitness_estimate, concentrations_dict, mic_fraction))
-
-                    # print warnings of MIC==nan
-                    #df_nan_mic = df_f[pd.isna(df_f[mic_field])]
-                    #if len(df_nan_mic)>0: print_with_runtime("WARNING: In drug=%s and fitness estimate=%s, there are %i spots where we could not calculate %s. This is be due to missing spots in some concentration."%(drug, fitness_estimate, len(df_nan_mic), mic_field))
-
-                    # add SMG
-                    sample_to_mic = dict(df_f[mic_field]) 
-                    smg_field = "SMG_MIC_%i"%(mic_fraction*100)
-                    df_f[smg_field] = grouped_df.apply(lambda x: get_SMG_for_EUCASTreplicate(x, raw_fitness_estimate, sample_to_mic[x.name], mic_fraction, sampleID_to_spotID_conc0[x.name]))
-
-                    # print warnings of SMG==nan
-                    #df_nan_smg = df_f[pd.isna(df_f[smg_field])]
-                    #if len(df_nan_smg)>0: print_with_runtime("WARNING: In drug=%s and fitness estimate=%s, there are %i spots where we could not calculate %s. This is due to missing spots in some concentration, or because there are <2 concentrations >MIC."%(drug, fitness_estimate, len(df_nan_smg), smg_field))
+                    df_f[mic_field] = get_MIC_array(field_to_values[fitness_estimate], assayed, sorted_concentrations, fitness_estimate, mic_fraction)
+                    df_f["SMG_MIC_%i"%(mic_fraction*100)] = get_SMG_array(field_to_values[raw_fitness_estimate], assayed, df_f[mic_field].values, sorted_concentrations, raw_fitness_estimate, mic_fraction, sampleIDs, spotIDs_conc0)
 
                 # add the rAUC for log2 or not of the concentrations
-                for conc_estimate, conc_info_dict in [("concentration", concentrations_dict), ("log2_concentration", concentrations_dict_log2)]:
-
-                    # get a series that map each sampleID to the AUC 
-                    df_f["rAUC_%s"%conc_estimate] = grouped_df.apply(lambda x: get_AUC_for_EUCASTreplicate(x, fitness_estimate, conc_info_dict, conc_estimate, min_points_to_calculate_auc=min_points_to_calculate_auc))
+                for conc_estimate, sorted_concentration_values in [("concentration", sorted_concentrations), ("log2_concentration", sorted_log2_concentrations)]:
+                    df_f["rAUC_%s"%conc_estimate] = get_rAUC_array(field_to_values[fitness_estimate], assayed, field_to_values["is_growing"], sorted_concentration_values, fitness_estimate, min_points_to_calculate_auc=min_points_to_calculate_auc)
 
                 # add the raw fitness of conc==0
-                df_conc0 = fitness_df_d[(fitness_df_d["concentration"]==0.0)]
-                sample_to_fitness0 = dict(df_conc0[["sampleID", raw_fitness_estimate]].drop_duplicates().set_index("sampleID")[raw_fitness_estimate])
-                df_f["raw_fitness_conc0"] = list(map(lambda x: sample_to_fitness0[x], df_f.index))
-                check_no_nans_series(df_f["raw_fitness_conc0"])
+                df_f["raw_fitness_conc0"] = field_to_values[raw_fitness_estimate][:,0]
 
                 # keep df
                 df_f = df_f.merge(fitness_df_d[["sampleID", "strain", "replicateID", "row", "column"]].set_index("sampleID").drop_duplicates(),  left_index=True, right_index=True, how="left",  validate="one_to_one")
@@ -1454,10 +2533,12 @@ def get_susceptibility_df(fitness_df, fitness_estimates, min_points_to_calculate
                 df_f["drug"] = drug
                 df_f["max_concentration"] = max(sorted_concentrations)
                 df_f["fitness_estimate"] = fitness_estimate
-                df_all = df_all.append(df_f).reset_index(drop=True)
+                add_df_to_table(table_all, df_f)
+
+        df_all = get_df_from_table(table_all, reset_index=True)
 
         # checks 
-        for k in set(df_all.keys()).difference({"MIC_25", "MIC_50", "MIC_75", "MIC_90", "SMG_MIC_25", "SMG_MIC_50", "SMG_MIC_75", "SMG_MIC_90", "rAUC_concentration", "rAUC_log2_concentration"}): check_no_nans_series(df_all[k])
+        validate_df_schema(df_all, {k : {"nan":False} for k in set(df_all.keys()).difference({"MIC_25", "MIC_50", "MIC_75", "MIC_90", "SMG_MIC_25", "SMG_MIC_50", "SMG_MIC_75", "SMG_MIC_90", "rAUC_concentration", "rAUC_log2_concentration"})}, "susceptibility measurements", unique_fields=["drug", "fitness_estimate", "strain", "replicateID"])
 
         # add exp name
         df_all["experiment_name"] = experiment_name
@@ -1562,15 +2643,17 @@ def get_row_simple_susceptibility_df_one_strain_and_drug(df):
 
 def get_plate_quadrant(r):
 
-    """Takes a row and col and returns the quadrant 1, 2, 3, 4"""
+    """Takes a row and col and returns the quadrant 1, 2, 3, 4 (of the plate_format)"""
+
+    nrows, ncols = get_plate_nrows_and_ncols()
 
-    if r.column in set(range(1,7)):
-        if r.row in set(range(1,5)): quadrant = 1
-        elif r.row in set(range(5,9)): quadrant = 3
+    if r.column in set(range(1, int(ncols/2)+1)):
+        if r.row in set(range(1, int(nrows/2)+1)): quadrant = 1
+        elif r.row in set(range(int(nrows/2)+1, nrows+1)): quadrant = 3
 
-    elif r.column in set(range(7,13)):
-        if r.row in set(range(1,5)): quadrant = 2
-        elif r.row in set(range(5,9)): quadrant = 4
+    elif r.column in set(range(int(ncols/2)+1, ncols+1)):
+        if r.row in set(range(1, int(nrows/2)+1)): quadrant = 2
+        elif r.row in set(range(int(nrows/2)+1, nrows+1)): quadrant = 4
 
     return quadrant
 
@@ -1699,9 +2782,12 @@ def plot_heatmap_susceptibility(susceptibility_df, plots_dir_all, fitness_estima
     susceptibility_df["log10_MIC_50"] = np.log10(susceptibility_df.MIC_50)
     if any(pd.isna(susceptibility_df["log10_MIC_50"])!=pd.isna(susceptibility_df["MIC_50"])): raise ValueError("The MICs are not NaN in a consistent way")
 
+    # log
+    print_with_runtime("Plotting susceptibility heatmaps (%s)..."%(type_measurements_susc))
+
     # make one plot for each drug and fitness_estimate
+    inputs_fn = []
     for drug in all_drugs:
-        print_with_runtime("Plotting susceptibility heatmaps for drug=%s..."%(drug))
 
         relative_fitness_estimates = ["%s_rel"%f for f in fitness_estimates]
         for fitness_estimate in relative_fitness_estimates:
@@ -1711,159 +2797,187 @@ def plot_heatmap_susceptibility(susceptibility_df, plots_dir_all, fitness_estima
             filename = "%s/%s_susceptibility_heatmap_by_%s.pdf"%(plots_dir, drug, fitness_estimate.replace("_rel", ""))
             filename_no_clustering = "%s/%s_susceptibility_heatmap_by_%s.no_clustering.pdf"%(plots_dir, drug, fitness_estimate.replace("_rel", ""))
 
-            for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
+            # add the inputs of both heatmaps, with the dataframe for this fe and drug
+            if file_is_empty(filename) or file_is_empty(filename_no_clustering): inputs_fn.append((susceptibility_df[(susceptibility_df.fitness_estimate==fitness_estimate) & (susceptibility_df.drug==drug)], filename, filename_no_clustering, drug, fitness_estimate, experiment_name, min_nAUC_to_beConsideredGrowing, type_measurements_susc))
 
-                if file_is_empty(file):
+    # run in parallel
+    if len(inputs_fn)>0: run_plotting_function_in_parallel(inputs_fn, plot_heatmap_susceptibility_one_drug_and_fitness_estimate)
+
+def get_df_zscore_heatmap_susceptibility(df_plot_nonans):
 
-                    # get dataframe for this fe and drug
-                    susceptibility_df_d_fe = susceptibility_df[(susceptibility_df.fitness_estimate==fitness_estimate) & (susceptibility_df.drug==drug)]
+    """Returns the z-score of each column of df_plot_nonans (0 for constant columns), which is used to cluster the strains in the susceptibility heatmaps"""
 
-                    # get the simplified susceptibility_df, with one strain for eacg
-                    simple_susceptibility_df = susceptibility_df_d_fe.groupby(["strain"]).apply(get_row_simple_susceptibility_df_one_strain_and_drug).reset_index(drop=True)
+    df_plot_nonans_zscore = pd.DataFrame(index=df_plot_nonans.index)
+    for col in df_plot_nonans.columns:
+        if len(df_plot_nonans[col].unique()) == 1: df_plot_nonans_zscore[col] = 0
+        else: df_plot_nonans_zscore[col] = scipy.stats.zscore(df_plot_nonans[col])
 
-                    # define the fields based on type_measurements_susc
-                    if type_measurements_susc=="raw":
-                        susceptibility_fileds = ["median_rAUC", "median_MIC50", "median_SMG-MIC50"]
-                        estimate_to_real_estimate = {"rAUC":"rAUC", "MIC50":"MIC50", "SMG-MIC50":"SMG-MIC50"}
+    return df_plot_nonans_zscore
 
-                    elif type_measurements_susc=="log":
-                        susceptibility_fileds = ["median_rAUC_log2", "median_MIC50_log10", "median_SMG-MIC50"] # SMG is in linear scale
-                        estimate_to_real_estimate = {"rAUC":"rAUC_log2", "MIC50":"MIC50_log10", "SMG-MIC50":"SMG-MIC50"}
+def plot_heatmap_susceptibility_one_drug_and_fitness_estimate(susceptibility_df_d_fe, filename, filename_no_clustering, drug, fitness_estimate, experiment_name, min_nAUC_to_beConsideredGrowing, type_measurements_susc):
 
-                    # make clustermap
-                    df_plot = simple_susceptibility_df[susceptibility_fileds +  ["strain"]].set_index("strain")
+    """Plots the susceptibility heatmaps for one drug and fitness estimate, with the strains clustered (filename) and sorted (filename_no_clustering). The data and the clustering of the strains are calculated once for both"""
 
-                    # change the order
-                    if row_cluster is False: df_plot = df_plot.loc[sorted(df_plot.index)]
+    # skip
+    if not file_is_empty(filename) and not file_is_empty(filename_no_clustering): return
 
-                    # get as the no nans df
-                    df_plot_nonans = df_plot.applymap(convert_nans_to_0s)
+    # get the simplified susceptibility_df, with one strain for eacg
+    simple_susceptibility_df = susceptibility_df_d_fe.groupby(["strain"]).apply(get_row_simple_susceptibility_df_one_strain_and_drug).reset_index(drop=True)
 
-                    # create the df to plot that is compatible with zscore
-                    df_plot_nonans_zscore = pd.DataFrame(index=df_plot_nonans.index)
-                    for col in df_plot_nonans.columns:
-                        if len(df_plot_nonans[col].unique()) == 1: df_plot_nonans_zscore[col] = 0
-                        else: df_plot_nonans_zscore[col] = scipy.stats.zscore(df_plot_nonans[col])
+    # define the fields based on type_measurements_susc
+    if type_measurements_susc=="raw":
+        susceptibility_fileds = ["median_rAUC", "median_MIC50", "median_SMG-MIC50"]
+        estimate_to_real_estimate = {"rAUC":"rAUC", "MIC50":"MIC50", "SMG-MIC50":"SMG-MIC50"}
 
-                    # init clustermap with the z-score of the three values, so that the strains are clustered based on that
-                    g = sns.clustermap(df_plot_nonans_zscore, row_cluster=row_cluster, col_cluster=False, linecolor="gray", linewidth=0, yticklabels=1)
-                    ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
-                    if set(ordered_strains)!=set(df_plot_nonans_zscore.index): raise ValueError("The yticklabels should include all strains")
+    elif type_measurements_susc=="log":
+        susceptibility_fileds = ["median_rAUC_log2", "median_MIC50_log10", "median_SMG-MIC50"] # SMG is in linear scale
+        estimate_to_real_estimate = {"rAUC":"rAUC_log2", "MIC50":"MIC50_log10", "SMG-MIC50":"SMG-MIC50"}
 
-                    # change positions
-                    hm_height_multiplier = 0.04
-                    hm_width_multiplier = 0.04
-                    distance_btw_boxes = 0.01
-                    rd_width = 0.08
-                    cbar_width = 0.04
+    # get the df to plot
+    df_plot_all = simple_susceptibility_df[susceptibility_fileds +  ["strain"]].set_index("strain")
 
-                    hm_height = len(df_plot)*hm_height_multiplier
-                    hm_width = len(df_plot.columns)*hm_width_multiplier
+    # get the clustering of the strains (based on the z-score of the three values), shared by both heatmaps
+    row_linkage = get_row_linkage_heatmap(get_df_zscore_heatmap_susceptibility(df_plot_all.applymap(convert_nans_to_0s)))
 
-                    hm_pos = g.ax_heatmap.get_position()
-                    cb_pos = g.ax_cbar.get_position()
-                    hm_y0 = cb_pos.y1 - hm_height
-                    g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
+    # plot the heatmaps with clustered and sorted strains
+    for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
+        if not file_is_empty(file): continue
 
-                    rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
-                    g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
+        # change the order
+        if row_cluster is True: df_plot = df_plot_all
+        else: df_plot = df_plot_all.loc[sorted(df_plot_all.index)]
 
-                    # remove colorbar
-                    g.ax_cbar.remove()
-            
-                    # change axis
-                    fontsize_all = 16
-                    max_conc = get_clean_float_value(simple_susceptibility_df.max_concentration.iloc[0])
+        # get as the no nans df, and the df to plot that is compatible with zscore
+        df_plot_nonans = df_plot.applymap(convert_nans_to_0s)
+        df_plot_nonans_zscore = get_df_zscore_heatmap_susceptibility(df_plot_nonans)
+
+        # init clustermap with the z-score of the three values, so that the strains are clustered based on that
+        g = sns.clustermap(df_plot_nonans_zscore, row_cluster=row_cluster, row_linkage={True:row_linkage, False:None}[row_cluster], col_cluster=False, linecolor="gray", linewidth=0, yticklabels=1)
+        ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
+        if set(ordered_strains)!=set(df_plot_nonans_zscore.index): raise ValueError("The yticklabels should include all strains")
+
+        # change positions
+        hm_height_multiplier = 0.04
+        hm_width_multiplier = 0.04
+        distance_btw_boxes = 0.01
+        rd_width = 0.08
+        cbar_width = 0.04
+
+        hm_height = len(df_plot)*hm_height_multiplier
+        hm_width = len(df_plot.columns)*hm_width_multiplier
 
-                    estimate_to_label = {"median_rAUC":"rAUC$_{%s}$"%max_conc, "median_MIC50":"MIC$_{50}$", "median_SMG-MIC50":"SMG$_{50}$", "median_rAUC_log2":"rAUC_log2$_{%s}$"%max_conc, "median_MIC50_log10":"log(MIC$_{50}$)"}
+        hm_pos = g.ax_heatmap.get_position()
+        cb_pos = g.ax_cbar.get_position()
+        hm_y0 = cb_pos.y1 - hm_height
+        g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
 
-                    g.ax_heatmap.set_xticklabels([estimate_to_label[e] for e in df_plot.columns], rotation=90, fontsize=fontsize_all)
-                    g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
-                    g.ax_heatmap.set_xlabel("")
-                    g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
-                    g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
+        rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
+        g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
 
-                    # create the axes for the heatmaps
-                    cbar_w = hm_height_multiplier*0.9
-                    cbar_h = hm_height_multiplier*3
-                    
-                    x0_cax = rd_pos.x0-distance_btw_boxes-3*cbar_w
-                    y1_rd = rd_pos.y0+rd_pos.height
+        # remove colorbar
+        g.ax_cbar.remove()
 
-                    rAUC_cax = g.fig.add_axes([x0_cax, y1_rd - cbar_h, cbar_w, cbar_h])
-                    MIC_cax = g.fig.add_axes([x0_cax, y1_rd - 2*cbar_h - (distance_btw_boxes)*6, cbar_w, cbar_h])
-                    SMG_cax = g.fig.add_axes([x0_cax, y1_rd - 3*cbar_h - (2*distance_btw_boxes)*6, cbar_w, cbar_h])
+        # change axis
+        fontsize_all = 16
+        max_conc = get_clean_float_value(simple_susceptibility_df.max_concentration.iloc[0])
 
-                    # change things for each field
-                    for Ic, (estimate, palette, cax) in enumerate([("rAUC", "gray_r", rAUC_cax), ("MIC50", "Blues", MIC_cax), ("SMG-MIC50","Reds", SMG_cax)]):
+        estimate_to_label = {"median_rAUC":"rAUC$_{%s}$"%max_conc, "median_MIC50":"MIC$_{50}$", "median_SMG-MIC50":"SMG$_{50}$", "median_rAUC_log2":"rAUC_log2$_{%s}$"%max_conc, "median_MIC50_log10":"log(MIC$_{50}$)"}
 
-                        # define the real estimate, based on the type of plot
-                        real_estimate = estimate_to_real_estimate[estimate]
+        g.ax_heatmap.set_xticklabels([estimate_to_label[e] for e in df_plot.columns], rotation=90, fontsize=fontsize_all)
+        g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
+        g.ax_heatmap.set_xlabel("")
+        g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
+        g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
 
-                        # get the cmap
-                        sorted_vals = sorted(set(df_plot_nonans["median_%s"%real_estimate]).union({0}))
-                        val_to_color = get_value_to_color(sorted_vals, palette=palette, n=len(sorted_vals), type_color="hex", center=None)[0]
+        # create the axes for the heatmaps
+        cbar_w = hm_height_multiplier*0.9
+        cbar_h = hm_height_multiplier*3
 
-                        # go through each strain
-                        for Ir, strain in enumerate(ordered_strains):
+        x0_cax = rd_pos.x0-distance_btw_boxes-3*cbar_w
+        y1_rd = rd_pos.y0+rd_pos.height
 
-                            # add the rectangle for the median
-                            val = df_plot.loc[strain, "median_%s"%real_estimate]
-                            if pd.isna(val): color = "white"
-                            else: color = val_to_color[val]
+        rAUC_cax = g.fig.add_axes([x0_cax, y1_rd - cbar_h, cbar_w, cbar_h])
+        MIC_cax = g.fig.add_axes([x0_cax, y1_rd - 2*cbar_h - (distance_btw_boxes)*6, cbar_w, cbar_h])
+        SMG_cax = g.fig.add_axes([x0_cax, y1_rd - 3*cbar_h - (2*distance_btw_boxes)*6, cbar_w, cbar_h])
 
-                            rect = patches.Rectangle((Ic, Ir), 1, 1, linewidth=.5, edgecolor='gray', facecolor=color)
-                            g.ax_heatmap.add_patch(rect)
+        # change things for each field
+        for Ic, (estimate, palette, cax) in enumerate([("rAUC", "gray_r", rAUC_cax), ("MIC50", "Blues", MIC_cax), ("SMG-MIC50","Reds", SMG_cax)]):
 
-                            # add things to each heatmap
-                            df = simple_susceptibility_df[(simple_susceptibility_df.strain==strain)]
-                            if len(df)==0: continue
-                            if len(df)!=1: raise ValueError("df should be 1")
-                            r = df.iloc[0]
+            # define the real estimate, based on the type of plot
+            real_estimate = estimate_to_real_estimate[estimate]
 
-                            # add text for few replicates
-                            if r["replicates_%s"%real_estimate] in {0, 1}: g.ax_heatmap.text(Ic+0.5, Ir+0.5, {0:"X", 1:"1"}[r["replicates_%s"%real_estimate]], color=get_annotationColor_on_bgcolor(color), fontsize=fontsize_all, horizontalalignment="center", verticalalignment="center")
+            # get the cmap
+            sorted_vals = sorted(set(df_plot_nonans["median_%s"%real_estimate]).union({0}))
+            val_to_color = get_value_to_color(sorted_vals, palette=palette, n=len(sorted_vals), type_color="hex", center=None)[0]
 
-                            # for more replicates, add circles for MAD
-                            else:
-                                lower_bound_median = max([0, r["median_%s"%real_estimate] - r["mad_%s"%real_estimate]])
-                                upper_bound_median = r["median_%s"%real_estimate] + r["mad_%s"%real_estimate]
-                                for Iv, val in enumerate([lower_bound_median, upper_bound_median]): 
+            # go through each strain
+            for Ir, strain in enumerate(ordered_strains):
 
-                                    g.ax_heatmap.scatter([Ic+0.33*(1+Iv)], [Ir+0.5], edgecolor="gray", facecolor=val_to_color[find_nearest(np.array(sorted(set(val_to_color.keys()))), val)],  s=25, linewidth=.4, zorder=2)
+                # add the rectangle for the median
+                val = df_plot.loc[strain, "median_%s"%real_estimate]
+                if pd.isna(val): color = "white"
+                else: color = val_to_color[val]
 
-                        # add colorbar
-                        ticks_vals = list(np.linspace(0, max(sorted_vals), 3))
-                        ticks_list = [get_clean_float_value(y) for y in ticks_vals]
-                        cax.set_yticks(ticks_vals)
-                        cax.set_yticklabels(ticks_list)
+                rect = patches.Rectangle((Ic, Ir), 1, 1, linewidth=.5, edgecolor='gray', facecolor=color)
+                g.ax_heatmap.add_patch(rect)
 
-                        cmap = plt.get_cmap(palette)
-                        norm = plt.Normalize(vmin=0, vmax=max(sorted_vals))
-                        cb = plt.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), cax=cax, ticks=ticks_vals)
+                # add things to each heatmap
+                df = simple_susceptibility_df[(simple_susceptibility_df.strain==strain)]
+                if len(df)==0: continue
+                if len(df)!=1: raise ValueError("df should be 1")
+                r = df.iloc[0]
 
-                        cb.ax.tick_params(labelsize=fontsize_all-4)
-                        cax.set_title(estimate_to_label["median_%s"%real_estimate], fontsize=fontsize_all, pad=10, loc="center")
-                        cb.outline.set_visible(False)
+                # add text for few replicates
+                if r["replicates_%s"%real_estimate] in {0, 1}: g.ax_heatmap.text(Ic+0.5, Ir+0.5, {0:"X", 1:"1"}[r["replicates_%s"%real_estimate]], color=get_annotationColor_on_bgcolor(color), fontsize=fontsize_all, horizontalalignment="center", verticalalignment="center")
 
+                # for more replicates, add circles for MAD
+                else:
+                    lower_bound_median = max([0, r["median_%s"%real_estimate] - r["mad_%s"%real_estimate]])
+                    upper_bound_median = r["median_%s"%real_estimate] + r["mad_%s"%real_estimate]
+                    for Iv, val in enumerate([lower_bound_median, upper_bound_median]): 
+
+                        g.ax_heatmap.scatter([Ic+0.33*(1+Iv)], [Ir+0.5], edgecolor="gray", facecolor=val_to_color[find_nearest(np.array(sorted(set(val_to_color.keys()))), val)],  s=25, linewidth=.4, zorder=2)
+
+            # add colorbar
+            ticks_vals = list(np.linspace(0, max(sorted_vals), 3))
+            ticks_list = [get_clean_float_value(y) for y in ticks_vals]
+            cax.set_yticks(ticks_vals)
+            cax.set_yticklabels(ticks_list)
+
+            cmap = plt.get_cmap(palette)
+            norm = plt.Normalize(vmin=0, vmax=max(sorted_vals))
+            cb = plt.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), cax=cax, ticks=ticks_vals)
+
+            cb.ax.tick_params(labelsize=fontsize_all-4)
+            cax.set_title(estimate_to_label["median_%s"%real_estimate], fontsize=fontsize_all, pad=10, loc="center")
+            cb.outline.set_visible(False)
+
+
+        # add description at the bottom
+        description = "rAUC (max [%s]=%s), 50%s Minimum Inhibitory Concentration (MIC)\nand Supra-MIC Growth (SMG) based on fitness estimate '%s'\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(drug, max_conc, "%", fitness_estimate.replace("_rel", ""))
 
-                    # add description at the bottom
-                    description = "rAUC (max [%s]=%s), 50%s Minimum Inhibitory Concentration (MIC)\nand Supra-MIC Growth (SMG) based on fitness estimate '%s'\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(drug, max_conc, "%", fitness_estimate.replace("_rel", ""))
+        description += get_fe_description(fitness_estimate.replace("_rel", ""), 'only_correct_spots', min_nAUC_to_beConsideredGrowing)
+        g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
 
-                    description += get_fe_description(fitness_estimate.replace("_rel", ""), 'only_correct_spots', min_nAUC_to_beConsideredGrowing)
-                    g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
+        filename_tmp = "%s.tmp.pdf"%file
+        g.savefig(filename_tmp,  format='pdf', bbox_inches="tight")
+        plt.close(g.fig)
+        os.rename(filename_tmp, file)
 
-                    filename_tmp = "%s.tmp.pdf"%file
-                    g.savefig(filename_tmp,  format='pdf', bbox_inches="tight")
-                    os.rename(filename_tmp, file)
 
+def get_row_linkage_heatmap(df_plot):
 
-def plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate(df_fit, filename, all_strains, fitness_estimate, drug, min_nAUC_to_beConsideredGrowing, experiment_name, cmap="rocket_r", row_cluster=True):
+    """Returns the linkage of the rows of df_plot as calculated by sns.clustermap (average linkage of euclidean distances), so that it can be shared by several heatmaps. It is None if there are <2 rows."""
 
-    """Plots the heatmap for one drug and fitness estimate"""
+    if len(df_plot)<2: return None
+    return hierarchy.linkage(df_plot.values, method="average", metric="euclidean")
+
+def plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate(df_fit, filename, filename_no_clustering, all_strains, fitness_estimate, drug, min_nAUC_to_beConsideredGrowing, experiment_name, cmap="rocket_r"):
+
+    """Plots the heatmaps for one drug and fitness estimate, with the strains clustered (filename) and sorted (filename_no_clustering). The data and the clustering of the strains are calculated once for both"""
 
     # skip
-    if not file_is_empty(filename): return
+    if not file_is_empty(filename) and not file_is_empty(filename_no_clustering): return
 
     # set parms
     matplotlib.use('Agg')
@@ -1896,9 +3010,6 @@ def plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate(df_fit,
     sorted_concentrations = sorted(set(df_fit_per_strain.concentration))
     df_plot = df_fit_per_strain.pivot(index="strain", columns="concentration", values="median %s"%fitness_estimate)[sorted_concentrations].applymap(get_nan_to_0)
 
-    # resort df if it is not sorted
-    if row_cluster is False: df_plot = df_plot.loc[sorted(df_plot.index)]
-
     # define the annot df to flag weird concentrations
     def get_annot_for_n_reps(x):
         if pd.isna(x): return "X"
@@ -1908,75 +3019,87 @@ def plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate(df_fit,
 
     df_annot = df_fit_per_strain.pivot(index="strain", columns="concentration", values="# replicates").loc[df_plot.index, df_plot.columns].applymap(get_annot_for_n_reps)
 
-    # get clustermap
-    max_val = max(df_fit_per_strain.upper_bound_median)
-    g = sns.clustermap(df_plot, row_cluster=row_cluster, col_cluster=False, cmap=cmap, linecolor="gray", linewidth=0.5, cbar_kws={'label': "median(%s)"%fitness_estimate}, vmin=0, vmax=max_val, annot=df_annot, annot_kws={"size": 13}, fmt="",  yticklabels=1)
-
     # map the value to color
+    max_val = max(df_fit_per_strain.upper_bound_median)
     all_vals = sorted(get_uniqueVals_df(df_fit_per_strain[["median %s"%fitness_estimate, "upper_bound_median", "lower_bound_median"]]))
     val_to_color = get_value_to_color(all_vals, palette=cmap, n=len(all_vals), type_color="hex", center=None)[0]
 
-    # get the ordered ytick labels as in g
-    ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
-    if set(ordered_strains)!=set(df_plot.index): raise ValueError("The yticklabels should include all strains")
+    # get the clustering of the strains, shared by both heatmaps
+    df_plot_all = df_plot
+    row_linkage = get_row_linkage_heatmap(df_plot_all)
 
-    # add the MAD for strains with >1 replicate
-    for Ic, conc in enumerate(sorted_concentrations):
-        for Is, strain in enumerate(ordered_strains):
+    # plot the heatmaps with clustered and sorted strains
+    for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
+        if not file_is_empty(file): continue
 
-            # get row of df_fit_per_strain
-            df = df_fit_per_strain[(df_fit_per_strain.concentration==conc) & (df_fit_per_strain.strain==strain)]
-            if len(df)==0: continue
-            if len(df)!=1: raise ValueError("df should be 1")
-            r = df.iloc[0]
-            if r["# replicates"]<2: continue
+        # resort df if it is not clustered
+        if row_cluster is True: df_plot = df_plot_all
+        else: df_plot = df_plot_all.loc[sorted(df_plot_all.index)]
 
-            for Iv, val in enumerate([r.lower_bound_median, r.upper_bound_median]): g.ax_heatmap.scatter([Ic+0.33*(1+Iv)], [Is+0.5], edgecolor="gray", facecolor=val_to_color[val],  s=25, linewidth=.4)
+        # get clustermap
+        g = sns.clustermap(df_plot, row_cluster=row_cluster, row_linkage={True:row_linkage, False:None}[row_cluster], col_cluster=False, cmap=cmap, linecolor="gray", linewidth=0.5, cbar_kws={'label': "median(%s)"%fitness_estimate}, vmin=0, vmax=max_val, annot=df_annot.loc[df_plot.index], annot_kws={"size": 13}, fmt="",  yticklabels=1)
 
-    # change positions
-    hm_height_multiplier = 0.04
-    hm_width_multiplier = 0.04
-    distance_btw_boxes = 0.01
-    rd_width = 0.08
-    cbar_width = 0.04
+        # get the ordered ytick labels as in g
+        ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
+        if set(ordered_strains)!=set(df_plot.index): raise ValueError("The yticklabels should include all strains")
 
-    hm_height = len(df_plot)*hm_height_multiplier
-    hm_width = len(df_plot.columns)*hm_width_multiplier
+        # add the MAD for strains with >1 replicate
+        for Ic, conc in enumerate(sorted_concentrations):
+            for Is, strain in enumerate(ordered_strains):
 
-    hm_pos = g.ax_heatmap.get_position()
-    cb_pos = g.ax_cbar.get_position()
-    hm_y0 = cb_pos.y1 - hm_height
-    #hm_y0 = (hm_pos.y0+hm_pos.height)-hm_height
-    g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
+                # get row of df_fit_per_strain
+                df = df_fit_per_strain[(df_fit_per_strain.concentration==conc) & (df_fit_per_strain.strain==strain)]
+                if len(df)==0: continue
+                if len(df)!=1: raise ValueError("df should be 1")
+                r = df.iloc[0]
+                if r["# replicates"]<2: continue
 
-    rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
-    g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
+                for Iv, val in enumerate([r.lower_bound_median, r.upper_bound_median]): g.ax_heatmap.scatter([Ic+0.33*(1+Iv)], [Is+0.5], edgecolor="gray", facecolor=val_to_color[val],  s=25, linewidth=.4)
 
-    cbar_height = hm_height_multiplier*4
-    g.ax_cbar.set_position([rd_pos.x0 - rd_width - distance_btw_boxes*8, rd_pos.y0 + hm_pos.height - cbar_height,cbar_width, cbar_height])
+        # change positions
+        hm_height_multiplier = 0.04
+        hm_width_multiplier = 0.04
+        distance_btw_boxes = 0.01
+        rd_width = 0.08
+        cbar_width = 0.04
 
-    # labels
-    g.ax_heatmap.set_xticklabels(sorted_concentrations, rotation=90, fontsize=fontsize_all)
-    g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
-    g.ax_heatmap.set_xlabel("[%s]"%drug, fontsize=fontsize_all)
-    g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
-    g.ax_cbar.set_yticklabels([y.get_text() for y in g.ax_cbar.get_yticklabels()], fontsize=fontsize_all)
-    g.ax_cbar.set_ylabel(fitness_estimate, fontsize=fontsize_all)
+        hm_height = len(df_plot)*hm_height_multiplier
+        hm_width = len(df_plot.columns)*hm_width_multiplier
 
-    # add title
-    g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
+        hm_pos = g.ax_heatmap.get_position()
+        cb_pos = g.ax_cbar.get_position()
+        hm_y0 = cb_pos.y1 - hm_height
+        #hm_y0 = (hm_pos.y0+hm_pos.height)-hm_height
+        g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
 
-    # add description at the bottom
-    description = "[%s] vs fitness (estimated by '%s')\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(drug, fitness_estimate)
+        rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
+        g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
 
-    description += get_fe_description(fitness_estimate, 'only_correct_spots', min_nAUC_to_beConsideredGrowing)
-    g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
+        cbar_height = hm_height_multiplier*4
+        g.ax_cbar.set_position([rd_pos.x0 - rd_width - distance_btw_boxes*8, rd_pos.y0 + hm_pos.height - cbar_height,cbar_width, cbar_height])
 
-    # save
-    filename_tmp = "%s.tmp.pdf"%filename
-    g.savefig(filename_tmp,  bbox_inches="tight")
-    #plt.close(g)
-    os.rename(filename_tmp, filename)
+        # labels
+        g.ax_heatmap.set_xticklabels(sorted_concentrations, rotation=90, fontsize=fontsize_all)
+        g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
+        g.ax_heatmap.set_xlabel("[%s]"%drug, fontsize=fontsize_all)
+        g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
+        g.ax_cbar.set_yticklabels([y.get_text() for y in g.ax_cbar.get_yticklabels()], fontsize=fontsize_all)
+        g.ax_cbar.set_ylabel(fitness_estimate, fontsize=fontsize_all)
+
+        # add title
+        g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
+
+        # add description at the bottom
+        description = "[%s] vs fitness (estimated by '%s')\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(drug, fitness_estimate)
+
+        description += get_fe_description(fitness_estimate, 'only_correct_spots', min_nAUC_to_beConsideredGrowing)
+        g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
+
+        # save
+        filename_tmp = "%s.tmp.pdf"%file
+        g.savefig(filename_tmp,  bbox_inches="tight")
+        plt.close(g.fig)
+        os.rename(filename_tmp, file)
 
 
 def plot_heatmaps_concentration_vs_fitness(df_fitness_measurements, plots_dir_all, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name):
@@ -1997,8 +3120,12 @@ def plot_heatmaps_concentration_vs_fitness(df_fitness_measurements, plots_dir_al
     print_with_runtime("Plotting drug-vs-fitness heatmaps...")
 
     # make one plot for each drug and fitness_estimate
+    inputs_fn = []
     for drug in all_drugs:
 
+        # get the df of this drug
+        df_fit = df_fitness_measurements[(df_fitness_measurements.drug==drug) | (df_fitness_measurements.concentration==0)]
+
         relative_fitness_estimates = ["%s_rel"%f for f in fitness_estimates]
         for fitness_estimate in (fitness_estimates + relative_fitness_estimates):
             #print_with_runtime("plotting the heatmap for %s-%s"%(drug, fitness_estimate))
@@ -2010,19 +3137,15 @@ def plot_heatmaps_concentration_vs_fitness(df_fitness_measurements, plots_dir_al
 
             # define the colormap
             if fitness_estimate.endswith("_rel"): cmap = "rocket_r"
-            else: cmap = "Greens"
-
-            # one plot for each type
-            for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
-
-                if file_is_empty(file):
+            else: cmap = "Greens"
 
-                    # get dfs
-                    df_fit = cp.deepcopy(df_fitness_measurements[(df_fitness_measurements.drug==drug) | (df_fitness_measurements.concentration==0)])
-                    check_no_nans_series(df_fit[fitness_estimate])
+            # add the inputs of both heatmaps
+            if file_is_empty(filename) or file_is_empty(filename_no_clustering):
+                check_no_nans_series(df_fit[fitness_estimate])
+                inputs_fn.append((df_fit[["concentration", "strain", "row", "column", fitness_estimate]], filename, filename_no_clustering, all_strains, fitness_estimate, drug, min_nAUC_to_beConsideredGrowing, experiment_name, cmap))
 
-                    # get heatmap 
-                    plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate(df_fit, file, all_strains, fitness_estimate, drug, min_nAUC_to_beConsideredGrowing, experiment_name, cmap=cmap, row_cluster=row_cluster)
+    # run in parallel
+    if len(inputs_fn)>0: run_plotting_function_in_parallel(inputs_fn, plot_heatmaps_concentration_vs_fitness_one_drug_and_fitness_estimate)
 
 def chunks(l, n):
     
@@ -2229,13 +3352,7 @@ def plot_growth_at_different_drugs(df_fitness_measurements, plots_dir_all, fitne
                 inputs_fn.append((df_fit, filename, all_strains, fitness_estimate, drug, type_data, min_nAUC_to_beConsideredGrowing, strain_to_repID_to_color, experiment_name))
 
     # run in parallel
-    if len(inputs_fn)>0: 
-
-        # parallel
-        #for inputs_fn_chunk in chunks(inputs_fn, multiproc.cpu_count()): run_function_in_parallel(inputs_fn_chunk, plot_growth_at_different_drugs_one_fitness_estimate_and_drug, ntries=2)
-        
-        # not parallel
-        for x in inputs_fn: plot_growth_at_different_drugs_one_fitness_estimate_and_drug(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7], x[8])
+    if len(inputs_fn)>0: run_plotting_function_in_parallel(inputs_fn, plot_growth_at_different_drugs_one_fitness_estimate_and_drug)
 
 def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1):
 
@@ -2270,6 +3387,44 @@ def run_function_in_parallel(inputs_fn, parallel_fun, ntries=1):
     # debug. If you arrived here it should have worked
     if fun_worked is False: raise ValueError("Function did not work")
 
+def init_plotting_worker():
+
+    """Initializes the matplotlib state of each worker of run_plotting_function_in_parallel"""
+
+    matplotlib.use('Agg')
+    matplotlib.rcParams['pdf.fonttype'] = 42
+    matplotlib.rcParams['ps.fonttype'] = 42
+    plt.close("all")
+
+def run_plotting_function_with_retries(plotting_fun, inputs, ntries):
+
+    """Runs plotting_fun(*inputs) up to ntries times, closing all figures after each try. It returns None if it worked, and the traceback of the last error otherwise"""
+
+    for tryI in range(1, ntries+1):
+
+        try: 
+            plotting_fun(*inputs)
+            return None
+
+        except Exception: error_traceback = traceback.format_exc()
+        finally: plt.close("all")
+
+    return error_traceback
+
+def run_plotting_function_in_parallel(inputs_fn, plotting_fun, ntries=2, maxtasksperchild=10):
+
+    """Runs a plotting function in parallel. Each worker has its own matplotlib state (with the Agg backend), and it is replaced after maxtasksperchild plots to bound the memory used by matplotlib. Each plot is tried ntries times, and the tracebacks of the plots that did not work are printed before raising an error."""
+
+    # run
+    with multiproc.Pool(multiproc.cpu_count(), initializer=init_plotting_worker, maxtasksperchild=maxtasksperchild) as pool:
+        error_tracebacks = pool.starmap(run_plotting_function_with_retries, [(plotting_fun, inputs, ntries) for inputs in inputs_fn], chunksize=1)
+
+    # check that all plots worked
+    failed_error_tracebacks = [x for x in error_tracebacks if x is not None]
+    if len(failed_error_tracebacks)>0:
+        for error_traceback in failed_error_tracebacks: print(error_traceback)
+        raise ValueError("%i/%i plots of function %s did not work. Check the error tracebacks above."%(len(failed_error_tracebacks), len(inputs_fn), plotting_fun))
+
 def get_only_element_of_list(x):
 
     """Takes a list with only one element"""
@@ -2306,11 +3461,12 @@ def parse_excel_positions_plate_layout(df_all):
 
             if df_all.loc[Ir-1, Ic]=="1" and df_all.loc[Ir-3, Ic]=="Strains distribution" and df_all.loc[Ir, Ic-1]=="A":
 
-                # validate that there are 12 columns
-                if list(df_all.loc[Ir-1, list(range(Ic, Ic+12))])==list(map(str, range(1, 13))):
+                # validate that there are as many columns as in the plate format (12 for 96-spot plates)
+                nrows, ncols = get_plate_nrows_and_ncols()
+                if list(df_all.loc[Ir-1, list(range(Ic, Ic+ncols))])==list(map(str, range(1, ncols+1))):
 
-                    # validate that there are 8 rows A-H
-                    if list(df_all.loc[list(range(Ir, Ir+8)), Ic-1])==['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
+                    # validate that there are as many rows as in the plate format (A-H for 96-spot plates)
+                    if list(df_all.loc[list(range(Ir, Ir+nrows)), Ic-1])==get_plate_row_letters():
                         n_strains_pos+=1
                         strains_pos = (Ir, Ic)
 
@@ -2340,7 +3496,7 @@ def get_df_drugs(df_all, comp, conc):
     if plate_batches_comp!=plate_batches_conc: raise ValueError("the plate_batches are not the same between compounds and concentrations layouts")
 
     # fill the df_drugs
-    df_drugs = pd.DataFrame()
+    table_drugs = init_table()
     for Ib, plate_batch in enumerate(plate_batches_comp):
         for plate in range(1, 5):
 
@@ -2351,9 +3507,9 @@ def get_df_drugs(df_all, comp, conc):
             elif drug=="nan" and concentration!="nan":  raise ValueError("compounds and concentrations layouts do not match")
             elif drug!="nan" and concentration=="nan":  raise ValueError("compounds and concentrations layouts do not match")
 
-            row_drugs = pd.DataFrame({0:{"plate_batch":plate_batch, "plate":plate, "drug":drug, "concentration":concentration}}).transpose()
-            df_drugs = df_drugs.append(row_drugs).reset_index(drop=True)
+            add_row_to_table(table_drugs, {"plate_batch":plate_batch, "plate":plate, "drug":drug, "concentration":concentration})
 
+    df_drugs = get_df_from_table(table_drugs)
 
     # formats
     df_drugs["concentration"] = df_drugs["concentration"].apply(lambda x: str(x).replace(",", ".")) # format as floats the concentration
@@ -2370,10 +3526,11 @@ def get_df_drugs(df_all, comp, conc):
 
 def get_df_strains_layout(df_all, strains_pos):
 
-    """Gets df strains layout in 96-well-plate"""
+    """Gets df strains layout in the plate (with the rows and columns of plate_format)"""
 
     # init df
-    df_strains_layout = pd.DataFrame(index=list("ABCDEFGH"), columns=list(range(1, 13)))
+    nrows, ncols = get_plate_nrows_and_ncols()
+    df_strains_layout = pd.DataFrame(index=get_plate_row_letters(), columns=list(range(1, ncols+1)))
 
     # add from df_all and strains_pos
     for Ir, row in enumerate(df_strains_layout.index):
@@ -2383,10 +3540,10 @@ def get_df_strains_layout(df_all, strains_pos):
             df_strains_layout.loc[row, col] = strain_name
 
             # checks
-            if strain_name in {"nan", "", '0'}: raise ValueError("We found a strain called '%s'. There can't be empty cells in the 96-strain grid of the plate layout. If you have empty spots, specify them as 'H2O' or 'empty'. Note that '0' counts also as empty cell."%(strain_name))
+            if strain_name in {"nan", "", '0'}: raise ValueError("We found a strain called '%s'. There can't be empty cells in the %i-strain grid of the plate layout. If you have empty spots, specify them as 'H2O' or 'empty'. Note that '0' counts also as empty cell."%(strain_name, plate_format))
 
     # change index
-    df_strains_layout.index = list(range(1, 9))
+    df_strains_layout.index = list(range(1, nrows+1))
 
     return df_strains_layout
 
@@ -2411,9 +3568,10 @@ def get_df_plate_layout_long_with_bad_spots(df_plate_layout_long, df_all, bad_sp
         df_bad_spots.columns = ["plate_batch", "plate", "row", "column"]
 
         # check the rows
-        letter_to_number = dict(zip(list("ABCDEFGH"), range(1,9)))
+        row_letters = get_plate_row_letters()
+        letter_to_number = dict(zip(row_letters, range(1, len(row_letters)+1)))
         strange_rows = set(df_bad_spots["row"]).difference(set(letter_to_number))
-        if len(strange_rows)>0: raise ValueError("Error in plate layout. In the bad spots, there are strange rows: %s. The rows should be A-H letters."%(strange_rows))
+        if len(strange_rows)>0: raise ValueError("Error in plate layout. In the bad spots, there are strange rows: %s. The rows should be %s-%s letters."%(strange_rows, row_letters[0], row_letters[-1]))
 
         # change rows to numbers
         df_bad_spots["row"] = df_bad_spots.row.apply(lambda x: letter_to_number[x])
@@ -2480,11 +3638,11 @@ def get_df_plate_layout_and_all_drugs(plate_layout_file, images_dir):
     elif sum(df_drugs.concentration==0)!=1: raise ValueError("There should be only one plate with a concentration of 0.0")
     if sum(df_drugs.concentration!=0)==0: raise ValueError("there have to be some non-0 concentrations")
 
-    # define the df_strains_layout (which has the strains in the 96-well-plate layout)
+    # define the df_strains_layout (which has the strains in the plate layout, with the rows and columns of plate_format)
     df_strains_layout = get_df_strains_layout(df_all, strains_pos)
 
     # create the long df for the plate
-    df_plate_layout_long_core = pd.concat([pd.DataFrame({"column":[col]*8, "strain":df_strains_layout[col], "row":list(df_strains_layout.index)}) for col in df_strains_layout.columns]).sort_values(by=["row", "column"]).reset_index(drop=True)
+    df_plate_layout_long_core = pd.concat([pd.DataFrame({"column":[col]*len(df_strains_layout), "strain":df_strains_layout[col], "row":list(df_strains_layout.index)}) for col in df_strains_layout.columns]).sort_values(by=["row", "column"]).reset_index(drop=True)
 
     # create a single df_plate_layout_long with a copy of df_plate_layout_long_core for each combination of plate_batch, plate
     def get_df_plate_layout_long_one_row_df_drugs(r):
@@ -2503,7 +3661,8 @@ def get_df_plate_layout_and_all_drugs(plate_layout_file, images_dir):
     df_plate_layout_long = df_plate_layout_long[["plate_batch", "plate", "row", "column", "strain", "drug", "concentration", "bad_spot"]].reset_index(drop=True)
 
     # debugs
-    for f, expected_values in [("plate", set(range(1, 5))), ("row", set(range(1, 9))), ("column", set(range(1, 13)))]:
+    nrows, ncols = get_plate_nrows_and_ncols()
+    for f, expected_values in [("plate", set(range(1, 5))), ("row", set(range(1, nrows+1))), ("column", set(range(1, ncols+1)))]:
         strange_vals = set(df_plate_layout_long[f]).difference(expected_values)
         if len(strange_vals)>0: raise ValueError("There are strange values in %s: %s"%(f, strange_vals))
 
@@ -2514,7 +3673,7 @@ def get_df_plate_layout_and_all_drugs(plate_layout_file, images_dir):
     all_drugs = sorted(set(df_plate_layout_long[df_plate_layout_long.concentration!=0.0].drug))
 
     # more debugs on drugs
-    if measure_susceptibility is True and len(df_plate_layout_long[df_plate_layout_long.concentration==0.0])!=96: raise ValueError("There should be only one plate batch with concentration==0")
+    if measure_susceptibility is True and len(df_plate_layout_long[df_plate_layout_long.concentration==0.0])!=plate_format: raise ValueError("There should be only one plate batch with concentration==0")
 
 
     for d in all_drugs:
@@ -2528,7 +3687,7 @@ def get_df_plate_layout_and_all_drugs(plate_layout_file, images_dir):
             if next(iter(set_strainTuples))!=tuple_strains_no_drug: raise ValueError("For drug %s, the strains are not equal to drug==0 (they should be)"%(d))
 
         for conc in sorted(set(df_d.concentration)):
-            if sum(df_d.concentration==conc)!=96: raise ValueError("There should be 96 spots in the df_plate_layout_long with concentration==%s. This is not the case, which may be because you provided multiple plates with this concentration for drug %s, which is not allowed. There should be only one plate with this concentration."%(conc, d))
+            if sum(df_d.concentration==conc)!=plate_format: raise ValueError("There should be %i spots in the df_plate_layout_long with concentration==%s. This is not the case, which may be because you provided multiple plates with this concentration for drug %s, which is not allowed. There should be only one plate with this concentration."%(plate_format, conc, d))
 
     return df_plate_layout_long, all_drugs, measure_susceptibility, experiment_name
 
@@ -2547,7 +3706,8 @@ def get_df_plate_layout_and_all_drugs_from_long_format(plate_layout_file, images
         try: df_plate_layout[f] = df_plate_layout[f].apply(function_format)
         except: raise ValueError("The '%s' should be formatable as %s"%(f, function_format))
 
-    for f, expected_values in [("plate", set(range(1, 5))), ("row", set(range(1, 9))), ("column", set(range(1, 13)))]:
+    nrows, ncols = get_plate_nrows_and_ncols()
+    for f, expected_values in [("plate", set(range(1, 5))), ("row", set(range(1, nrows+1))), ("column", set(range(1, ncols+1)))]:
         strange_vals = set(df_plate_layout[f]).difference(expected_values)
         if len(strange_vals)>0: raise ValueError("There are strange values in %s: %s"%(f, strange_vals))
 
@@ -2559,7 +3719,7 @@ def get_df_plate_layout_and_all_drugs_from_long_format(plate_layout_file, images
     all_drugs = sorted(set(df_plate_layout[df_plate_layout.concentration!=0.0].drug))
 
     # more debugs on drugs
-    if len(df_plate_layout[df_plate_layout.concentration==0.0])!=96: raise ValueError("There should be only one plate batch (with 96 rows in the plate layout table) with concentration==0")
+    if len(df_plate_layout[df_plate_layout.concentration==0.0])!=plate_format: raise ValueError("There should be only one plate batch (with %i rows in the plate layout table) with concentration==0"%plate_format)
 
     tuple_strains_no_drug = tuple(df_plate_layout[df_plate_layout.concentration==0].strain)
 
@@ -3037,23 +4197,29 @@ def run_analyze_images_run_colonyzer(outdir_images):
 
 def run_analyze_images_run_colonyzer_subset_images_one_plate(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d, reference_plate):
 
-    """Runs colonyzer on one plate (d) from processed_images_dir_each_plate, colonyzer_runs_subset_dir contains the images"""
+    """Runs colonyzer on the last image of one plate (d) from processed_images_dir_each_plate. The run in colonyzer_runs_subset_dir is keyed by the md5 of the Colonyzer.txt, so that it is only repeated if the coordinates changed."""
 
     # define dirs
     outdir = "%s/%s"%(colonyzer_runs_subset_dir, d) # place where to put the images
     source_dir =  "%s/%s"%(processed_images_dir_each_plate, d) # origin of the images
 
-    if not os.path.isdir(outdir):
+    if not get_colonyzer_subset_run_is_up_to_date(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d):
+
+        # remove the previous run (generated with other coordinates)
+        delete_folder(outdir)
 
         # make tmp folder
         outdir_tmp = "%s_tmp"%outdir
         delete_folder(outdir_tmp); make_folder(outdir_tmp)
 
+        # get the hash of the coordinates that will be used
+        coords_md5 = get_md5_file("%s/Colonyzer.txt"%source_dir)
+
         # define the sorted images
         sorted_image_names = sorted({f for f in os.listdir(source_dir) if not f.startswith(".") and f not in {"Colonyzer.txt.tmp", "Colonyzer.txt"}}, key=get_yyyymmddhhmm_tuple_one_image_name)
 
-        # add files in outdir_tmp to get images
-        for f in [sorted_image_names[0], sorted_image_names[-1], "Colonyzer.txt"]: soft_link_files("%s/%s"%(source_dir,f), "%s/%s"%(outdir_tmp,f))
+        # add files in outdir_tmp to get images. Only the last image is needed to draw the grid overlay
+        for f in [sorted_image_names[-1], "Colonyzer.txt"]: soft_link_files("%s/%s"%(source_dir,f), "%s/%s"%(outdir_tmp,f))
         
         # move into the images dir
         initial_dir = os.getcwd()
@@ -3064,11 +4230,17 @@ def run_analyze_images_run_colonyzer_subset_images_one_plate(processed_images_di
 
         # run colonyzer for all parameters
         run_colonyzer_one_set_of_parms(parms_colonyzer, outdir_tmp, image_names_withoutExtension, processed_images_dir_each_plate, reference_plate)
+
+        # go back to the initial dir
+        os.chdir(initial_dir)
+
+        # record the coordinates used
+        open("%s/Colonyzer.txt.md5"%outdir_tmp, "w").write("%s\n"%coords_md5)
         os.rename(outdir_tmp, outdir)
 
 def run_analyze_images_run_colonyzer_subset_images(outdir, reference_plate):
 
-    """Runs colonyzer on a subset of 2 images with the generated Colonyzer.txt file"""
+    """Runs colonyzer on the last image of each plate with the generated Colonyzer.txt file. Only plates with new coordinates are run."""
 
     start_time = time.time()
 
@@ -3077,11 +4249,14 @@ def run_analyze_images_run_colonyzer_subset_images(outdir, reference_plate):
     processed_images_dir_each_plate = "%s/processed_images_each_plate"%tmpdir
     colonyzer_runs_subset_dir = "%s/colonyzer_runs_subset"%tmpdir; make_folder(colonyzer_runs_subset_dir)
 
-    # define the inputs function to run colonyzer
-    inputs_fn = [(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d, reference_plate) for d in os.listdir(processed_images_dir_each_plate)]
+    # define the inputs function to run colonyzer, only for plates with changed coordinates
+    inputs_fn = [(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d, reference_plate) for d in sorted(os.listdir(processed_images_dir_each_plate)) if not get_colonyzer_subset_run_is_up_to_date(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d)]
+
+    # run directly if only one plate changed (typically a rejected plate), avoiding the pool start
+    if len(inputs_fn)==1: run_analyze_images_run_colonyzer_subset_images_one_plate(*inputs_fn[0])
 
     #print_with_runtime("Checking coordinates in parallel on %i threads..."%multiproc.cpu_count())
-    run_function_in_parallel(inputs_fn, run_analyze_images_run_colonyzer_subset_images_one_plate)
+    elif len(inputs_fn)>1: run_function_in_parallel(inputs_fn, run_analyze_images_run_colonyzer_subset_images_one_plate)
 
     # give permissions
     run_cmd("chmod -R 777 %s"%colonyzer_runs_subset_dir)
@@ -3114,15 +4289,18 @@ def is_outlier(L, x, multiplier=2.5):
     return (is_outlier_bool, (lower_threshold, upper_threshold))
 
 
-def generate_df_w_potential_bad_spots(df_fitness_measurements, min_nAUC_to_beConsideredGrowing):
+def generate_df_w_potential_bad_spots(df_fitness_measurements, min_nAUC_to_beConsideredGrowing, bad_spot_features=None, multiplier=2.5):
 
-    """Generate an df with the potential bad spots"""
+    """Generate an df with the potential bad spots. The automatic bad spots are those with any of bad_spot_features (among 'nAUC', 'DT_h' and 'K', None means only 'nAUC') outside the range of is_outlier for their strain and plate. The quartiles of each strain and plate are calculated once, for all spots."""
+
+    # define the features
+    if bad_spot_features is None: bad_spot_features = ["nAUC"]
 
     # keep
     df_fitness_measurements = cp.deepcopy(df_fitness_measurements)
 
     # init df with manually-defined bad spots
-    num_to_letter = dict(zip(range(1,9), "ABCDEFGH"))
+    num_to_letter = dict(zip(range(1, get_plate_nrows_and_ncols()[0]+1), get_plate_row_letters()))
     df_bad_spots = df_fitness_measurements[df_fitness_measurements.bad_spot==True]
     df_bad_spots["row"] = df_bad_spots.row.apply(lambda x: num_to_letter[x])
     df_bad_spots["bad_spot_reason"] = "manual setting in plate layout"
@@ -3131,50 +4309,41 @@ def generate_df_w_potential_bad_spots(df_fitness_measurements, min_nAUC_to_beCon
     df_bad_spots = df_bad_spots[fields_spot]
 
     # for the other spots, add them automatically
-    df_fitness_measurements = df_fitness_measurements[df_fitness_measurements.bad_spot==False]
-
-    # get automatic bad spots
-    def get_bad_spot_reason_one_spot(r, nAUC_list, DT_h_list):
-
-        # if none of them are growing, it can't be a bad spot
-        median_nAUC = np.median(nAUC_list)
-        if median_nAUC<min_nAUC_to_beConsideredGrowing and r.nAUC<min_nAUC_to_beConsideredGrowing: return ""
-
-        # define a list of reasons that indicate that this could be a bad spot
-        reasons_bad_spot = []
-
-        outlier_nAUC, range_nAUC = is_outlier(nAUC_list, r.nAUC)
-        #outlier_DT_h, range_DT_h = is_outlier(DT_h_list, r.DT_h)
-
-        if outlier_nAUC==True: reasons_bad_spot.append("nAUC=%.2f outside (%.2f, %.2f)"%(r.nAUC, range_nAUC[0], range_nAUC[1]))
-        #if outlier_DT_h==True: reasons_bad_spot.append("DT_h=%.2f outside (%.2f, %.2f)"%(r.DT_h, range_DT_h[0], range_DT_h[1]))
-
-        # if by both measures this is a bad spot
-        if len(reasons_bad_spot)==1: return "; ".join(reasons_bad_spot)
-
-        # else it is not
-        else: return ""
-
-    def get_df_bad_spots_one_strain_and_plate(df):
-
-
-        # if there are <3 replicates, return an empty df
-        if len(df)<3: return pd.DataFrame(columns=fields_spot) 
-
-        # define if it is a bad spot
-        df["bad_spot_reason"] = df[["nAUC", "DT_h"]].apply(get_bad_spot_reason_one_spot, nAUC_list=list(df.nAUC), DT_h_list=list(df.DT_h), axis=1)
-
-        # return bad spots (if any)
-        df = df[df.bad_spot_reason!=""]
-        return df[fields_spot]
-
-    df_bad_spots_automatic = df_fitness_measurements.groupby(["plate_batch", "plate", "strain"]).apply(get_df_bad_spots_one_strain_and_plate)
+    df_fitness_measurements = df_fitness_measurements[df_fitness_measurements.bad_spot==False].reset_index(drop=True)
+    grouped_df = df_fitness_measurements.groupby(["plate_batch", "plate", "strain"])
+
+    # define the spots that can be bad spots: those of strains with >=3 replicates in the plate, where either the spot or the median of the strain is growing
+    group_sizes = grouped_df.nAUC.transform("size").values
+    median_nAUC = np.where(grouped_df.nAUC.transform("count").values==group_sizes, grouped_df.nAUC.transform("median").values, np.nan) # NaN for strains with NaNs, as np.median
+    spot_nAUC = df_fitness_measurements.nAUC.values
+    idx_candidate_spots = (group_sizes>=3) & ~((median_nAUC<min_nAUC_to_beConsideredGrowing) & (spot_nAUC<min_nAUC_to_beConsideredGrowing))
+
+    # add the reasons of the spots that are outliers in each feature, with the IQR thresholds of is_outlier
+    spot_to_reasons_bad_spot = {}
+    for feature in bad_spot_features:
+
+        # get the thresholds of each spot, which are NaN in strains with NaN values (as np.percentile)
+        q1 = np.where(grouped_df[feature].transform("count").values==group_sizes, grouped_df[feature].transform("quantile", 0.25).values, np.nan)
+        q3 = grouped_df[feature].transform("quantile", 0.75).values
+        iqr = q3 - q1
+        lower_thresholds = np.maximum(q1 - (multiplier * iqr), 0)
+        upper_thresholds = q3 + (multiplier * iqr)
+
+        # add the reasons of the outliers
+        values = df_fitness_measurements[feature].values
+        for I in np.where(idx_candidate_spots & ((values<lower_thresholds) | (values>upper_thresholds)))[0]:
+            spot_to_reasons_bad_spot.setdefault(I, []).append("%s=%.2f outside (%.2f, %.2f)"%(feature, values[I], lower_thresholds[I], upper_thresholds[I]))
+
+    # get the automatic bad spots
+    df_bad_spots_automatic = df_fitness_measurements.loc[sorted(spot_to_reasons_bad_spot)]
+    df_bad_spots_automatic["bad_spot_reason"] = [("; ".join(spot_to_reasons_bad_spot[I])) for I in df_bad_spots_automatic.index]
     df_bad_spots_automatic["row"] = df_bad_spots_automatic.row.apply(lambda x: num_to_letter[x])
+    df_bad_spots_automatic = df_bad_spots_automatic[fields_spot]
 
-    if len(df_bad_spots_automatic)>0: print_with_runtime("WARNING: We found %i (not defined) potential bad spots. We detected them based on a typical outlier-detection method: the Interquartile Range (IQR, which is Q3-Q1) approach. For each strain, in each plate batch and concentration, we calculated Q1, Q3 and IQR for nAUC. Potential bad spots have nAUC outside the (Q1 - 2.5·IQR, Q3 + 2.5·IQR) range for their strain. This method is approximate, so in a subsequent step you'll need to validate which of these spots are actually bad spots."%(len(df_bad_spots_automatic)))
+    if len(df_bad_spots_automatic)>0: print_with_runtime("WARNING: We found %i (not defined) potential bad spots. We detected them based on a typical outlier-detection method: the Interquartile Range (IQR, which is Q3-Q1) approach. For each strain, in each plate batch and concentration, we calculated Q1, Q3 and IQR for %s. Potential bad spots have %s outside the (Q1 - %s·IQR, Q3 + %s·IQR) range for their strain. This method is approximate, so in a subsequent step you'll need to validate which of these spots are actually bad spots."%(len(df_bad_spots_automatic), ", ".join(bad_spot_features), " or ".join(bad_spot_features), multiplier, multiplier))
 
     # merge
-    df_bad_spots = df_bad_spots.append(df_bad_spots_automatic)
+    df_bad_spots = pd.concat([df_bad_spots, df_bad_spots_automatic], sort=False)
 
 
     # return
@@ -3184,14 +4353,17 @@ def make_flat_listOflists(LoL):
 
     return list(itertools.chain.from_iterable(LoL))
 
-def generate_simplified_fitness_table(fitness_df, fitness_estimates, filename, experiment_name):
+def generate_simplified_fitness_table(fitness_df, fitness_estimates, filename, experiment_name, table_writer=None):
 
-    """Genrates a table where each row is one combination of plate_batch, plate, and strain, and it contains summary stats about the fitness estimates, discarding the bad spots"""
+    """Genrates a table where each row is one combination of plate_batch, plate, and strain, and it contains summary stats about the fitness estimates, discarding the bad spots. It is written as .csv and .xlsx (in the background if table_writer is provided)"""
 
     # keep df
     fitness_df = cp.deepcopy(fitness_df)
     fitness_df = fitness_df[~fitness_df.bad_spot]
 
+    # checks
+    validate_df_schema(fitness_df, {f : {"nan":False, "inf":False, "min":0} for f in fitness_estimates}, "fitness measurements (without bad spots)", unique_fields=["plate_batch", "plate", "strain", "replicateID"])
+
     # define a function that takes a slice of the df with the strains of one plate, and returns a row with summary stats
     def get_row_simple_fitness_df_one_plate_batch_plate_and_strain(df):
 
@@ -3201,14 +4373,6 @@ def generate_simplified_fitness_table(fitness_df, fitness_estimates, filename, e
         # init dict
         data_dict = {"plate_batch":df.plate_batch.iloc[0], "plate":df.plate.iloc[0], "drug":df.drug.iloc[0], "concentration":df.concentration.iloc[0], "strain":df.strain.iloc[0], "# replicates":len(df)}
 
-        # debug
-        if len(df)!=len(set(df.replicateID)): raise ValueError("replicateIDs should be unique")
-        for f in fitness_estimates: 
-            check_no_nans_series(df[f])
-            if any(df[f]==np.inf): raise ValueError("there can't be infs in f")
-            if any(df[f]==-np.inf): raise ValueError("there can't be -infs in f")
-            if any(df[f]<0): raise ValueError("there can't be <0s in f")
-
         # go through different fitness_estimates
         for fe in fitness_estimates:
 
@@ -3232,8 +4396,7 @@ def generate_simplified_fitness_table(fitness_df, fitness_estimates, filename, e
     simple_fitness_df["experiment_name"] = experiment_name
     simple_fitness_df = simple_fitness_df[['drug', 'concentration', 'strain', '# replicates', 'experiment_name'] + fields_fe].sort_values(by=['drug', 'concentration', 'strain'], ascending=True)
 
-    save_df_as_tab(simple_fitness_df, filename)
-    simple_fitness_df.to_excel("%s.xlsx"%(filename.rstrip(".csv")), index=False)
+    write_table(simple_fitness_df, filename, ["tab", "xlsx"], table_writer=table_writer)
 
 
 def get_df_fitness_measurements_with_extra_fields_when_conc0_is_available(fitness_df):
@@ -3244,14 +4407,11 @@ def get_df_fitness_measurements_with_extra_fields_when_conc0_is_available(fitnes
     fitness_df = cp.deepcopy(fitness_df)
 
     # add whether the concentration 0 is a bad spot or is growing
-    fitness_df_conc0 = fitness_df[fitness_df.concentration==0].set_index("replicateID")
-    if len(fitness_df_conc0)!=96: raise ValueError("There should be 96 spots with conc==0")
+    fitness_df_conc0 = fitness_df[fitness_df.concentration==0].set_index("sample_code")
+    if len(fitness_df_conc0)!=plate_format: raise ValueError("There should be %i spots with conc==0"%plate_format)
 
-    repID_to_is_growing_conc0 = dict(fitness_df_conc0.is_growing)
-    repID_to_is_bad_spots_conc0 = dict(fitness_df_conc0.bad_spot)
-
-    fitness_df["conc0_is_growing"] = fitness_df.replicateID.apply(lambda repID: repID_to_is_growing_conc0[repID])
-    fitness_df["conc0_is_bad_spot"] = fitness_df.replicateID.apply(lambda repID: repID_to_is_bad_spots_conc0[repID])
+    fitness_df["conc0_is_growing"] = fitness_df.sample_code.map(fitness_df_conc0.is_growing)
+    fitness_df["conc0_is_bad_spot"] = fitness_df.sample_code.map(fitness_df_conc0.bad_spot)
 
     if len(set(fitness_df.conc0_is_growing).difference({True, False}))>0: raise ValueError("conc0_is_growing should be boolean")
     if len(set(fitness_df.conc0_is_bad_spot).difference({True, False}))>0: raise ValueError("conc0_is_bad_spot should be boolean")
@@ -3269,15 +4429,11 @@ def get_df_fitness_measurements_with_extra_fields_when_conc0_is_available(fitnes
     fitness_df_no_conc0 = fitness_df[fitness_df.concentration!=0]
     initial_len_fitness_df_no_conc0 = len(fitness_df_no_conc0)
 
-    def get_df_with_n_non0_concentrations_bad_spot_one_replicate_and_drug(df):
-        if len(set(df.concentration))!=len(df): raise ValueError("concentration should be unique")
-        df["n_non0_concentrations_bad_spot"] = sum(df.bad_spot==True)
-        return df
-
-    fitness_df_no_conc0 = fitness_df_no_conc0.groupby(["drug", "replicateID"]).apply(get_df_with_n_non0_concentrations_bad_spot_one_replicate_and_drug)
+    if any(fitness_df_no_conc0[["drug_code", "sample_code", "concentration"]].duplicated()): raise ValueError("concentration should be unique")
+    fitness_df_no_conc0["n_non0_concentrations_bad_spot"] = (fitness_df_no_conc0.bad_spot==True).groupby([fitness_df_no_conc0.drug_code, fitness_df_no_conc0.sample_code]).transform("sum").astype(int)
     if initial_len_fitness_df_no_conc0!=len(fitness_df_no_conc0): raise ValueError("fitness_df_no_conc0 changed it's len")
 
-    fitness_df = fitness_df_conc0.append(fitness_df_no_conc0)
+    fitness_df = pd.concat([fitness_df_conc0, fitness_df_no_conc0], sort=False)
 
     return fitness_df
 
@@ -3300,171 +4456,282 @@ def load_object(filename):
     
     return pickle.load(open(filename,"rb"))
 
+####### MEMORY-MAPPED TABLES #######
 
-def generate_merged_image_test_bad_spot(plate_batch, plate, row, column, df_offsets, df_growth, merged_images_bad_spots_dir, processed_images_dir_each_plate, plate_batch_to_images, box_size, hours_experiment):
+# A memory-mapped table is a dir with one .npy file per column (object columns are stored as integer codes of categories), sorted by an index field. Workers read only the rows of one index value (with np.load(mmap_mode="r")), without deserializing the whole table.
 
-    """Generates one merged image for a bad spot"""
+def save_df_as_memmap_table(df, table_dir, index_field):
 
-    # define the final merged image
-    final_image = "%s/%s_%s_%s_%s.tif"%(merged_images_bad_spots_dir, plate_batch, plate, row, column)
-    if file_is_empty(final_image):
+    """Saves df as a memory-mapped table in table_dir, sorted by index_field (keeping the original order within each value)"""
 
-        # checks
-        if len(df_offsets[["row", "column"]].drop_duplicates())!=len(df_offsets): raise ValueError("combinations should be unique")
-        if len(df_offsets)<3: raise ValueError("There have to be >=3 replicates to infer bad spots")
+    # sort
+    df = df.sort_values(by=index_field, kind="mergesort").reset_index(drop=True)
 
-        ###### CREATE IMAGES ####
+    # save each column into a tmp dir
+    table_dir_tmp = "%s.tmp"%table_dir; delete_folder(table_dir_tmp); make_folder(table_dir_tmp)
+    column_to_categories = {}
+    for Ic, column in enumerate(df.columns):
 
-        # keep only grwoth of hours experiment
-        days_experiment = hours_experiment/24
-        df_growth = df_growth[df_growth["Expt.Time"]<=days_experiment]
+        if df[column].dtype.kind not in "biuf":
+            categorical_values = pd.Categorical(df[column])
+            column_to_categories[column] = list(categorical_values.categories)
+            values = categorical_values.codes
 
-        # define valid images (those that are below hours experiment)
-        df_growth["img_file"] = df_growth["Date.Time"].apply(get_img_file_from_DateTime)
-        valid_images = set(df_growth["img_file"])
+        else: values = df[column].values
 
-        # define images
-        all_images = [img for img in plate_batch_to_images[plate_batch] if img in valid_images] 
-        if set(all_images)!=valid_images: raise ValueError("all_images is different to valid_images")
-        if len(all_images)<3: raise ValueError("There are <3 images for plate_batch %s. This does not allow for a proper analysis"%plate_batch)
+        np.save("%s/column_%i.npy"%(table_dir_tmp, Ic), values)
 
-        # get subset of images
-        subset_images = [all_images[int(idx)] for idx in np.linspace(0, len(all_images)-1, 3)]
+    # get the rows of each value of the index field
+    positions = pd.Series(np.arange(len(df)), index=df[index_field].values)
+    index_value_to_rows = {index_value : (min(p), max(p)+1) for index_value, p in positions.groupby(level=0)}
 
-        # Open the four images
-        dir_images = "%s/%s_plate%i"%(processed_images_dir_each_plate, plate_batch, plate)
-        image1 = PIL_Image.open("%s/%s"%(dir_images, subset_images[0]))
-        image2 = PIL_Image.open("%s/%s"%(dir_images, subset_images[1]))
-        image3 = PIL_Image.open("%s/%s"%(dir_images, subset_images[2]))
+    # save the metadata and rename
+    save_object({"columns":list(df.columns), "column_to_categories":column_to_categories, "index_field":index_field, "index_value_to_rows":index_value_to_rows, "nrows":len(df)}, "%s/metadata.py"%table_dir_tmp)
+    delete_folder(table_dir)
+    os.rename(table_dir_tmp, table_dir)
 
-        # Get the size of the first input image
-        width, height = image1.size
-        #compression = image1.info.get('compression', 'tiff_lzw')
+def load_memmap_table(table_dir, index_value=None, fields=None):
 
-        # add the bad spots in the first three quadrants
-        for img in [image1, image2, image3]:
+    """Loads the rows of a memory-mapped table (saved with save_df_as_memmap_table) where the index field is index_value (or all rows if None), with the columns in fields (or all if None)"""
 
-            # init draw object
-            draw = ImageDraw.Draw(img)
+    # get the rows
+    metadata = load_object("%s/metadata.py"%table_dir)
+    if index_value is None: start, end = 0, metadata["nrows"]
+    elif index_value in metadata["index_value_to_rows"]: start, end = metadata["index_value_to_rows"][index_value]
+    else: start, end = 0, 0
 
-            # one square for each offset
-            for I, r in df_offsets.iterrows():
+    # get the columns
+    if fields is None: fields = metadata["columns"]
+    column_to_values = {}
+    for column in fields:
 
-                # define locations
-                x = r.XOffset
-                y = r.YOffset
+        values = np.array(np.load("%s/column_%i.npy"%(table_dir, metadata["columns"].index(column)), mmap_mode="r")[start:end])
+        if column in metadata["column_to_categories"]: values = pd.Categorical.from_codes(values, metadata["column_to_categories"][column]).astype(object)
+        column_to_values[column] = values
 
-                # add rectangle
-                if r.row==row and r.column==column: color = "red"
-                else: color = "black"
-                draw.rectangle((x, y, x + box_size, y + box_size), outline=color, width=8) # x0, y0, x1, y1
+    return pd.DataFrame(column_to_values, columns=fields)
 
-        # define a size of the textbox to add ttiles
-        size_textbox = int(height/10)
+####################################
 
-        # Create a new image with the size of the first input image and mode 'RGB'
-        merged_image = PIL_Image.new('RGB', (2*width, 2*height + 2*size_textbox), (255, 255, 255))
+####### INTEGER KEYS #######
 
-        # Paste the four input images into the merged image
-        merged_image.paste(image1, (0, size_textbox))
-        merged_image.paste(image2, (width, size_textbox))
-        merged_image.paste(image3, (0, height + size_textbox*2))
+# Integer keys of the spots, strains, drugs and samples, used for merges, groupbys and isin instead of object columns. The categories are taken from the plate layout, so that the keys are consistent across all tables of a run. They are not written into the outputs.
 
-        #########################
+integer_key_fields = ["spot_idx", "strain_code", "drug_code", "sample_code"]
 
-        ###### CREATE GROWTH CURVES PLOT ######
+def get_codes_series(series, categories):
 
-        # define is potential bad spot
-        df_growth["type spot"] = ((df_growth.row==row) & (df_growth.column==column)).map({True:"potential bad spot", False:"other spots"})
-        df_growth["spot"] = df_growth.row + df_growth.column.apply(str)
+    """Returns a series with the integer code of each value of series in the categories (a sorted list)"""
 
+    codes = pd.Categorical(series, categories=categories).codes
+    if any(codes<0): raise ValueError("There are values not in the categories: %s"%(set(series[codes<0])))
 
-        # checks
-        if len(df_growth[["Expt.Time", "spot"]].drop_duplicates())!=len(df_growth): raise ValueError("for each spot there should be one timepoint for one timepoint")
+    return pd.Series(codes, index=series.index).astype(int)
 
-        # init figure to mimic the ones of the images
-        dpi = 100
-        fig_size = (width/dpi, height/dpi)
-        fig = plt.figure(figsize=fig_size)
+def add_integer_keys_to_df(df, df_plate_layout):
 
-        # create
-        sns.set(font_scale=2)
-        df_growth["hours"] = df_growth["Expt.Time"] * 24
-        ax = sns.lineplot(data=df_growth, x="hours", y="Growth", hue="type spot", units="spot",  estimator=None, lw=3, palette={"potential bad spot":"red", "other spots":"black"})
+    """Takes a df with plate_batch, plate, row (as a number) and column (and optionally strain and drug) and returns it with the integer keys of df_plate_layout: a dense spot_idx for each plate_batch, plate, row and column, strain_code, drug_code and sample_code (one for each strain and replicateID)"""
 
-        ax.set_xlabel("Time (hours)")
-        ax.set_ylabel("Cell density (AU)")
+    df = cp.deepcopy(df)
 
-        # save
-        filename_curves = "%s.growth_curves.png"%final_image
-        fig.savefig(filename_curves, bbox_inches='tight', dpi=dpi)
-        plt.close(fig)
+    # add the spot idx (there can be 4 plates for each plate batch, with the rows and columns of plate_format)
+    nrows, ncols = get_plate_nrows_and_ncols()
+    plate_batch_code = get_codes_series(df.plate_batch, sorted(set(df_plate_layout.plate_batch)))
+    df["spot_idx"] = ((plate_batch_code*4 + (df.plate-1))*nrows + (df.row-1))*ncols + (df.column-1)
 
-        # add to the merged image
-        image_curves = PIL_Image.open(filename_curves)
-        merged_image.paste(image_curves, (width + size_textbox, height + int(size_textbox*2.5)))
+    # add the codes of strains, drugs and samples
+    if "strain" in df.keys(): 
+        df["strain_code"] = get_codes_series(df.strain, sorted(set(df_plate_layout.strain)))
+        df["sample_code"] = (df.strain_code*nrows + (df.row-1))*ncols + (df.column-1)
 
-        #######################################
+    if "drug" in df.keys(): df["drug_code"] = get_codes_series(df.drug, sorted(set(df_plate_layout.drug)))
 
-        #### ADD TITLES AND SAVE ######
+    return df
 
-        # add the titles of the images
-        draw_merged = ImageDraw.Draw(merged_image)
+############################
 
-        # define the font 
-        fontsize = int(width/18)
-        font = ImageFont.truetype("/opt/conda/envs/main_env/lib/python3.6/site-packages/matplotlib/mpl-data/fonts/ttf/DejaVuSansMono.ttf", fontsize)
 
-        # define the titles of the four quadrants
-        title_texts = []
-        for image_name in subset_images:
-            day = image_name.split("_")[-2]
-            timepoint = image_name.split("_")[-1].split(".")[0]
-            title_texts.append("%s/%s/%s, %s:%s"%(day[0:4], day[4:6], day[6:8], timepoint[0:2], timepoint[2:4]))
+def get_growth_curves_image_bad_spot(fig, df_growth, row, column):
 
-        # add the title of the curves
-        title_texts.append("Growth curves")
+    """Plots the growth curves of one strain in fig (a figure that is reused for all the spots of a plate), with the potential bad spot (row, column) in red. Returns the plot as a PIL image"""
 
-        # add titles
-        for I,text in enumerate(title_texts):
+    # init the axes
+    fig.clf()
+    ax = fig.add_subplot(111)
 
-            # get the text size
-            w, h = draw.textsize(text, font=font)
+    # add one line for each spot, with the potential bad spot on top
+    for (spot_row, spot_column), df_spot in df_growth.groupby(["row", "column"]):
+        if spot_row!=row or spot_column!=column: ax.plot(df_spot.hours.values, df_spot.Growth.values, color="black", lw=3)
 
-            # get coords
-            if I==0:
-                text_x = int((width - w) / 2)
-                text_y = int((size_textbox - h) / 2)
+    df_bad_spot = df_growth[(df_growth.row==row) & (df_growth.column==column)]
+    ax.plot(df_bad_spot.hours.values, df_bad_spot.Growth.values, color="red", lw=3)
 
-            elif I==1:
-                text_x = width + int((width - w) / 2)
-                text_y = int((size_textbox - h) / 2)
+    ax.legend(handles=[patches.Patch(color="red", label="potential bad spot"), patches.Patch(color="black", label="other spots")], title="type spot")
+    ax.set_xlabel("Time (hours)")
+    ax.set_ylabel("Cell density (AU)")
 
-            elif I==2:
-                text_x = int((width - w) / 2)
-                text_y = size_textbox + height + int((size_textbox - h) / 2)
+    # get the image, without writing it
+    buffer_image = io.BytesIO()
+    fig.savefig(buffer_image, bbox_inches='tight', dpi=fig.dpi)
+    buffer_image.seek(0)
 
-            elif I==3:
-                text_x = width + int((width - w) / 2)
-                text_y = size_textbox + height + int((size_textbox - h) / 2)
-            
-            # add 
-            draw_merged.text((text_x, text_y), text, fill="black", font=font)
+    return PIL_Image.open(buffer_image)
+
+def generate_merged_images_test_bad_spots_one_plate(plate_batch, plate, bad_spots_plate, offsets_table_dir, growth_table_dir, merged_images_bad_spots_dir, processed_images_dir_each_plate, images_plate_batch, box_size, hours_experiment):
+
+    """Generates the merged images of all the potential bad spots of one plate (bad_spots_plate, a list of (row, column, strain)). The images of the plate are opened once, and each strain's boxes are drawn once for all its bad spots. The offsets and growth of the spots are read from the memory-mapped tables offsets_table_dir and growth_table_dir (indexed by strain). images_plate_batch are the sorted images of plate_batch."""
+
+    # define the bad spots without a merged image
+    df_bad_spots_plate = pd.DataFrame(bad_spots_plate, columns=["row", "column", "strain"])
+    df_bad_spots_plate["final_image"] = df_bad_spots_plate.apply(lambda r: "%s/%s_%s_%s_%s.tif"%(merged_images_bad_spots_dir, plate_batch, plate, r.row, r.column), axis=1)
+    df_bad_spots_plate = df_bad_spots_plate[df_bad_spots_plate.final_image.apply(file_is_empty)]
+    if len(df_bad_spots_plate)==0: return
+
+    # load the offsets and growth of the strains of the bad spots, in this plate
+    num_to_letter = dict(zip(range(1, get_plate_nrows_and_ncols()[0]+1), get_plate_row_letters()))
+    def load_spots_of_plate(table_dir, fields):
+        df = pd.concat([load_memmap_table(table_dir, index_value=strain, fields=fields) for strain in sorted(set(df_bad_spots_plate.strain))]).reset_index(drop=True)
+        df = df[(df.plate_batch==plate_batch) & (df.plate==plate)].reset_index(drop=True)
+        df["row"] = df.row.apply(lambda x: num_to_letter[x])
+        return df
 
-        # generate downsized_image_file
-        original_w, original_h = merged_image.size
-        factor_resize = 900/original_w
-        merged_image = merged_image.resize((int(original_w*factor_resize), int(original_h*factor_resize)))
+    df_offsets = load_spots_of_plate(offsets_table_dir, ["plate_batch", "plate", "row", "column", "strain", "XOffset", "YOffset"])
+    df_growth = load_spots_of_plate(growth_table_dir, ["plate_batch", "plate", "row", "column", "strain", "Growth", "Expt.Time", "Date.Time"])
 
-        # remove the image of the curves
-        remove_file(filename_curves)
+    ###### OPEN IMAGES ####
 
-        # Save the merged image with the same compression level as the first image
-        final_image_tmp = "%s.tmp.tif"%final_image
-        merged_image.save(final_image_tmp)
-        os.rename(final_image_tmp, final_image)
+    # keep only grwoth of hours experiment
+    days_experiment = hours_experiment/24
+    df_growth = df_growth[df_growth["Expt.Time"]<=days_experiment].copy()
 
-        ###############################
+    # define valid images (those that are below hours experiment)
+    df_growth["img_file"] = df_growth["Date.Time"].apply(get_img_file_from_DateTime)
+    valid_images = set(df_growth["img_file"])
+
+    # define images
+    all_images = [img for img in images_plate_batch if img in valid_images] 
+    if set(all_images)!=valid_images: raise ValueError("all_images is different to valid_images")
+    if len(all_images)<3: raise ValueError("There are <3 images for plate_batch %s. This does not allow for a proper analysis"%plate_batch)
+
+    # get subset of images
+    subset_images = [all_images[int(idx)] for idx in np.linspace(0, len(all_images)-1, 3)]
+
+    # open the three images, once for all spots
+    dir_images = "%s/%s_plate%i"%(processed_images_dir_each_plate, plate_batch, plate)
+    plate_images = [PIL_Image.open("%s/%s"%(dir_images, img)) for img in subset_images]
+    for img in plate_images: img.load()
+
+    # Get the size of the first input image
+    width, height = plate_images[0].size
+
+    # define a size of the textbox to add ttiles
+    size_textbox = int(height/10)
+
+    #########################
+
+    #### CREATE THE BACKGROUND WITH TITLES ######
+
+    # Create a new image with the size of the first input image and mode 'RGB'
+    background_image = PIL_Image.new('RGB', (2*width, 2*height + 2*size_textbox), (255, 255, 255))
+    draw_background = ImageDraw.Draw(background_image)
+
+    # define the font 
+    fontsize = int(width/18)
+    font = ImageFont.truetype("%s/fonts/ttf/DejaVuSansMono.ttf"%matplotlib.get_data_path(), fontsize)
+
+    # define the titles of the four quadrants
+    title_texts = []
+    for image_name in subset_images:
+        day = image_name.split("_")[-2]
+        timepoint = image_name.split("_")[-1].split(".")[0]
+        title_texts.append("%s/%s/%s, %s:%s"%(day[0:4], day[4:6], day[6:8], timepoint[0:2], timepoint[2:4]))
+
+    # add the title of the curves
+    title_texts.append("Growth curves")
+
+    # add titles
+    for I,text in enumerate(title_texts):
+
+        # get the text size
+        w, h = draw_background.textsize(text, font=font)
+
+        # get coords
+        if I==0:
+            text_x = int((width - w) / 2)
+            text_y = int((size_textbox - h) / 2)
+
+        elif I==1:
+            text_x = width + int((width - w) / 2)
+            text_y = int((size_textbox - h) / 2)
+
+        elif I==2:
+            text_x = int((width - w) / 2)
+            text_y = size_textbox + height + int((size_textbox - h) / 2)
+
+        elif I==3:
+            text_x = width + int((width - w) / 2)
+            text_y = size_textbox + height + int((size_textbox - h) / 2)
+        
+        # add 
+        draw_background.text((text_x, text_y), text, fill="black", font=font)
+
+    ###############################
+
+    #### CREATE THE MERGED IMAGES OF EACH STRAIN #####
+
+    # init figure to mimic the ones of the images
+    dpi = 100
+    sns.set(font_scale=2)
+    fig = plt.figure(figsize=(width/dpi, height/dpi), dpi=dpi)
+
+    df_growth["hours"] = df_growth["Expt.Time"] * 24
+    df_growth["spot"] = df_growth.row + df_growth.column.apply(str)
+
+    for strain, df_bad_spots_strain in df_bad_spots_plate.groupby("strain"):
+
+        # get the offsets and growth of this strain
+        df_offsets_strain = df_offsets[df_offsets.strain==strain]
+        df_growth_strain = df_growth[df_growth.strain==strain]
+
+        # checks
+        if len(df_offsets_strain[["row", "column"]].drop_duplicates())!=len(df_offsets_strain): raise ValueError("combinations should be unique")
+        if len(df_offsets_strain)<3: raise ValueError("There have to be >=3 replicates to infer bad spots")
+        if len(df_growth_strain[["Expt.Time", "spot"]].drop_duplicates())!=len(df_growth_strain): raise ValueError("for each spot there should be one timepoint for one timepoint")
+
+        # add one black square for each offset of the strain
+        strain_images = [img.copy() for img in plate_images]
+        for img in strain_images:
+            draw = ImageDraw.Draw(img)
+            for x, y in df_offsets_strain[["XOffset", "YOffset"]].values: draw.rectangle((x, y, x + box_size, y + box_size), outline="black", width=8) # x0, y0, x1, y1
+
+        # generate the image of each bad spot
+        for row, column, final_image in df_bad_spots_strain[["row", "column", "final_image"]].values:
+
+            # add the red square of the bad spot
+            spot_images = [img.copy() for img in strain_images]
+            x, y = df_offsets_strain.loc[(df_offsets_strain.row==row) & (df_offsets_strain.column==column), ["XOffset", "YOffset"]].values[0]
+            for img in spot_images: ImageDraw.Draw(img).rectangle((x, y, x + box_size, y + box_size), outline="red", width=8)
+
+            # Paste the three images and the growth curves into the merged image
+            merged_image = background_image.copy()
+            merged_image.paste(spot_images[0], (0, size_textbox))
+            merged_image.paste(spot_images[1], (width, size_textbox))
+            merged_image.paste(spot_images[2], (0, height + size_textbox*2))
+            merged_image.paste(get_growth_curves_image_bad_spot(fig, df_growth_strain, row, column), (width + size_textbox, height + int(size_textbox*2.5)))
+
+            # generate downsized_image_file
+            original_w, original_h = merged_image.size
+            factor_resize = 900/original_w
+            merged_image = merged_image.resize((int(original_w*factor_resize), int(original_h*factor_resize)))
+
+            # Save the merged image
+            final_image_tmp = "%s.tmp.tif"%final_image
+            merged_image.save(final_image_tmp)
+            os.rename(final_image_tmp, final_image)
+
+    plt.close(fig)
+
+    ###############################
 
 # functions fitness
 def get_rsquare_to0(rsq):
@@ -3476,9 +4743,43 @@ def get_DT_good_rsq(DT_h, rsq, rsq_tshd=0.9):
     if rsq>=rsq_tshd: return DT_h
     else: return maxDT_h
 
-def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, outdir, min_nAUC_to_beConsideredGrowing, reference_plate, hours_experiment):
+def get_df_fitness_with_derived_spot_fields(df_fit, rsq_tshd=0.9):
+
+    """Takes a fitness df (with row, column, rsquare and DT_h) and adds spotID, clips rsquare to >=0 and adds DT_h_goodR2 (DT_h if rsquare>=rsq_tshd, maxDT_h otherwise) and inv_DT_h_goodR2. These are column operations equivalent to get_rsquare_to0 and get_DT_good_rsq."""
+
+    df_fit["spotID"] = df_fit.row.astype(str) + "_" + df_fit.column.astype(str)
+    df_fit["rsquare"] = np.where(df_fit.rsquare>0, df_fit.rsquare, 0.0) # nans are also set to 0
+    df_fit["DT_h_goodR2"] = np.where(df_fit.rsquare>=rsq_tshd, df_fit.DT_h, maxDT_h)
+    df_fit["inv_DT_h_goodR2"] = 1 / df_fit.DT_h_goodR2
+
+    return df_fit
+
+def get_df_fitness_measurements_from_fits_all_plates(df_fits_all, df_plate_layout, min_nAUC_to_beConsideredGrowing):
+
+    """Table preparation of STEP 3. It takes the logRegression_fits of all plates (with plate_batch and plate) and the plate layout (with integer keys) and returns the df_fitness_measurements, with the derived per-spot fields (spotID, rsquare, DT_h_goodR2, replicateID, sampleID and is_growing). All fields are calculated as column operations, so that this scales linearly with the number of spots."""
+
+    # keep some fields
+    merge_fields = ["plate_batch", "plate", "row", "column"]
+    df_fitness_measurements = get_df_fitness_with_derived_spot_fields(df_fits_all.rename(columns={"Row":"row", "Column":"column"}))
+    df_fitness_measurements_interesting_fields = merge_fields + ['spotID', 'Inoc.Time', 'XOffset', 'YOffset', 'K', 'r', 'g', 'v', 'objval', 'd0', 'nAUC', 'nSTP', 'nr', 'nr_t', 'maxslp', 'maxslp_t', 'Gene', 'MDP', 'MDR', 'MDRMDP', 'glog_maxslp', 'DT', 'AUC', 'rsquare', 'DT_h', 'DT_h_goodR2', 'inv_DT_h_goodR2']
+
+    # merge the plate layout
+    df_fitness_measurements = add_integer_keys_to_df(df_fitness_measurements[df_fitness_measurements_interesting_fields], df_plate_layout)
+    df_fitness_measurements = df_fitness_measurements.merge(df_plate_layout.drop(columns=merge_fields), how="left", on="spot_idx", validate="one_to_one").reset_index(drop=True)
+
+    # checks
+    validate_df_schema(df_fitness_measurements, {k : {"nan":False} for k in df_fitness_measurements.keys()}, "fitness measurements", unique_fields=["spot_idx"])
+
+    # add fields that are necessary to run the subsequent calculations
+    df_fitness_measurements["replicateID"] = np.array(get_plate_row_letters(), dtype=object)[df_fitness_measurements.row.values-1] + df_fitness_measurements.column.astype(str)
+    df_fitness_measurements["sampleID"] = df_fitness_measurements.strain + "_" + df_fitness_measurements.replicateID
+    df_fitness_measurements["is_growing"]  = df_fitness_measurements.nAUC>=min_nAUC_to_beConsideredGrowing # the nAUC to be considered growing
 
-    """Generates the fitness measurements."""
+    return df_fitness_measurements
+
+def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, outdir, min_nAUC_to_beConsideredGrowing, reference_plate, hours_experiment, timepoint_subsampling="none", fitness_engine="R", growth_curve_plots="end", interim_fitness_hours=None, bad_spot_features=None):
+
+    """Generates the fitness measurements. timepoint_subsampling and fitness_engine ('R' or 'python') are passed to get_growth_measurements_one_plate_batch_and_plate. If growth_curve_plots is 'background' the growth curve plots are rendered in a background process while the rest of the step runs. Otherwise ('end' or 'none') they are not rendered here. interim_fitness_hours is a list of times (<hours_experiment) at which interim fitness measurements are written into extended_outputs/interim_fitness (None means no interim measurements). bad_spot_features are the fitness estimates used to detect potential bad spots (see generate_df_w_potential_bad_spots, None means only 'nAUC')."""
 
     #### LOAD DATA ####
 
@@ -3493,8 +4794,9 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
     extended_outdir = "%s/extended_outputs"%outdir
     if not os.path.isdir(extended_outdir): raise ValueError("extended_outdir should exist")
 
-    # define several dirs of the final output
-    growth_curves_dir = "%s/growth_curves"%extended_outdir; make_folder(growth_curves_dir) # a dir with a plot for each growth curve
+    # define the interim fitness times
+    if interim_fitness_hours is None: interim_fitness_hours = []
+    if bad_spot_features is None: bad_spot_features = ["nAUC"]
 
     ###################
 
@@ -3524,9 +4826,32 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
     # go through each plate and plate set and run the growth calculations
     print("Getting fitness measurements in parallel on %i threads..."%multiproc.cpu_count())
 
-    inputs_fn_growth = [(I+1, len(inputs_fn_coords), proc_images_folder, "%s/%s_plate%i"%(outdir_growth_calculations, plate_batch, plate), plate_batch, plate, plate_batch_to_images[plate_batch], processed_images_dir_each_plate, reference_plate, cp.deepcopy(df_plate_layout), hours_experiment) for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords)]
+    inputs_fn_growth = [(I+1, len(inputs_fn_coords), proc_images_folder, "%s/%s_plate%i"%(outdir_growth_calculations, plate_batch, plate), plate_batch, plate, plate_batch_to_images[plate_batch], processed_images_dir_each_plate, reference_plate, cp.deepcopy(df_plate_layout), hours_experiment, timepoint_subsampling, fitness_engine) for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords)]
     run_function_in_parallel(inputs_fn_growth, get_growth_measurements_one_plate_batch_and_plate)
 
+    # run the fitness engine on all the plates at once (a single R session or python process)
+    outdirs_colonyzer = ["%s/%s_plate%i/output_%s"%(outdir_growth_calculations, plate_batch, plate, "_".join(sorted(parms_colonyzer))) for proc_images_folder, plate_batch, plate in inputs_fn_coords]
+    outdirs_colonyzer_missing = [d for d in outdirs_colonyzer if file_is_empty("%s/all_images_data.tab"%d)]
+
+    # get the interim fitness measurements, which also warm-start the final fit of the python engine
+    log_params0 = None
+    if len(interim_fitness_hours)>0:
+        print_with_runtime("Getting interim fitness measurements at %s hours..."%(", ".join(["%g"%h for h in sorted(interim_fitness_hours)])))
+        interim_fitness_dir = "%s/interim_fitness"%extended_outdir; make_folder(interim_fitness_dir)
+        outdir_colonyzer_to_plate = dict(zip(outdirs_colonyzer, [(plate_batch, plate) for proc_images_folder, plate_batch, plate in inputs_fn_coords]))
+        log_params0 = run_interim_fitness_measurements(outdir_colonyzer_to_plate, interim_fitness_hours, df_plate_layout, interim_fitness_dir)
+
+    if len(outdirs_colonyzer_missing)>0:
+        print_with_runtime("Fitting growth curves of %i plates with the %s engine..."%(len(outdirs_colonyzer_missing), fitness_engine))
+        run_fitness_engine(fitness_engine, outdirs_colonyzer_missing, hours_experiment/24, threads=multiproc.cpu_count(), log_params0=log_params0)
+        for d in outdirs_colonyzer_missing: os.rename("%s/processed_all_data.tbl"%d, "%s/all_images_data.tab"%d)
+
+    # render the growth curves in the background, while the fitness tables and bad spots are generated
+    if growth_curve_plots=="background":
+        print_with_runtime("Plotting growth curves in the background...")
+        process_growth_curves_plots = multiproc.Process(target=generate_growth_curves_plots, args=(outdir, fitness_engine, hours_experiment))
+        process_growth_curves_plots.start()
+
     ####################################################
 
     ######## GET INTEGRATED GROWTH DF ##########
@@ -3537,7 +4862,7 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
 
     # generate df
     print("Generating table with all growth / fitness measurements")
-    df_growth_measurements_all = pd.DataFrame()
+    table_growth_measurements_all = init_table()
     for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords): 
 
         # get the growth measurements for all time points
@@ -3550,14 +4875,12 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
         df_growth_measurements = df_growth_measurements.rename(columns={"Row":"row", "Column":"column"})[df_growth_fields]
 
         # print nans in blueMeanBack
-        df_test = df_growth_measurements[df_growth_measurements[["blueMeanBack", "greenMeanBack", "redMeanBack"]].apply(pd.isna, axis=1).apply(any, axis=1)][["Trimmed", "Expt.Time"]]
-        if len(df_test)>0: raise ValueError("There are NaNs in columns blueMeanBack, greenMeanBack, redMeanBack of df_growth_measurements for %s plate %i. This could be because there are no spots growing in the plate, which means that this plate cannot be analyzed. If this is the case, you may skip this plate by leaving it empty in the plate layout excel."%(plate_batch, plate))
+        if df_growth_measurements[["blueMeanBack", "greenMeanBack", "redMeanBack"]].isna().values.any(): raise ValueError("There are NaNs in columns blueMeanBack, greenMeanBack, redMeanBack of df_growth_measurements for %s plate %i. This could be because there are no spots growing in the plate, which means that this plate cannot be analyzed. If this is the case, you may skip this plate by leaving it empty in the plate layout excel."%(plate_batch, plate))
 
         # keep
-        df_growth_measurements_all = df_growth_measurements_all.append(df_growth_measurements)
+        add_df_to_table(table_growth_measurements_all, df_growth_measurements)
 
-        # keep the growth curves in the final output
-        copy_file("%s/output_plots.pdf"%outdir_p, "%s/batch_%s-plate%i.pdf"%(growth_curves_dir, plate_batch, plate))
+    df_growth_measurements_all = get_df_from_table(table_growth_measurements_all)
 
     # get the pseudocount
     pseudocounts_g = set(df_growth_measurements_all[df_growth_measurements_all["Timeseries.order"]==1].Growth)
@@ -3566,10 +4889,7 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
 
     # checks of growth
     df_growth_measurements_all["Growth_no_pseudo"] = df_growth_measurements_all.Growth - growth_pseudocount
-    check_no_nans_series(df_growth_measurements_all["Growth"])
-    if any(df_growth_measurements_all["Growth_no_pseudo"]<0): raise ValueError("Growth should be >=0")
-    if any(df_growth_measurements_all["Growth"]==np.inf): raise ValueError("Growth should not be inf")
-    if any(df_growth_measurements_all["Growth"]==-np.inf): raise ValueError("Growth should not be -inf")
+    validate_df_schema(df_growth_measurements_all, {"Growth":{"nan":False, "inf":False}, "Growth_no_pseudo":{"min":0}}, "growth measurements")
 
     growth_pseudocount_fraction_max = growth_pseudocount / max(df_growth_measurements_all["Growth_no_pseudo"])
     if growth_pseudocount_fraction_max>0.1: raise ValueError("The pseudocount added on growth should not be >10% of the maximum growth")
@@ -3577,21 +4897,23 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
     
     # add fields
     df_growth_measurements_all["experiment_name"] = experiment_name
-    df_growth_measurements_all = df_growth_measurements_all.merge(df_plate_layout, how="left", left_on=merge_fields, right_on=merge_fields, validate="many_to_one").reset_index(drop=True)
+    df_plate_layout = add_integer_keys_to_df(df_plate_layout, df_plate_layout)
+    df_growth_measurements_all = add_integer_keys_to_df(df_growth_measurements_all, df_plate_layout)
+    df_growth_measurements_all = df_growth_measurements_all.merge(df_plate_layout.drop(columns=merge_fields), how="left", on="spot_idx", validate="many_to_one").reset_index(drop=True)
 
     # checks
-    for k in set(df_growth_measurements_all.keys()).difference({"redMean", "greenMean", "blueMean"}): check_no_nans_series(df_growth_measurements_all[k])
+    validate_df_schema(df_growth_measurements_all, {k : {"nan":False} for k in set(df_growth_measurements_all.keys()).difference({"redMean", "greenMean", "blueMean"})}, "growth measurements (with the plate layout)")
 
     # save
     save_df_as_tab(df_growth_measurements_all[df_growth_fields], "%s/growth_measurements_all_timepoints.csv"%extended_outdir)
-    save_object(df_growth_measurements_all, "%s/growth_measurements_all_timepoints.py"%tmpdir)
+    save_df_as_memmap_table(df_growth_measurements_all, "%s/growth_measurements_all_timepoints_table"%tmpdir, "strain")
 
     ######################################
 
     ############ GET INTEGRATED FITNESS DF ################
 
     print("Generating table with fitness estimates...")
-    df_fitness_measurements = pd.DataFrame()
+    table_fitness_measurements = init_table()
     for I, (proc_images_folder, plate_batch, plate) in enumerate(inputs_fn_coords): 
 
         # get the fitness df
@@ -3600,22 +4922,22 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
         # add fields
         df_fitness_measurements_batch["plate"] = plate
         df_fitness_measurements_batch["plate_batch"] = plate_batch
-        df_fitness_measurements_batch["spotID"] = df_fitness_measurements_batch.apply(lambda r: "%s_%s"%(r["Row"], r["Column"]), axis=1)
-        df_fitness_measurements_batch["rsquare"] = df_fitness_measurements_batch.rsquare.apply(get_rsquare_to0)
-        df_fitness_measurements_batch["DT_h_goodR2"] = df_fitness_measurements_batch.apply(lambda r: get_DT_good_rsq(r["DT_h"], r["rsquare"]), axis=1)
-        df_fitness_measurements_batch["inv_DT_h_goodR2"] = 1 / df_fitness_measurements_batch.DT_h_goodR2
 
         # keep
-        df_fitness_measurements = df_fitness_measurements.append(df_fitness_measurements_batch)
+        add_df_to_table(table_fitness_measurements, df_fitness_measurements_batch)
 
-    # keep some fields and merge the df_fitness_measurements
-    df_fitness_measurements = df_fitness_measurements.rename(columns={"Row":"row", "Column":"column"})
-    df_fitness_measurements_interesting_fields = merge_fields + ['spotID', 'Inoc.Time', 'XOffset', 'YOffset', 'K', 'r', 'g', 'v', 'objval', 'd0', 'nAUC', 'nSTP', 'nr', 'nr_t', 'maxslp', 'maxslp_t', 'Gene', 'MDP', 'MDR', 'MDRMDP', 'glog_maxslp', 'DT', 'AUC', 'rsquare', 'DT_h', 'DT_h_goodR2', 'inv_DT_h_goodR2']
-    df_fitness_measurements = df_fitness_measurements[df_fitness_measurements_interesting_fields]
-    df_fitness_measurements = df_fitness_measurements.merge(df_plate_layout, how="left", left_on=merge_fields, right_on=merge_fields, validate="one_to_one").reset_index(drop=True)
+    # get the df with the plate layout and the derived fields
+    df_fitness_measurements = get_df_fitness_measurements_from_fits_all_plates(get_df_from_table(table_fitness_measurements), df_plate_layout, min_nAUC_to_beConsideredGrowing)
 
-    # checks
-    for k in df_fitness_measurements.keys(): check_no_nans_series(df_fitness_measurements[k])
+    # report the drift of the fitness estimates caused by timepoint subsampling
+    if timepoint_subsampling=="adaptive_check":
+
+        df_drift = pd.concat([get_tab_as_df_or_empty_df("%s/%s_plate%i/output_%s/timepoint_subsampling_drift.tab"%(outdir_growth_calculations, plate_batch, plate, "_".join(sorted(parms_colonyzer)))) for proc_images_folder, plate_batch, plate in inputs_fn_coords]).reset_index(drop=True)
+        save_df_as_tab(df_drift, "%s/timepoint_subsampling_drift.csv"%extended_outdir)
+
+        for fe in ["K", "r", "nAUC", "DT_h"]: 
+            rel_drift = df_drift["%s_rel_drift"%fe].replace([np.inf, -np.inf], np.nan).dropna()
+            print("Timepoint subsampling drift in %s (relative to the full-resolution run): median %.4f, 95th percentile %.4f"%(fe, np.median(rel_drift), np.percentile(rel_drift, 95)))
 
     #######################################################
 
@@ -3623,14 +4945,7 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
     print_with_runtime("Detecting bad spots...")
 
     # create an df with the potential bad spots
-    df_bad_spots = generate_df_w_potential_bad_spots(df_fitness_measurements, min_nAUC_to_beConsideredGrowing)
-
-    # add fields to the fitness df that are necessary to run the subsequent calculations
-    number_to_letter = dict(zip(range(1,9), list("ABCDEFGH")))
-    df_fitness_measurements["replicateID"] = df_fitness_measurements.row.apply(lambda x: number_to_letter[x]) + df_fitness_measurements.column.apply(str)
-    df_fitness_measurements["sampleID"] = df_fitness_measurements.strain + "_" + df_fitness_measurements.replicateID
-    #df_fitness_measurements["log2_concentration"] = np.log2(df_fitness_measurements.concentration + pseudocount_log2_concentration)
-    df_fitness_measurements["is_growing"]  = df_fitness_measurements.nAUC>=min_nAUC_to_beConsideredGrowing # the nAUC to be considered growing
+    df_bad_spots = generate_df_w_potential_bad_spots(df_fitness_measurements, min_nAUC_to_beConsideredGrowing, bad_spot_features=bad_spot_features)
 
     # create merged images to validate bad spots
     df_bad_spots_auto = df_bad_spots[df_bad_spots.bad_spot_reason!="manual setting in plate layout"]
@@ -3640,32 +4955,33 @@ def run_analyze_images_get_fitness_measurements(plate_layout_file, images_dir, o
         merged_images_bad_spots_dir = "%s/merged_images_bad_spots"%tmpdir
         delete_folder(merged_images_bad_spots_dir); make_folder(merged_images_bad_spots_dir)
 
-        # define a df with the spot locations
-        df_offsets = cp.deepcopy(df_fitness_measurements[["plate_batch", "plate", "row", "column", "strain", "XOffset", "YOffset"]])
-        df_offsets["numeric_row"] = df_offsets.row
-        num_to_letter = dict(zip(range(1,9), "ABCDEFGH"))
-        df_offsets["row"] = df_offsets.row.apply(lambda x: num_to_letter[x])
-
-        # define a df with the growth at different timepoints
-        df_growth_all = cp.deepcopy(df_growth_measurements_all[["plate_batch", "plate", "row", "column", "strain", "Growth", "Expt.Time", "Date.Time"]]).set_index(["plate_batch", "plate", "strain"], drop=False)
-        df_growth_all["row"] = df_growth_all.row.apply(lambda x: num_to_letter[x])
+        # define a df with the spot locations, saved as a memory-mapped table (as the growth at different timepoints) that is read by the jobs of each plate
+        df_offsets = df_fitness_measurements[["plate_batch", "plate", "row", "column", "strain", "XOffset", "YOffset"]]
+        offsets_table_dir = "%s/bad_spots_offsets_table"%tmpdir
+        save_df_as_memmap_table(df_offsets, offsets_table_dir, "strain")
 
         # define the box size as the mean of distance between adjacent boxes. This is specific to each plate
-        df_offsets = df_offsets.set_index(["numeric_row", "column"], drop=False)
+        df_offsets = df_offsets.set_index(["row", "column"], drop=False)
         plate_batch_and_plate_to_box_size = {}
         for plate_batch, plate in df_bad_spots_auto[["plate_batch", "plate"]].drop_duplicates().values:
             df_offsets_plate = df_offsets[(df_offsets.plate_batch==plate_batch) & (df_offsets.plate==plate)]
 
-            box_size_rows = [df_offsets_plate.loc[(n_row+1, 1), "YOffset"] - df_offsets_plate.loc[(n_row, 1), "YOffset"] for n_row in range(1,8)]
-            box_size_cols = [df_offsets_plate.loc[(1, col+1), "XOffset"] - df_offsets_plate.loc[(1, col), "XOffset"] for col in range(1,12)]
+            nrows, ncols = get_plate_nrows_and_ncols()
+            box_size_rows = [df_offsets_plate.loc[(n_row+1, 1), "YOffset"] - df_offsets_plate.loc[(n_row, 1), "YOffset"] for n_row in range(1, nrows)]
+            box_size_cols = [df_offsets_plate.loc[(1, col+1), "XOffset"] - df_offsets_plate.loc[(1, col), "XOffset"] for col in range(1, ncols)]
 
             plate_batch_and_plate_to_box_size[(plate_batch, plate)] = int(np.mean(box_size_rows + box_size_cols))
 
-        # run generation of images in parallel
+        # run generation of images in parallel, one job for each plate (which only gets the keys of its bad spots)
         #print_with_runtime("Generating bad-spot images in parallel in %i threads..."%multiproc.cpu_count())
-        df_offsets = df_offsets.set_index(["plate_batch", "plate", "strain"])
-        inputs_fn_bad_spots = [(r.plate_batch, r.plate, r.row, r.column, cp.deepcopy(df_offsets.loc[{(r.plate_batch, r.plate, r.strain)}]), cp.deepcopy(df_growth_all.loc[{(r.plate_batch, r.plate, r.strain)}].reset_index(drop=True)), merged_images_bad_spots_dir, processed_images_dir_each_plate, plate_batch_to_images, plate_batch_and_plate_to_box_size[(r.plate_batch, r.plate)], hours_experiment) for I, r in df_bad_spots_auto.iterrows()]
-        run_function_in_parallel(inputs_fn_bad_spots, generate_merged_image_test_bad_spot)
+        growth_table_dir = "%s/growth_measurements_all_timepoints_table"%tmpdir
+        inputs_fn_bad_spots = [(plate_batch, plate, [tuple(x) for x in df_bad_spots_plate[["row", "column", "strain"]].values], offsets_table_dir, growth_table_dir, merged_images_bad_spots_dir, processed_images_dir_each_plate, plate_batch_to_images[plate_batch], plate_batch_and_plate_to_box_size[(plate_batch, plate)], hours_experiment) for (plate_batch, plate), df_bad_spots_plate in df_bad_spots_auto.groupby(["plate_batch", "plate"])]
+        run_function_in_parallel(inputs_fn_bad_spots, generate_merged_images_test_bad_spots_one_plate)
+
+    # wait for the growth curves
+    if growth_curve_plots=="background":
+        process_growth_curves_plots.join()
+        if process_growth_curves_plots.exitcode!=0: raise ValueError("The plotting of growth curves failed")
 
     # save files, marking the end
     save_object(df_fitness_measurements, "%s/df_fitness_measurements.py"%tmpdir)
@@ -3683,9 +4999,68 @@ def get_img_file_from_DateTime(dt):
 
     return "img_0_%s%s%s_%s%s.tif"%(year, month, day, hour, minunte)
 
-def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_fitness, outdir, plots_dir, hours_experiment, field_type_spot):
+def get_montage_subset_images(all_images, nimages_subset=3):
 
-    """For one strain, generate a plot that has all the images and growth curves. Each column should be one concentration."""
+    """Returns the images (evenly spaced in all_images, sorted by time) that are shown in the montages of growth curves and images"""
+
+    return [all_images[int(idx)] for idx in np.linspace(0, len(all_images)-1, nimages_subset)]
+
+def generate_montage_frames_one_plate(plate_batch, plate, image_files, processed_images_dir_each_plate, frames_dir, montage_image_scale):
+
+    """Opens the images (image_files) of one plate once, and saves them resized by montage_image_scale as .npy arrays in frames_dir. These are read by generate_plot_growth_curves_and_images_one_strain_and_drug for all strains, without decoding the images again."""
+
+    frames_dir_plate = "%s/%s_plate%i"%(frames_dir, plate_batch, plate); make_folder(frames_dir_plate)
+    for img_file in image_files:
+
+        frame_file = "%s/%s.npy"%(frames_dir_plate, img_file)
+        if file_is_empty(frame_file):
+
+            # get the resized image
+            image_object = PIL_Image.open("%s/%s_plate%i/%s"%(processed_images_dir_each_plate, plate_batch, plate, img_file)).convert("RGB")
+            w, h = image_object.size
+            if montage_image_scale!=1: image_object = image_object.resize((int(w*montage_image_scale), int(h*montage_image_scale)))
+
+            # save
+            frame_file_tmp = "%s.tmp.npy"%frame_file
+            np.save(frame_file_tmp, np.array(image_object))
+            os.rename(frame_file_tmp, frame_file)
+
+def get_growth_curves_and_images_inputs_dirs(outdir, montage_image_scale):
+
+    """Returns the dirs of the inputs of the growth_curves_and_images plots (the growth measurements table and the montage frames), which are saved in extended_outputs (and not in tmp), so that the plots can be rendered after the run. The scale is in the name of the frames dir, so that frames resized with a different montage_image_scale are not reused."""
+
+    inputs_dir = "%s/extended_outputs/growth_curves_and_images_inputs"%outdir
+    return "%s/growth_measurements_all_timepoints_table"%inputs_dir, "%s/montage_frames_scale%s"%(inputs_dir, montage_image_scale)
+
+def save_growth_curves_and_images_inputs(outdir, hours_experiment, montage_image_scale):
+
+    """Saves the inputs of the growth_curves_and_images plots (see get_growth_curves_and_images_inputs_dirs) from the files of <outdir>/tmp. It returns the growth table dir and the frames dir."""
+
+    tmpdir = "%s/tmp"%outdir
+    growth_table_dir, frames_dir = get_growth_curves_and_images_inputs_dirs(outdir, montage_image_scale)
+
+    # copy the growth measurements table
+    if not os.path.isdir(growth_table_dir):
+        growth_table_dir_tmp = "%s.tmp"%growth_table_dir; delete_folder(growth_table_dir_tmp)
+        shutil.copytree("%s/growth_measurements_all_timepoints_table"%tmpdir, growth_table_dir_tmp)
+        os.rename(growth_table_dir_tmp, growth_table_dir)
+
+    # decode the images shown in the plots once for each plate (and not once for each strain), saving the resized frames
+    if not os.path.isdir(frames_dir):
+        print("Getting the images of the plots with growth curves and images...")
+        frames_dir_tmp = "%s.tmp"%frames_dir; make_folder(frames_dir_tmp)
+        df_images = load_memmap_table(growth_table_dir, fields=["plate_batch", "plate", "Expt.Time", "Date.Time"]).drop_duplicates()
+        df_images = df_images[df_images["Expt.Time"]<=(hours_experiment/24)].sort_values(by=["plate_batch", "plate", "Expt.Time"])
+        df_images["img_file"] = df_images["Date.Time"].apply(get_img_file_from_DateTime)
+        inputs_fn_frames = [(plate_batch, plate, get_montage_subset_images(list(df_p.img_file)), "%s/processed_images_each_plate"%tmpdir, frames_dir_tmp, montage_image_scale) for (plate_batch, plate), df_p in df_images.groupby(["plate_batch", "plate"])]
+        run_function_in_parallel(inputs_fn_frames, generate_montage_frames_one_plate)
+        os.rename(frames_dir_tmp, frames_dir)
+
+    return growth_table_dir, frames_dir
+
+def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_fitness, growth_table_dir, plots_dir, hours_experiment, field_type_spot, plate_batch_and_plate_to_box_size, frames_dir, montage_image_scale):
+
+    """For one strain, generate a plot that has all the images and growth curves. Each column should be one concentration. plate_batch_and_plate_to_box_size maps each plate to the size of the boxes drawn around the spots. The growth measurements are read from the memory-mapped table growth_table_dir, and the images from frames_dir (generated by generate_montage_frames_one_plate), and the whole plot is resized by montage_image_scale."""
 
     # define filename
     filename = "%s/growth_curves_and_images_%s_%s.png"%(plots_dir, drug, strain)
@@ -3694,13 +5069,13 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
 
         #### GET INPUTS ####
 
-        # get df growth of this strain and drug
-        df_growth_all = load_object("%s/tmp/growth_measurements_all_timepoints.py"%outdir)
+        # get df growth of this strain (only its rows are read) and drug
+        df_growth_strain = load_memmap_table(growth_table_dir, index_value=strain)
 
         merge_fields = ["plate_batch", "plate", "row", "column"]
         extra_fields = ["replicateID", "nAUC", field_type_spot]
 
-        df_growth = df_growth_all.merge(df_fitness[merge_fields + extra_fields].drop_duplicates(), on=merge_fields, validate="many_to_one", how="left")
+        df_growth = df_growth_strain.merge(df_fitness[merge_fields + extra_fields].drop_duplicates(), on=merge_fields, validate="many_to_one", how="left")
         df_growth = df_growth[(df_growth.strain==strain) & ((df_growth.drug==drug) | (df_growth.concentration==0))]
         for f in extra_fields: check_no_nans_series(df_growth[f])
         df_growth["img_file"] = df_growth["Date.Time"].apply(get_img_file_from_DateTime)
@@ -3710,7 +5085,6 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
         df_growth = df_growth[df_growth["Expt.Time"]<=days_experiment]
 
         # get the images of each plate batch
-        processed_images_dir_each_plate = "%s/tmp/processed_images_each_plate"%outdir
         plate_batch_plate_to_images = {(plate_batch, plate) : list(df_growth[(df_growth.plate_batch==plate_batch) & (df_growth.plate==plate)][["Expt.Time", "img_file"]].drop_duplicates().sort_values(by="Expt.Time").img_file) for plate_batch, plate in df_fitness[["plate_batch", "plate"]].drop_duplicates().values}
 
         # define all the concentrations
@@ -3718,8 +5092,8 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
 
         # init output_image
         first_pb, first_p = list(plate_batch_plate_to_images.keys())[0]
-        test_image = "%s/%s_plate%i/%s"%(processed_images_dir_each_plate, first_pb, first_p, plate_batch_plate_to_images[(first_pb, first_p)][0])
-        single_image_w, single_image_h = PIL_Image.open(test_image).size
+        test_frame = "%s/%s_plate%i/%s.npy"%(frames_dir, first_pb, first_p, get_montage_subset_images(plate_batch_plate_to_images[(first_pb, first_p)])[0])
+        single_image_h, single_image_w = np.load(test_frame, mmap_mode="r").shape[0:2]
         width_midbox = int(single_image_w/30)
         nimages_subset= 3
         merged_image = PIL_Image.new('RGB', (len(sorted_concentrations)*single_image_w + width_midbox*(len(sorted_concentrations)+1), (nimages_subset+1)*single_image_h + width_midbox*(nimages_subset+2)), (255, 255, 255))
@@ -3745,9 +5119,9 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
             spot_to_color = {spot : repID_to_color[repID] for spot,repID in df_g[["spot & nAUC", "replicateID"]].drop_duplicates().values}
             df_g["type spot"] = df_g[field_type_spot].map({True:"used", False:"discarded"}); check_no_nans_series(df_g["type spot"])
 
-            # init figure to mimic the ones of the images
+            # init figure to mimic the ones of the images (with the size of the original images, saved with a resolution that gives the size of the frames)
             dpi = 100
-            fig_size = (single_image_w/dpi, single_image_h/dpi)
+            fig_size = (single_image_w/montage_image_scale/dpi, single_image_h/montage_image_scale/dpi)
             fig = plt.figure(figsize=fig_size)
 
             # create
@@ -3766,7 +5140,7 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
 
             # save
             filename_curves = "%s.growth_curves_%s.png"%(filename, concentration)
-            fig.savefig(filename_curves, bbox_inches='tight', dpi=dpi)
+            fig.savefig(filename_curves, bbox_inches='tight', dpi=dpi*montage_image_scale)
             plt.close(fig)
 
             # add to the merged image
@@ -3788,20 +5162,19 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
             if len(all_pb_ps)!=1: raise ValueError("there should be only 1")
             plate_batch, plate = next(iter(all_pb_ps))
             all_images = plate_batch_plate_to_images[(plate_batch, plate)]
-            subset_images = [all_images[int(idx)] for idx in np.linspace(0, len(all_images)-1, nimages_subset)]
+            subset_images = get_montage_subset_images(all_images, nimages_subset=nimages_subset)
 
-            # define the box_size
-            df_offsets_plate = df_growth_all[(df_growth_all.plate_batch==plate_batch) & (df_growth_all.plate==plate) & (df_growth_all["Expt.Time"]==0)][["row", "column", "X.Offset", "Y.Offset"]].drop_duplicates().set_index(["row", "column"], drop=False)
-
-            box_size_rows = [df_offsets_plate.loc[(n_row+1, 1), "Y.Offset"] - df_offsets_plate.loc[(n_row, 1), "Y.Offset"] for n_row in range(1,8)]
-            box_size_cols = [df_offsets_plate.loc[(1, col+1), "X.Offset"] - df_offsets_plate.loc[(1, col), "X.Offset"] for col in range(1,12)]
-            box_size = int(np.mean(box_size_rows + box_size_cols))
+            # define the box_size and the width of the boxes in the frames
+            box_size = plate_batch_and_plate_to_box_size[(plate_batch, plate)]*montage_image_scale
+            box_width = max([1, int(round(7*montage_image_scale))])
 
             # each image
             for Ii, img_file in enumerate(subset_images):
                 
-                # load image
-                image_object = PIL_Image.open("%s/%s_plate%i/%s"%(processed_images_dir_each_plate, plate_batch, plate, img_file))
+                # load the frame, which was decoded once for all strains
+                frame_file = "%s/%s_plate%i/%s.npy"%(frames_dir, plate_batch, plate, img_file)
+                if file_is_empty(frame_file): raise ValueError("The frame %s should exist"%frame_file)
+                image_object = PIL_Image.fromarray(np.load(frame_file))
 
                 # check
                 w,h = image_object.size
@@ -3813,9 +5186,9 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
 
                 # add one square to each spot
                 for idx, r in df_growth[(df_growth.img_file==img_file) & (df_growth.plate_batch==plate_batch) & (df_growth.plate==plate)].iterrows():
-                    x = r["X.Offset"]
-                    y = r["Y.Offset"]
-                    draw.rectangle((x, y, x + box_size, y + box_size), outline=repID_to_color[r.replicateID], width=7) # x0, y0, x1, y1
+                    x = r["X.Offset"]*montage_image_scale
+                    y = r["Y.Offset"]*montage_image_scale
+                    draw.rectangle((x, y, x + box_size, y + box_size), outline=repID_to_color[r.replicateID], width=box_width) # x0, y0, x1, y1
 
                 # add to merged image
                 merged_image.paste(image_object, ((Ic*single_image_w) + (Ic*width_midbox) + width_midbox, width_midbox + (Ii+1)*width_midbox + (Ii+1)*single_image_h))
@@ -3829,12 +5202,12 @@ def generate_plot_growth_curves_and_images_one_strain_and_drug(strain, drug, df_
 
 
 
-def plot_heatmap_raw_fitness_all_drugs_one_fe(df_fit, filename, all_strains, fitness_estimate, min_nAUC_to_beConsideredGrowing, experiment_name, row_cluster=True):
+def plot_heatmap_raw_fitness_all_drugs_one_fe(df_fit, filename, filename_no_clustering, all_strains, fitness_estimate, min_nAUC_to_beConsideredGrowing, experiment_name):
 
-    """Plots the heatmap for one fitness estimate, all drugs"""
+    """Plots the heatmaps for one fitness estimate, all drugs, with the strains clustered (filename) and sorted (filename_no_clustering). The data and the clustering of the strains are calculated once for both"""
 
     # skip
-    if not file_is_empty(filename): return
+    if not file_is_empty(filename) and not file_is_empty(filename_no_clustering): return
 
     # set parms
     matplotlib.use('Agg')
@@ -3872,9 +5245,6 @@ def plot_heatmap_raw_fitness_all_drugs_one_fe(df_fit, filename, all_strains, fit
     sorted_drugs = sorted(set(df_fit_per_strain.drug))
     df_plot = df_fit_per_strain.pivot(index="strain", columns="drug", values="median %s"%fitness_estimate)[sorted_drugs].applymap(get_nan_to_0)
 
-    # adjust clustering
-    if row_cluster is False: df_plot = df_plot.loc[sorted(df_plot.index)]
-
     # define the annot df to flag weird concentrations
     def get_annot_for_n_reps(x):
         if pd.isna(x): return "X"
@@ -3884,76 +5254,88 @@ def plot_heatmap_raw_fitness_all_drugs_one_fe(df_fit, filename, all_strains, fit
 
     df_annot = df_fit_per_strain.pivot(index="strain", columns="drug", values="# replicates").loc[df_plot.index, df_plot.columns].applymap(get_annot_for_n_reps)
 
-    # get clustermap
+    # map the value to color
     max_val = max(df_fit_per_strain.upper_bound_median)
     cmap_name = "Greens" # rocket_r
-    g = sns.clustermap(df_plot, row_cluster=row_cluster, col_cluster=False, cmap=cmap_name, linecolor="gray", linewidth=0.5, cbar_kws={'label': "median(%s)"%fitness_estimate}, vmin=0, vmax=max_val, annot=df_annot, annot_kws={"size": 13}, fmt="",  yticklabels=1) # 
-
-    # map the value to color
     all_vals = sorted(get_uniqueVals_df(df_fit_per_strain[["median %s"%fitness_estimate, "upper_bound_median", "lower_bound_median"]]))
     val_to_color = get_value_to_color(all_vals, palette=cmap_name, n=len(all_vals), type_color="hex", center=None)[0]
 
-    # get the ordered ytick labels as in g
-    ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
-    if set(ordered_strains)!=set(df_plot.index): raise ValueError("The yticklabels should include all strains")
+    # get the clustering of the strains, shared by both heatmaps
+    df_plot_all = df_plot
+    row_linkage = get_row_linkage_heatmap(df_plot_all)
 
-    # add the MAD for strains with >1 replicate
-    for Id, drug in enumerate(sorted_drugs):
-        for Is, strain in enumerate(ordered_strains):
+    # plot the heatmaps with clustered and sorted strains
+    for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
+        if not file_is_empty(file): continue
 
-            # get row of df_fit_per_strain
-            df = df_fit_per_strain[(df_fit_per_strain.drug==drug) & (df_fit_per_strain.strain==strain)]
-            if len(df)==0: continue
-            if len(df)!=1: raise ValueError("df should be 1")
-            r = df.iloc[0]
-            if r["# replicates"]<2: continue
+        # adjust clustering
+        if row_cluster is True: df_plot = df_plot_all
+        else: df_plot = df_plot_all.loc[sorted(df_plot_all.index)]
 
-            for Iv, val in enumerate([r.lower_bound_median, r.upper_bound_median]): g.ax_heatmap.scatter([Id+0.33*(1+Iv)], [Is+0.5], edgecolor="gray", facecolor=val_to_color[val],  s=25, linewidth=.4)
+        # get clustermap
+        g = sns.clustermap(df_plot, row_cluster=row_cluster, row_linkage={True:row_linkage, False:None}[row_cluster], col_cluster=False, cmap=cmap_name, linecolor="gray", linewidth=0.5, cbar_kws={'label': "median(%s)"%fitness_estimate}, vmin=0, vmax=max_val, annot=df_annot.loc[df_plot.index], annot_kws={"size": 13}, fmt="",  yticklabels=1) # 
 
-    # change positions
-    hm_height_multiplier = 0.04
-    hm_width_multiplier = 0.04
-    distance_btw_boxes = 0.01
-    rd_width = 0.08
-    cbar_width = 0.04
+        # get the ordered ytick labels as in g
+        ordered_strains = [s.get_text() for s in g.ax_heatmap.get_yticklabels()]
+        if set(ordered_strains)!=set(df_plot.index): raise ValueError("The yticklabels should include all strains")
 
-    hm_height = len(df_plot)*hm_height_multiplier
-    hm_width = len(df_plot.columns)*hm_width_multiplier
+        # add the MAD for strains with >1 replicate
+        for Id, drug in enumerate(sorted_drugs):
+            for Is, strain in enumerate(ordered_strains):
 
-    hm_pos = g.ax_heatmap.get_position()
-    cb_pos = g.ax_cbar.get_position()
-    hm_y0 = cb_pos.y1 - hm_height
-    #hm_y0 = (hm_pos.y0+hm_pos.height)-hm_height
-    g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
+                # get row of df_fit_per_strain
+                df = df_fit_per_strain[(df_fit_per_strain.drug==drug) & (df_fit_per_strain.strain==strain)]
+                if len(df)==0: continue
+                if len(df)!=1: raise ValueError("df should be 1")
+                r = df.iloc[0]
+                if r["# replicates"]<2: continue
 
-    rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
-    g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
+                for Iv, val in enumerate([r.lower_bound_median, r.upper_bound_median]): g.ax_heatmap.scatter([Id+0.33*(1+Iv)], [Is+0.5], edgecolor="gray", facecolor=val_to_color[val],  s=25, linewidth=.4)
 
-    cbar_height = hm_height_multiplier*4
-    g.ax_cbar.set_position([rd_pos.x0 - rd_width - distance_btw_boxes*8, rd_pos.y0 + hm_pos.height - cbar_height,cbar_width, cbar_height])
+        # change positions
+        hm_height_multiplier = 0.04
+        hm_width_multiplier = 0.04
+        distance_btw_boxes = 0.01
+        rd_width = 0.08
+        cbar_width = 0.04
 
-    # labels
-    g.ax_heatmap.set_xticklabels(sorted_drugs, rotation=90, fontsize=fontsize_all)
-    g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
-    g.ax_heatmap.set_xlabel("condition", fontsize=fontsize_all)
-    g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
-    g.ax_cbar.set_yticklabels([y.get_text() for y in g.ax_cbar.get_yticklabels()], fontsize=fontsize_all)
-    g.ax_cbar.set_ylabel(fitness_estimate, fontsize=fontsize_all)
+        hm_height = len(df_plot)*hm_height_multiplier
+        hm_width = len(df_plot.columns)*hm_width_multiplier
 
-    # add title
-    g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
+        hm_pos = g.ax_heatmap.get_position()
+        cb_pos = g.ax_cbar.get_position()
+        hm_y0 = cb_pos.y1 - hm_height
+        #hm_y0 = (hm_pos.y0+hm_pos.height)-hm_height
+        g.ax_heatmap.set_position([hm_pos.x0, hm_y0, hm_width, hm_height]); hm_pos = g.ax_heatmap.get_position()
 
-    # add description at the bottom
-    description = "drug vs fitness (estimated by '%s')\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(fitness_estimate)
+        rd_x0 = hm_pos.x0 - rd_width - distance_btw_boxes
+        g.ax_row_dendrogram.set_position([rd_x0, hm_pos.y0, rd_width, hm_pos.height]); rd_pos = g.ax_row_dendrogram.get_position()
 
-    description += get_fe_description(fitness_estimate, 'only_not_bad_spots', min_nAUC_to_beConsideredGrowing)
-    g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
+        cbar_height = hm_height_multiplier*4
+        g.ax_cbar.set_position([rd_pos.x0 - rd_width - distance_btw_boxes*8, rd_pos.y0 + hm_pos.height - cbar_height,cbar_width, cbar_height])
 
-    # save
-    filename_tmp = "%s.tmp.pdf"%filename
-    g.savefig(filename_tmp,  bbox_inches="tight")
-    #plt.close(g)
-    os.rename(filename_tmp, filename)
+        # labels
+        g.ax_heatmap.set_xticklabels(sorted_drugs, rotation=90, fontsize=fontsize_all)
+        g.ax_heatmap.set_yticklabels(ordered_strains, fontsize=fontsize_all, rotation=0)
+        g.ax_heatmap.set_xlabel("condition", fontsize=fontsize_all)
+        g.ax_heatmap.set_ylabel("strain", fontsize=fontsize_all)
+        g.ax_cbar.set_yticklabels([y.get_text() for y in g.ax_cbar.get_yticklabels()], fontsize=fontsize_all)
+        g.ax_cbar.set_ylabel(fitness_estimate, fontsize=fontsize_all)
+
+        # add title
+        g.ax_heatmap.set_title(experiment_name+"\n", fontsize=fontsize_all)
+
+        # add description at the bottom
+        description = "drug vs fitness (estimated by '%s')\nSquares: Median; Circles: MAD; 1: One replicate; X: Not available\n\n"%(fitness_estimate)
+
+        description += get_fe_description(fitness_estimate, 'only_not_bad_spots', min_nAUC_to_beConsideredGrowing)
+        g.ax_heatmap.text(0, len(df_plot) + 3 + (len(description.split("\n"))*0.5), description, horizontalalignment='left', verticalalignment='bottom')
+
+        # save
+        filename_tmp = "%s.tmp.pdf"%file
+        g.savefig(filename_tmp,  bbox_inches="tight")
+        plt.close(g.fig)
+        os.rename(filename_tmp, file)
 
 
 def plot_heatmaps_raw_fitness_all_drugs(df_fitness_measurements, plots_dir_all, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name):
@@ -3974,27 +5356,214 @@ def plot_heatmaps_raw_fitness_all_drugs(df_fitness_measurements, plots_dir_all,
     all_strains = sorted(set(df_fitness_measurements.strain))
 
     # one plot for each estimator
+    inputs_fn = []
     for fitness_estimate in fitness_estimates:
 
         # get plot
         filename = "%s/raw_%s_across_drugs_heatmap.pdf"%(plots_dir_all, fitness_estimate)
         filename_no_clustering = "%s/raw_%s_across_drugs_heatmap.no_clustering.pdf"%(plots_dir_all, fitness_estimate)
 
-        for file, row_cluster in [(filename, True), (filename_no_clustering, False)]:
+        # add the inputs of both heatmaps
+        if file_is_empty(filename) or file_is_empty(filename_no_clustering):
+            check_no_nans_series(df_fitness_measurements[fitness_estimate])
+            inputs_fn.append((df_fitness_measurements[["drug", "concentration", "strain", "row", "column", fitness_estimate]], filename, filename_no_clustering, all_strains, fitness_estimate, min_nAUC_to_beConsideredGrowing, experiment_name))
+
+    # run in parallel
+    if len(inputs_fn)>0: run_plotting_function_in_parallel(inputs_fn, plot_heatmap_raw_fitness_all_drugs_one_fe)
+
+####### PLOT REGISTRY #######
+
+# Each type of plot in extended_outputs/<plot type> is declared in plot_type_to_info, with the function that renders it (taking plot_inputs, the plots dir and the fitness estimates), the plot_inputs that it needs, whether it is made for experiments with susceptibility measurements (True), without them (False) or in both (None), the fitness estimates that can be plotted (None if not applicable) and whether it is in the summary set (rendered by default, only for nAUC). STEP 5 renders the summary set (or all plots with --plots all), and the other plots can be rendered later from the saved tables with run_render_plots.
+
+fitness_estimates_all = ["K", "r", "nr", "nr_t", "maxslp", "maxslp_t", "MDP", "MDR", "MDRMDP", "DT", "AUC", "DT_h", "nAUC", "DT_h_goodR2", "nSTP"] # all the fitness estimates
+fitness_estimates_susceptibility = ["K", "r", "nr", "maxslp", "MDP", "MDR", "MDRMDP", "AUC", "nAUC", "nSTP"] # estimates that are correlated to growth rate, used in the susceptibility measurements
+fitness_estimates_summary = ["nAUC"] # the fitness estimates of the summary plots
+
+def render_growth_curves_and_images(plot_inputs, plots_dir, fitness_estimates):
+
+    """Renders, for each drug and strain, the plot with the growth curves and images (see generate_plot_growth_curves_and_images_one_strain_and_drug). It needs the growth measurements and montage frames saved by save_growth_curves_and_images_inputs."""
+
+    # define inputs
+    growth_table_dir = plot_inputs["growth_measurements"]
+    frames_dir = plot_inputs["montage_frames"]
+    df_fitness_measurements = plot_inputs["fitness_measurements"]
+    hours_experiment = plot_inputs["hours_experiment"]
+    montage_image_scale = plot_inputs["montage_image_scale"]
+
+    # define the drugs and strains
+    make_folder(plots_dir)
+    all_drugs = sorted(set(df_fitness_measurements[df_fitness_measurements.concentration!=0].drug))
+    all_strains = sorted(set(df_fitness_measurements.strain))
+
+    # define the box size of each plate as the mean distance between adjacent spots at t=0
+    df_offsets_t0 = load_memmap_table(growth_table_dir, fields=["plate_batch", "plate", "row", "column", "X.Offset", "Y.Offset", "Expt.Time"])
+    df_offsets_t0 = df_offsets_t0[df_offsets_t0["Expt.Time"]==0][["plate_batch", "plate", "row", "column", "X.Offset", "Y.Offset"]].drop_duplicates().set_index(["plate_batch", "plate", "row", "column"], drop=False)
+    plate_batch_and_plate_to_box_size = {}
+    nrows, ncols = get_plate_nrows_and_ncols()
+    for plate_batch, plate in df_offsets_t0[["plate_batch", "plate"]].drop_duplicates().values:
+        box_size_rows = [df_offsets_t0.loc[(plate_batch, plate, n_row+1, 1), "Y.Offset"] - df_offsets_t0.loc[(plate_batch, plate, n_row, 1), "Y.Offset"] for n_row in range(1, nrows)]
+        box_size_cols = [df_offsets_t0.loc[(plate_batch, plate, 1, col+1), "X.Offset"] - df_offsets_t0.loc[(plate_batch, plate, 1, col), "X.Offset"] for col in range(1, ncols)]
+        plate_batch_and_plate_to_box_size[(plate_batch, plate)] = int(np.mean(box_size_rows + box_size_cols))
+
+    for drug in all_drugs:
+        print("Getting plots with growth curves and images for drug %s..."%drug)
+
+        outdir_plots = "%s/%s"%(plots_dir, drug); make_folder(outdir_plots)
+        df_fit = df_fitness_measurements[(df_fitness_measurements.drug==drug) | (df_fitness_measurements.concentration==0)]
+        inputs_fn_plots_strain = [(s, drug, cp.deepcopy(df_fit[df_fit.strain==s]), growth_table_dir, outdir_plots, hours_experiment, {True:"idx_correct_rel_estimates", False:"not_bad_spot"}[plot_inputs["measure_susceptibility"]], plate_batch_and_plate_to_box_size, frames_dir, montage_image_scale) for I,s in enumerate(all_strains)]
+        run_function_in_parallel(inputs_fn_plots_strain, generate_plot_growth_curves_and_images_one_strain_and_drug)
+
+def render_drug_vs_fitness_heatmaps(plot_inputs, plots_dir, fitness_estimates):
+
+    """Renders the heatmaps of concentration-vs-fitness"""
+
+    plot_heatmaps_concentration_vs_fitness(plot_inputs["fitness_measurements"], plots_dir, fitness_estimates, plot_inputs["min_nAUC_to_beConsideredGrowing"], plot_inputs["experiment_name"])
+
+def render_drug_vs_fitness_lines(plot_inputs, plots_dir, fitness_estimates):
+
+    """Renders the lineplots of concentration-vs-fitness"""
+
+    plot_growth_at_different_drugs(plot_inputs["fitness_measurements"], plots_dir, fitness_estimates, plot_inputs["min_nAUC_to_beConsideredGrowing"], plot_inputs["experiment_name"], type_data="only_correct_spots", only_absolute_estimates=False)
+
+def render_drug_vs_fitness_lines_all_spots(plot_inputs, plots_dir, fitness_estimates):
+
+    """Renders the lineplots of concentration-vs-fitness with all spots (also the bad spots)"""
+
+    plot_growth_at_different_drugs(plot_inputs["fitness_measurements"], plots_dir, fitness_estimates, plot_inputs["min_nAUC_to_beConsideredGrowing"], plot_inputs["experiment_name"], type_data="all_data", only_absolute_estimates=True)
+
+def render_susceptibility_heatmaps(plot_inputs, plots_dir, fitness_estimates):
 
-            if file_is_empty(file):
+    """Renders the heatmaps of the susceptibility measurements"""
 
-                # checks
-                check_no_nans_series(df_fitness_measurements[fitness_estimate])
-                df_fit = cp.deepcopy(df_fitness_measurements)
+    print("Getting susceptibility measurements raw...")
+    plot_heatmap_susceptibility(plot_inputs["susceptibility_measurements"], plots_dir, fitness_estimates, plot_inputs["experiment_name"], plot_inputs["min_nAUC_to_beConsideredGrowing"], "raw")
 
-                # get plot
-                plot_heatmap_raw_fitness_all_drugs_one_fe(df_fit, file, all_strains, fitness_estimate, min_nAUC_to_beConsideredGrowing, experiment_name, row_cluster=row_cluster)
+def render_susceptibility_heatmaps_log_scale(plot_inputs, plots_dir, fitness_estimates):
 
-def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_layout_file, images_dir, outdir, keep_tmp_files, min_nAUC_to_beConsideredGrowing, hours_experiment):
+    """Renders the heatmaps of the susceptibility measurements, with rAUC and MIC in log scale"""
+
+    print("Getting susceptibility measurements log...")
+    plot_heatmap_susceptibility(plot_inputs["susceptibility_measurements"], plots_dir, fitness_estimates, plot_inputs["experiment_name"], plot_inputs["min_nAUC_to_beConsideredGrowing"], "log")
+
+def render_drug_vs_raw_fitness_heatmaps(plot_inputs, plots_dir, fitness_estimates):
+
+    """Renders the heatmaps of raw fitness across drugs"""
+
+    plot_heatmaps_raw_fitness_all_drugs(plot_inputs["fitness_measurements"], plots_dir, fitness_estimates, plot_inputs["min_nAUC_to_beConsideredGrowing"], plot_inputs["experiment_name"])
+
+plot_type_to_info = {"growth_curves_and_images" : {"function":render_growth_curves_and_images, "inputs":["fitness_measurements", "growth_measurements", "montage_frames"], "susceptibility":None, "fitness_estimates":None, "summary":False},
+                     "drug_vs_fitness_heatmaps" : {"function":render_drug_vs_fitness_heatmaps, "inputs":["fitness_measurements"], "susceptibility":True, "fitness_estimates":fitness_estimates_all, "summary":True},
+                     "drug_vs_fitness_lines" : {"function":render_drug_vs_fitness_lines, "inputs":["fitness_measurements"], "susceptibility":True, "fitness_estimates":fitness_estimates_all, "summary":True},
+                     "drug_vs_fitness_lines_all_spots" : {"function":render_drug_vs_fitness_lines_all_spots, "inputs":["fitness_measurements"], "susceptibility":True, "fitness_estimates":fitness_estimates_all, "summary":True},
+                     "susceptibility_heatmaps" : {"function":render_susceptibility_heatmaps, "inputs":["susceptibility_measurements"], "susceptibility":True, "fitness_estimates":fitness_estimates_susceptibility, "summary":True},
+                     "susceptibility_heatmaps_log_scale" : {"function":render_susceptibility_heatmaps_log_scale, "inputs":["susceptibility_measurements"], "susceptibility":True, "fitness_estimates":fitness_estimates_susceptibility, "summary":False},
+                     "drug_vs_raw_fitness_heatmaps" : {"function":render_drug_vs_raw_fitness_heatmaps, "inputs":["fitness_measurements"], "susceptibility":False, "fitness_estimates":fitness_estimates_all, "summary":True}}
+
+def get_missing_inputs_plot_type(plot_inputs, plot_type):
+
+    """Returns the inputs of plot_type that are not in plot_inputs"""
+
+    return [i for i in plot_type_to_info[plot_type]["inputs"] if i not in plot_inputs]
+
+def get_plot_types_to_render(plot_inputs, plots):
+
+    """Returns the plot types rendered with plots ('summary' or 'all'), which are those that fit the experiment (with or without susceptibility measurements) and have all the inputs"""
+
+    if plots not in {"summary", "all"}: raise ValueError("plots should be 'summary' or 'all'")
+
+    plot_types = []
+    for plot_type, info in plot_type_to_info.items():
+
+        if plots=="summary" and info["summary"] is False: continue
+        if info["susceptibility"] not in {None, plot_inputs["measure_susceptibility"]}: continue
+        if len(get_missing_inputs_plot_type(plot_inputs, plot_type))>0: continue
+        plot_types.append(plot_type)
+
+    return plot_types
+
+def render_plots(plot_inputs, plot_types, plots):
+
+    """Renders each of plot_types into <outdir>/extended_outputs/<plot type>, for all the fitness estimates (plots='all') or for the summary ones (plots='summary'). The plots that already exist are not rendered again."""
+
+    for plot_type in plot_types:
+
+        info = plot_type_to_info[plot_type]
+        missing_inputs = get_missing_inputs_plot_type(plot_inputs, plot_type)
+        if len(missing_inputs)>0: raise ValueError("The %s plots need these missing inputs: %s"%(plot_type, ", ".join(missing_inputs)))
+
+        if info["fitness_estimates"] is None: fitness_estimates = None
+        elif plots=="summary": fitness_estimates = [fe for fe in info["fitness_estimates"] if fe in fitness_estimates_summary]
+        elif plots=="all": fitness_estimates = info["fitness_estimates"]
+        else: raise ValueError("plots should be 'summary' or 'all'")
+
+        info["function"](plot_inputs, "%s/extended_outputs/%s"%(plot_inputs["outdir"], plot_type), fitness_estimates)
+
+def get_plot_inputs_from_saved_tables(outdir, min_nAUC_to_beConsideredGrowing, hours_experiment, montage_image_scale):
+
+    """Returns the plot_inputs of a finished run in outdir, loading the tables of extended_outputs. The inputs of the growth_curves_and_images plots are only available if they were saved (at montage_image_scale) by the run."""
+
+    # load the fitness measurements, with the fields added in STEP 5
+    fitness_file = "%s/extended_outputs/fitness_measurements.csv"%outdir
+    if file_is_empty(fitness_file): raise ValueError("%s should exist. The plots can only be rendered for a finished run"%fitness_file)
+    df_fitness_measurements = get_tab_as_df_or_empty_df(fitness_file)
+    for f in ["plate_batch", "strain", "drug", "replicateID", "sampleID", "experiment_name"]: 
+        if f in df_fitness_measurements.keys(): df_fitness_measurements[f] = df_fitness_measurements[f].apply(str)
+    df_fitness_measurements["not_bad_spot"] = ~df_fitness_measurements.bad_spot
+
+    # init
+    plot_inputs = {"outdir":outdir, "fitness_measurements":df_fitness_measurements, "experiment_name":df_fitness_measurements.experiment_name.iloc[0], "measure_susceptibility":("idx_correct_rel_estimates" in df_fitness_measurements.keys()), "min_nAUC_to_beConsideredGrowing":min_nAUC_to_beConsideredGrowing, "hours_experiment":hours_experiment, "montage_image_scale":montage_image_scale}
+
+    # add the susceptibility measurements (only generated for drugs with >=2 concentrations)
+    susceptibility_file = "%s/extended_outputs/susceptibility_measurements.csv"%outdir
+    if not file_is_empty(susceptibility_file): 
+        susceptibility_df = get_tab_as_df_or_empty_df(susceptibility_file)
+        for f in ["strain", "drug", "replicateID", "sampleID"]: 
+            if f in susceptibility_df.keys(): susceptibility_df[f] = susceptibility_df[f].apply(str)
+        plot_inputs["susceptibility_measurements"] = susceptibility_df
+
+    # add the inputs of the growth_curves_and_images plots
+    growth_table_dir, frames_dir = get_growth_curves_and_images_inputs_dirs(outdir, montage_image_scale)
+    if os.path.isdir(growth_table_dir): plot_inputs["growth_measurements"] = growth_table_dir
+    if os.path.isdir(frames_dir): plot_inputs["montage_frames"] = frames_dir
+
+    return plot_inputs
+
+def run_render_plots(outdir, plot_types, min_nAUC_to_beConsideredGrowing, hours_experiment, montage_image_scale):
+
+    """Renders plot_types (comma-separated keys of plot_type_to_info, or 'all') for all the fitness estimates, from the saved tables of a finished run in outdir. This allows rendering on demand the plots that are not in the summary set. The growth_curves_and_images need the montage_image_scale of the run."""
+
+    print("Rendering plots...")
+
+    # get the inputs
+    plot_inputs = get_plot_inputs_from_saved_tables(outdir, min_nAUC_to_beConsideredGrowing, hours_experiment, montage_image_scale)
+
+    # define the plot types
+    if plot_types=="all": 
+        plot_types = get_plot_types_to_render(plot_inputs, "all")
+        skipped_plot_types = [t for t in plot_type_to_info if plot_type_to_info[t]["susceptibility"] in {None, plot_inputs["measure_susceptibility"]} and t not in plot_types]
+        if len(skipped_plot_types)>0: print_with_runtime("WARNING: These plots are skipped because some inputs are missing: %s"%(", ".join(skipped_plot_types)))
+
+    else:
+        plot_types = plot_types.split(",")
+        strange_plot_types = set(plot_types).difference(set(plot_type_to_info))
+        if len(strange_plot_types)>0: raise ValueError("Invalid plot types: %s. They should be 'all' or among: %s"%(strange_plot_types, ", ".join(plot_type_to_info)))
+
+        for plot_type in plot_types:
+            if plot_type_to_info[plot_type]["susceptibility"] not in {None, plot_inputs["measure_susceptibility"]}: raise ValueError("The %s plots can't be made for an experiment %s susceptibility measurements"%(plot_type, {True:"with", False:"without"}[plot_inputs["measure_susceptibility"]]))
+            missing_inputs = get_missing_inputs_plot_type(plot_inputs, plot_type)
+            if len(missing_inputs)>0 and plot_type=="growth_curves_and_images": raise ValueError("The growth_curves_and_images plots need these inputs, which are missing: %s. They are only saved by runs with '--plots all' or --keep_tmp_files, and at the --montage_image_scale of the run (%s was provided). Run the pipeline again with '--plots all' (and --replace) to get these plots"%(", ".join(missing_inputs), montage_image_scale))
+            if len(missing_inputs)>0: raise ValueError("The %s plots need these inputs, which were not saved by the run: %s"%(plot_type, ", ".join(missing_inputs)))
+
+    # render
+    print_with_runtime("Rendering the plots %s..."%(", ".join(plot_types)))
+    render_plots(plot_inputs, plot_types, "all")
+
+#############################
+
+def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_layout_file, images_dir, outdir, keep_tmp_files, min_nAUC_to_beConsideredGrowing, hours_experiment, fitness_engine="R", growth_curve_plots="end", extra_table_formats=None, montage_image_scale=1.0, plots="summary"):
 
     """
-    Writes the integrated fitness and susceptibility measurements.
+    Writes the integrated fitness and susceptibility measurements. Unless growth_curve_plots is 'none', it also renders the growth curves of the plates that have no plots yet (deferred from STEP 3). The tables are written in the background while the plots are made. The large tables (fitness_measurements and susceptibility_measurements) are written as .csv and in the extra_table_formats ('parquet', 'feather' or 'xlsx'), and the summary tables as .csv and .xlsx. The images of the plots with growth curves and images are resized by montage_image_scale (1 keeps the original resolution). plots can be 'summary' (only the plots of the summary set of plot_type_to_info, for nAUC) or 'all' (all plot types and fitness estimates).
     """
 
     print("Getting final tables and plots...")
@@ -4012,6 +5581,11 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
     extended_outdir = "%s/extended_outputs"%outdir
     if not os.path.isdir(extended_outdir): raise ValueError("extended_outdir should exist")
 
+    # check the table formats and start writing tables in the background
+    if extra_table_formats is None: extra_table_formats = []
+    check_table_formats(extra_table_formats)
+    table_writer = start_table_writer()
+
     ###############################
 
 
@@ -4028,27 +5602,26 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
 
     if len(df_bad_spots)>0: 
         df_bad_spots["experiment_name"] = experiment_name
-        df_bad_spots[['plate_batch', 'plate', 'row', 'column', 'drug', 'concentration', 'strain', 'experiment_name', 'bad_spot_reason']].sort_values(by=["plate_batch", "plate", "strain", "row", "column"]).to_excel("%s/bad_spots.xlsx"%extended_outdir, index=False)
+        write_table(df_bad_spots[['plate_batch', 'plate', 'row', 'column', 'drug', 'concentration', 'strain', 'experiment_name', 'bad_spot_reason']].sort_values(by=["plate_batch", "plate", "strain", "row", "column"]), "%s/bad_spots.xlsx"%extended_outdir, ["xlsx"], table_writer=table_writer)
 
     else: print_with_runtime("There are no bad spots, so that bad_spots.xlsx will not be generated.")
 
     # change to numbers
-    letter_to_number = dict(zip(list("ABCDEFGH"), range(1,9)))
+    letter_to_number = dict(zip(get_plate_row_letters(), range(1, get_plate_nrows_and_ncols()[0]+1)))
     df_bad_spots["row"] = df_bad_spots.row.apply(lambda x: letter_to_number[x])
 
     # add bad spot
     spot_fields = ["plate_batch", "plate", "row", "column"]
-    df_fitness_measurements["spotID"] = df_fitness_measurements[spot_fields].apply(tuple, axis=1)
-    df_bad_spots["spotID"] = df_bad_spots[spot_fields].apply(tuple, axis=1)
-    all_spots = set(df_fitness_measurements.spotID)
-    bad_spots = set(df_bad_spots.spotID)
+    if len(df_bad_spots)>0: df_bad_spots = add_integer_keys_to_df(df_bad_spots[spot_fields], df_plate_layout)
+    else: df_bad_spots = pd.DataFrame(columns=spot_fields + ["spot_idx"])
 
-    if len(set(df_fitness_measurements.spotID))!=len(df_fitness_measurements): raise ValueError("spotID should be unique")
-    strange_bad_spots = bad_spots.difference(all_spots)
-    if len(strange_bad_spots)>0: raise ValueError("Strange bad spots: %s"%strange_bad_spots)
+    df_fitness_measurements["spotID"] = list(zip(*[df_fitness_measurements[f] for f in spot_fields])) # the spotID of the final tables
+    validate_df_schema(df_fitness_measurements, {"spot_idx":{"kind":"iu", "nan":False}}, "fitness measurements", unique_fields=["spot_idx"])
+    strange_bad_spots = df_bad_spots[~df_bad_spots.spot_idx.isin(df_fitness_measurements.spot_idx)]
+    if len(strange_bad_spots)>0: raise ValueError("Strange bad spots: %s"%set(strange_bad_spots[spot_fields].apply(tuple, axis=1)))
 
     # add to df_fitness_measurements
-    df_fitness_measurements["bad_spot"] = df_fitness_measurements.spotID.isin(bad_spots)
+    df_fitness_measurements["bad_spot"] = df_fitness_measurements.spot_idx.isin(df_bad_spots.spot_idx)
 
     # add the experiment name
     df_fitness_measurements["experiment_name"] = experiment_name
@@ -4057,14 +5630,14 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
     print_with_runtime("There are a total of %i validated bad spots (both manually-defined and automatically-predicted)."%(sum(df_fitness_measurements.bad_spot)))
 
     # create simple raw fitness table
-    generate_simplified_fitness_table(df_fitness_measurements, ["nAUC"], "%s/fitness_measurements_simple.csv"%extended_outdir, experiment_name)
+    generate_simplified_fitness_table(df_fitness_measurements, ["nAUC"], "%s/fitness_measurements_simple.csv"%extended_outdir, experiment_name, table_writer=table_writer)
     files_main_output.append("fitness_measurements_simple.xlsx")
 
     # map each drug to the number of concentrations
     drug_to_nconcs = df_fitness_measurements[df_fitness_measurements.concentration!=0][["drug", "concentration"]].drop_duplicates().groupby("drug").apply(len)
 
     # define all fitness estimates
-    fitness_estimates  = ["K", "r", "nr", "nr_t", "maxslp", "maxslp_t", "MDP", "MDR", "MDRMDP", "DT", "AUC", "DT_h", "nAUC", "DT_h_goodR2", "nSTP"]
+    fitness_estimates = fitness_estimates_all
 
     ########################################
 
@@ -4093,7 +5666,7 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
         """
 
         # init variables
-        fitness_estimates_susc = ["K", "r", "nr", "maxslp", "MDP", "MDR", "MDRMDP", "AUC", "nAUC", "nSTP"] # these are estimates that are correlated to growth rate
+        fitness_estimates_susc = fitness_estimates_susceptibility # these are estimates that are correlated to growth rate
 
         # get the fitness df with relative values (for each drug, the fitness relative to the concentration==0), and save these measurements
         df_fitness_measurements = get_fitness_df_with_relativeFitnessEstimates(df_fitness_measurements, fitness_estimates)
@@ -4104,10 +5677,10 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
         print_with_runtime("There are %i/%i spots that are valid for susceptibility and integrated relative fitness estimates. These are non-bad spots with a concentration==0 that is growing and is not a bad spot. In addtion, these have <2 non-0 concentrations that are bad spots."%(sum(df_fitness_measurements["idx_correct_rel_estimates"]), len(df_fitness_measurements)))
 
         # save the fitness df
-        save_df_as_tab(df_fitness_measurements, "%s/fitness_measurements.csv"%extended_outdir)
+        write_table(df_fitness_measurements.drop(columns=integer_key_fields), "%s/fitness_measurements.csv"%extended_outdir, ["tab"] + extra_table_formats, table_writer=table_writer)
 
         # create simple rel fitness table, only considering spots where the conc0 is growing, and only those with some concentration
-        generate_simplified_fitness_table(df_fitness_measurements[(df_fitness_measurements.idx_correct_rel_estimates) & (df_fitness_measurements.concentration>0)], ["nAUC_rel"], "%s/relative_fitness_measurements_simple.csv"%extended_outdir, experiment_name)
+        generate_simplified_fitness_table(df_fitness_measurements[(df_fitness_measurements.idx_correct_rel_estimates) & (df_fitness_measurements.concentration>0)], ["nAUC_rel"], "%s/relative_fitness_measurements_simple.csv"%extended_outdir, experiment_name, table_writer=table_writer)
         files_main_output.append("relative_fitness_measurements_simple.xlsx")
 
         # measure susceptibility
@@ -4116,6 +5689,7 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
             # get the susceptibility df
             min_points_to_calculate_resistance_auc = 3 # you need at least three points (including 0, to calculate rAUC)
             susceptibility_df = get_susceptibility_df(df_fitness_measurements, fitness_estimates_susc, min_points_to_calculate_resistance_auc, "%s/susceptibility_measurements.csv"%extended_outdir, experiment_name)
+            write_table(susceptibility_df.copy(), "%s/susceptibility_measurements.csv"%extended_outdir, extra_table_formats, table_writer=table_writer)
 
             # generate a reduced, simple, susceptibility_df
             simple_susceptibility_df = susceptibility_df[(susceptibility_df.fitness_estimate=="nAUC_rel")].groupby(["drug", "strain"]).apply(get_row_simple_susceptibility_df_one_strain_and_drug).reset_index(drop=True)
@@ -4125,74 +5699,48 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
             relevant_fields_simple_susc = ['drug', 'strain', 'median_MIC50', 'mode_MIC50', 'mad_MIC50', 'range_MIC50', 'replicates_MIC50', 'median_SMG-MIC50', 'mode_SMG-MIC50', 'mad_SMG-MIC50', 'range_SMG-MIC50', 'replicates_SMG-MIC50', 'median_rAUC', 'mode_rAUC', 'mad_rAUC', 'range_rAUC', 'replicates_rAUC', 'median_rAUC_log2', 'mode_rAUC_log2', 'mad_rAUC_log2', 'range_rAUC_log2', 'replicates_rAUC_log2', 'max_concentration', 'experiment_name']
             simple_susceptibility_df = simple_susceptibility_df[relevant_fields_simple_susc]
 
-            save_df_as_tab(simple_susceptibility_df, "%s/susceptibility_measurements_simple.csv"%extended_outdir)
-            simple_susceptibility_df.to_excel("%s/susceptibility_measurements_simple.xlsx"%extended_outdir, index=False)
+            write_table(simple_susceptibility_df, "%s/susceptibility_measurements_simple.csv"%extended_outdir, ["tab", "xlsx"], table_writer=table_writer)
             files_main_output.append("susceptibility_measurements_simple.xlsx")
 
         else: print_with_runtime("All drugs have <2 non-0 concentrations, so that the susceptibility analysis is skipped.")
     
     else: 
         print_with_runtime("WARNING: You did not provide concentration==0, so that the susceptibility and relative fitness measurements are not generated.")
-        save_df_as_tab(df_fitness_measurements, "%s/fitness_measurements.csv"%extended_outdir)
+        write_table(df_fitness_measurements.drop(columns=integer_key_fields), "%s/fitness_measurements.csv"%extended_outdir, ["tab"] + extra_table_formats, table_writer=table_writer)
 
     ############################################################
 
-    ###### MAKE PLOTS THAT ARE GENERAL TO ALL RUNS ######
+    ###### MAKE PLOTS ######
 
     # add general fields
     df_fitness_measurements["not_bad_spot"] = ~df_fitness_measurements.bad_spot
 
-    # make plots of each strain with the images and plots
-    all_strains = sorted(set(df_fitness_measurements.strain))
-    dir_growth_curves_and_images = "%s/growth_curves_and_images"%extended_outdir; make_folder(dir_growth_curves_and_images)
-
-    for drug in drug_to_nconcs.keys():
-        print("Getting plots with growth curves and images for drug %s..."%drug)
-
-        outdir_plots = "%s/%s"%(dir_growth_curves_and_images, drug); make_folder(outdir_plots)
-        df_fit = df_fitness_measurements[(df_fitness_measurements.drug==drug) | (df_fitness_measurements.concentration==0)]
-        inputs_fn_plots_strain = [(s, drug, cp.deepcopy(df_fit[df_fit.strain==s]), outdir, outdir_plots, hours_experiment, {True:"idx_correct_rel_estimates", False:"not_bad_spot"}[measure_susceptibility]) for I,s in enumerate(all_strains)]
-        run_function_in_parallel(inputs_fn_plots_strain, generate_plot_growth_curves_and_images_one_strain_and_drug)
-
-    #####################################################
-
-    ######### MAKE PLOTS ONLY RELATED TO SUSCEPTIBILITY ##########
-
-    if measure_susceptibility is True:
-
-        # make heatmap of concentration-vs-fitness
-        outdir_heatmaps_extended = "%s/drug_vs_fitness_heatmaps"%extended_outdir
-        plot_heatmaps_concentration_vs_fitness(df_fitness_measurements, outdir_heatmaps_extended, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name)
-
-        # make lineplots of concentration-vs-fitness
-        outdir_drug_vs_fitness_extended = "%s/drug_vs_fitness_lines"%extended_outdir
-        plot_growth_at_different_drugs(df_fitness_measurements, outdir_drug_vs_fitness_extended, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name, type_data="only_correct_spots", only_absolute_estimates=False)
-
-        # make lineplots of concentration-vs-fitness with all spots (also non-bad spots)
-        outdir_drug_vs_fitness_extended_all_spots = "%s/drug_vs_fitness_lines_all_spots"%extended_outdir
-        plot_growth_at_different_drugs(df_fitness_measurements, outdir_drug_vs_fitness_extended_all_spots, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name, type_data="all_data", only_absolute_estimates=True)
-
-        # make the heatmap of the susceptibility measures        
-        if any(drug_to_nconcs>=2): 
-
-            for type_measurements_susc, outir_plots_all_susc in [("raw", "%s/susceptibility_heatmaps"%extended_outdir), ("log", "%s/susceptibility_heatmaps_log_scale"%extended_outdir)]:
+    # define the inputs of the plots
+    plot_inputs = {"outdir":outdir, "fitness_measurements":df_fitness_measurements, "experiment_name":experiment_name, "measure_susceptibility":measure_susceptibility, "min_nAUC_to_beConsideredGrowing":min_nAUC_to_beConsideredGrowing, "hours_experiment":hours_experiment, "montage_image_scale":montage_image_scale}
+    if measure_susceptibility is True and any(drug_to_nconcs>=2): plot_inputs["susceptibility_measurements"] = susceptibility_df
 
-                print("Getting susceptibility measurements %s..."%type_measurements_susc)
-                plot_heatmap_susceptibility(susceptibility_df, outir_plots_all_susc, fitness_estimates_susc, experiment_name, min_nAUC_to_beConsideredGrowing, type_measurements_susc)
+    # save the inputs of the growth_curves_and_images plots outside tmpdir (copying the growth table and decoding the images is slow), only if these plots are rendered now or the tmp files are kept. They can then be rendered later with run_render_plots
+    if plots=="all" or plot_type_to_info["growth_curves_and_images"]["summary"] is True or keep_tmp_files is True:
+        plot_inputs["growth_measurements"], plot_inputs["montage_frames"] = save_growth_curves_and_images_inputs(outdir, hours_experiment, montage_image_scale)
 
-    else:
-
-        # make heatmap of drug vs fitness, one for each drug
-        outdir_raw_fitness_heatmaps_extended = "%s/drug_vs_raw_fitness_heatmaps"%extended_outdir
-        plot_heatmaps_raw_fitness_all_drugs(df_fitness_measurements, outdir_raw_fitness_heatmaps_extended, fitness_estimates, min_nAUC_to_beConsideredGrowing, experiment_name)
+    # render the plots (only the summary set unless plots is 'all'). The rest can be rendered later with run_render_plots
+    plot_types = get_plot_types_to_render(plot_inputs, plots)
+    if "growth_curves_and_images" not in plot_types: print_with_runtime("The plots with growth curves and images (extended_outputs/growth_curves_and_images) are not rendered with --plots %s. Run with '--plots all' to get them%s"%(plots, {True:" (or render them later with '--render_plots growth_curves_and_images', as the tmp files are kept)", False:""}[keep_tmp_files is True]))
+    print_with_runtime("Rendering the %s plots (%s)..."%(plots, ", ".join(plot_types)))
+    render_plots(plot_inputs, plot_types, plots)
 
+    # add the raw fitness heatmaps to the main output
+    if measure_susceptibility is False:
         files_main_output.append("drug_vs_raw_fitness_heatmaps/raw_nAUC_across_drugs_heatmap.pdf")
         files_main_output.append("drug_vs_raw_fitness_heatmaps/raw_nAUC_across_drugs_heatmap.no_clustering.pdf")
 
-    ##############################################################
+    #####################################################
 
     #### RESTRUCTURE ####
 
+    # wait until all the tables are written
+    finish_table_writer(table_writer)
+
     # main files
     for f in files_main_output: os.rename("%s/%s"%(extended_outdir, f), "%s/%s"%(outdir, get_file(f)))
 
@@ -4205,8 +5753,9 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
         # make dir
         summary_plots_dir_drug = "%s/%s"%(summary_plots_dir, drug); make_folder(summary_plots_dir_drug)
 
-        # copy various plots
-        all_interesting_plots = make_flat_listOflists([["%s/%s"%(root, f) for f in files if f.endswith(".pdf") and "_nAUC" in f and (f.startswith("[%s]_"%drug) or f.startswith("%s_"%drug)) and not "susceptibility_heatmaps_log_scale" in root] for (root, dirs, files) in os.walk(extended_outdir)])
+        # copy various plots, only looking into the dirs of the summary plots
+        summary_plots_dirs = ["%s/%s/%s"%(extended_outdir, plot_type, drug) for plot_type in plot_types if plot_type_to_info[plot_type]["summary"] is True]
+        all_interesting_plots = make_flat_listOflists([["%s/%s"%(root, f) for f in files if f.endswith(".pdf") and "_nAUC" in f and (f.startswith("[%s]_"%drug) or f.startswith("%s_"%drug))] for d in summary_plots_dirs for (root, dirs, files) in os.walk(d)])
 
         if len(all_interesting_plots)>0:
             for f in all_interesting_plots: copy_file(f, "%s/%s"%(summary_plots_dir_drug, get_file(f)))
@@ -4218,6 +5767,13 @@ def run_analyze_images_get_rel_fitness_and_susceptibility_measurements(plate_lay
 
     #####################
 
+    ###### GROWTH CURVES #####
+
+    # render the deferred growth curve plots (before removing the tmp files)
+    if growth_curve_plots!="none": generate_growth_curves_plots(outdir, fitness_engine, hours_experiment)
+
+    ##########################
+
     ###### CLEAN #####
 
     # clean, unless specified otherwise
@@ -1,7 +1,7 @@
 # Functions that can be run in any OS
 
 # universal imports
-import os, sys, argparse, shutil, subprocess, time
+import os, sys, argparse, shutil, subprocess, time, threading
 
 # environment checks
 #print("Testing that the python packages are correctly installed...")
@@ -52,6 +52,7 @@ import webbrowser
 from PIL import Image as PIL_Image
 from PIL import ImageTk
 from datetime import date
+from shared_functions import get_md5_file, get_colonyzer_subset_run_is_up_to_date, plate_format_to_nrows_and_ncols
 
 # define general variables
 window_width = 400 # width of all windows
@@ -633,8 +634,9 @@ def get_coords_one_image_GUIapp(colonizer_coordinates_one_spot, coordinate_obten
             window.title("%s. Enter to accept points | Double-click to re-start"%backbone_title)
 
             # define the width of the rectangle
-            w_one_spot_rows = (event.y - dict_data["upper_left_Y"])/7
-            w_one_spot_cols = (event.x - dict_data["upper_left_X"])/11
+            nrows, ncols = plate_format_to_nrows_and_ncols[opt.plate_format]
+            w_one_spot_rows = (event.y - dict_data["upper_left_Y"])/(nrows-1)
+            w_one_spot_cols = (event.x - dict_data["upper_left_X"])/(ncols-1)
             w_one_spot = (w_one_spot_rows + w_one_spot_cols)/2
             half_w_one_spot = w_one_spot*0.5
 
@@ -678,9 +680,9 @@ def get_coords_one_image_GUIapp(colonizer_coordinates_one_spot, coordinate_obten
     # write the colonizer_coordinates_one_spot
     coordinates_str = ",".join([str(dict_data[k]) for k in expected_keys])
     lines = ["######", 
-             "default,96,%s,%s"%(coordinates_str, date.today()),
+             "default,%i,%s,%s"%(opt.plate_format, coordinates_str, date.today()),
              "######",
-             "%s,96,%s"%(latest_image, coordinates_str),
+             "%s,%i,%s"%(latest_image, opt.plate_format, coordinates_str),
              ""]
 
     open(colonizer_coordinates_one_spot, "w").write("\n".join(lines))
@@ -798,7 +800,7 @@ def generate_colonyzer_coordinates_one_plate_batch_and_plate_inHouseGUI(dest_pro
 
         # define the wells
         wells = last_line_split[1]
-        if wells!="96": raise ValueError("You set the analysis for %s-well plates, which is incompatible. Make sure that you press 'g' to save the coordinates."%wells)
+        if wells!=str(opt.plate_format): raise ValueError("You set the analysis for %s-well plates, which is incompatible. Make sure that you press 'g' to save the coordinates."%wells)
 
         # get the coordinates
         coordinates_str = ",".join(last_line_split[2:])
@@ -865,7 +867,7 @@ def get_yyyymmddhhmm_tuple_one_image_name(filename):
 
 def validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_image_names):
 
-    """This function opens an image for a given plate and asks for the user input. If the colonyzer coordinates are bad, it removes the coordinates and also the colonyzer_subset runs"""
+    """This function opens an image for a given plate and asks for the user input. If the colonyzer coordinates are bad, it removes the coordinates (the colonyzer_subset run is keyed by their md5, so that it is re-run with the new ones). It returns whether the coordinates are correct."""
 
     # define dirs
     processed_images_dir_plate = "%s%sprocessed_images_each_plate%s%s_plate%i"%(tmpdir, get_os_sep(), get_os_sep(), plate_batch, plate)
@@ -911,7 +913,6 @@ def validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_b
     def no_click(e): 
 
         remove_file(colonyzer_coords)
-        delete_folder(colonyzer_runs_subset_dir_plate)
 
         dict_data["correct_coords"] = False
         window.destroy()
@@ -935,6 +936,8 @@ def validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_b
     elif dict_data["correct_coords"] is False: pass # print("Selected coordinates are incorrect for %s-plate%s. Repeating coorinate selection..."%(plate_batch, plate))
     else: raise ValueError("you shoud click 'Y' or 'N'")
 
+    return dict_data["correct_coords"]
+
 def generate_colonyzer_coordinates_one_plate_batch_and_plate_transfer_from_1st_plate(coords_file, coords_file_1st_plate, sorted_images):
 
     """Transfers coordinates of the 1st plate"""
@@ -987,6 +990,9 @@ def get_colonyzer_coordinates_GUI(outdir, docker_cmd):
     final_files = ["%s%sColonyzer.txt"%(x[0], get_os_sep()) for x in args_coordinates]
     final_file_correct = "%s%scoordinates_checking_worked_well.txt"%(tmpdir, get_os_sep())
 
+    # keep the md5 of the coordinates that were already validated for each plate, so that only changed plates are shown again
+    plate_to_validated_coords_md5 = {}
+
     # keep trying to generate these files while they are not generated
     while any([file_is_empty(x) for x in final_files]) or file_is_empty(final_file_correct):
 
@@ -1020,14 +1026,21 @@ def get_colonyzer_coordinates_GUI(outdir, docker_cmd):
         # generate a succes window
         generate_closing_window("Coordinates set. Checking them...")
 
-        # run colonyzer in parallel using a subset of the images 
-        run_docker_cmd("%s -e MODULE=analyze_images_run_colonyzer_subset_images"%(docker_cmd), [], print_cmd=False)
+        # run colonyzer in parallel using the last image, only if some plate has new coordinates
+        if not all([get_colonyzer_subset_run_is_up_to_date("%s%sprocessed_images_each_plate"%(tmpdir, get_os_sep()), "%s%scolonyzer_runs_subset"%(tmpdir, get_os_sep()), "%s_plate%i"%(x[3], x[4])) for x in args_coordinates]):
+            run_docker_cmd("%s -e MODULE=analyze_images_run_colonyzer_subset_images"%(docker_cmd), [], print_cmd=False)
 
-        # show the images for validation, and remove the colonyzer coordinates that did not work well
+        # show the images for validation (only for plates with changed coordinates), and remove the colonyzer coordinates that did not work well
         print_with_runtime("Validating the coordinates...")
         for I, (dest_processed_images_dir, coordinate_obtention_dir_plate, sorted_images, plate_batch, plate) in enumerate(args_coordinates):
             #print('Validating coordinates for plate_batch %s and plate %i %i/%i'%(plate_batch, plate, I+1, len(all_dirs)))
-            validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_images)
+
+            # skip plates that were validated with the same coordinates
+            coords_md5 = get_md5_file("%s%sColonyzer.txt"%(dest_processed_images_dir, get_os_sep()))
+            if plate_to_validated_coords_md5.get((plate_batch, plate))==coords_md5: continue
+
+            # validate
+            if validate_colonyzer_coordinates_one_plate_batch_and_plate_GUI(tmpdir, plate_batch, plate, sorted_images) is True: plate_to_validated_coords_md5[(plate_batch, plate)] = coords_md5
 
         # create the final file indicating that this worked well
         if not any([file_is_empty(x) for x in final_files]): open(final_file_correct, "w").write("coodinates selection worked well...")
@@ -1082,82 +1095,129 @@ def backwards_timer_print_text(seconds, text):
         time.sleep(1)
 
 
-def validate_automatic_bad_spot(r, tmpdir):
-
-    """This function validates whether the bad spot in r is valid with a GUI promt. It returns True/False."""
-
-    # define dirs
-    images_dir = "%s%smerged_images_bad_spots"%(tmpdir, get_os_sep())
-    validation_dir = "%s%sbad_spot_validation"%(tmpdir, get_os_sep()); make_folder(validation_dir)
-
-    # create a validation file if not done
-    spot_str = "%s_%s_%s_%s"%(r.plate_batch, r.plate, r.row, r.column)
-    validation_file = "%s%s%s.txt"%(validation_dir, get_os_sep(), spot_str) 
-
-    # if the file does not exist, create it with the boolean
-    if file_is_empty(validation_file): 
-
-        # load the image file
-        image_file = "%s%s%s.tif"%(images_dir, get_os_sep(), spot_str) 
+def get_bad_spot_thumbnail(image_file, thumbnail_width):
 
-        # get the size
-        image_object = PIL_Image.open(image_file)
-        image_w, image_h = image_object.size
+    """Returns a PIL image with the merged image of a bad spot resized to thumbnail_width"""
 
-        # start the window     
-        window = tk.Tk()  
-        window.geometry("%ix%i"%(image_w, image_h))
+    image_object = PIL_Image.open(image_file)
+    image_w, image_h = image_object.size
+    return image_object.resize((thumbnail_width, int(image_h*thumbnail_width/image_w)))
 
-        # define image that can be added to canvas
-        img = ImageTk.PhotoImage(image_object)  
+def validate_automatic_bad_spots(df_bad_spots_auto, tmpdir, nrows_page=2, ncols_page=3, thumbnail_width=420):
 
-        # create canvas 
-        canvas = tk.Canvas(window, width = image_w, height = image_h)  
-        canvas.pack()  
-        canvas.create_image(0, 0, anchor=tk.constants.NW, image=img) 
-
-        # define the title
-        window.title("[%s]=%s (%s-p%s), %s%i (%s) may be bad.   Press 'B' (Bad) if you AGREE | Press 'G' (Good) if you DISAGREE."%(r.drug, r.concentration, r.plate_batch, r.plate, r.row, r.column, r.strain))
-
-        # create buttons to set correct_coords
-        dict_data = {"is_bad_spot":None}
-        def bad_click(e): 
-            dict_data["is_bad_spot"] = True
-            window.destroy()
+    """This function validates whether the bad spots in df_bad_spots_auto are valid with a GUI that shows pages of nrows_page x ncols_page spots. The images of the next page are loaded while the current page is shown. The decisions of each page are written when the page is accepted, so that a validation can be resumed. It returns a list with True/False for each spot."""
 
-        def good_click(e): 
-            dict_data["is_bad_spot"] = False
-            window.destroy()
+    # define dirs
+    images_dir = "%s%smerged_images_bad_spots"%(tmpdir, get_os_sep())
+    validation_dir = "%s%sbad_spot_validation"%(tmpdir, get_os_sep()); make_folder(validation_dir)
 
-        window.bind("<b>", bad_click)
-        window.bind("<g>", good_click)
+    # define the validation file of each spot
+    spots = [r for I, r in df_bad_spots_auto.iterrows()]
+    spot_strs = ["%s_%s_%s_%s"%(r.plate_batch, r.plate, r.row, r.column) for r in spots]
+    validation_files = ["%s%s%s.txt"%(validation_dir, get_os_sep(), spot_str) for spot_str in spot_strs]
+
+    # define the pages of the spots that are not validated
+    spots_to_validate = [I for I, validation_file in enumerate(validation_files) if file_is_empty(validation_file)]
+    spots_per_page = nrows_page*ncols_page
+    pages = [spots_to_validate[I:I+spots_per_page] for I in range(0, len(spots_to_validate), spots_per_page)]
+
+    if len(pages)>0:
+
+        # init the data of the window. All spots are bad by default
+        dict_data = {"page":0, "is_bad_spot":{I : True for I in spots_to_validate}, "page_to_thumbnails":{}, "page_to_prefetch_thread":{}}
+
+        # define a function that loads the images of a page in the background
+        def prefetch_page(page):
+            if page>=len(pages) or page in dict_data["page_to_prefetch_thread"]: return
+            def load_thumbnails(): dict_data["page_to_thumbnails"][page] = [get_bad_spot_thumbnail("%s%s%s.tif"%(images_dir, get_os_sep(), spot_strs[I]), thumbnail_width) for I in pages[page]]
+            dict_data["page_to_prefetch_thread"][page] = threading.Thread(target=load_thumbnails, daemon=True)
+            dict_data["page_to_prefetch_thread"][page].start()
+
+        # start the window
+        window = tk.Tk()
+        grid_frame = tk.Frame(window)
+        grid_frame.pack(side=tk.TOP)
+
+        # define a function that shows the current page
+        def show_page():
+
+            # get the thumbnails of this page, and load the next one
+            page = dict_data["page"]
+            prefetch_page(page)
+            dict_data["page_to_prefetch_thread"][page].join()
+            if page not in dict_data["page_to_thumbnails"]: raise ValueError("The images of the page %i could not be loaded"%(page+1))
+            prefetch_page(page+1)
+
+            # remove the previous spots
+            for widget in grid_frame.winfo_children(): widget.destroy()
+            dict_data["images"] = [ImageTk.PhotoImage(thumbnail) for thumbnail in dict_data["page_to_thumbnails"][page]]
+
+            # add one image and label for each spot
+            for Ipage, (I, img) in enumerate(zip(pages[page], dict_data["images"])):
+
+                r = spots[I]
+                color = {True:"red", False:"green"}[dict_data["is_bad_spot"][I]]
+                spot_text = "%i: [%s]=%s (%s-p%s), %s%i (%s) is %s"%(Ipage+1, r.drug, r.concentration, r.plate_batch, r.plate, r.row, r.column, r.strain, {True:"BAD", False:"GOOD"}[dict_data["is_bad_spot"][I]])
+
+                image_label = tk.Label(grid_frame, image=img, bd=6, bg=color)
+                image_label.grid(row=2*(Ipage//ncols_page), column=Ipage%ncols_page)
+                image_label.bind("<Button-1>", lambda e, I=I: toggle_spot(I))
+                tk.Label(grid_frame, text=spot_text, fg=color, font=('Arial bold',11)).grid(row=2*(Ipage//ncols_page)+1, column=Ipage%ncols_page)
+
+            # define the title
+            window.title("Page %i/%i of potential bad spots. Press '1'-'%i' (or click) to toggle Bad/Good | 'B' all Bad | 'G' all Good | Enter to accept | Left to go back."%(page+1, len(pages), len(pages[page])))
+
+        # define the actions on the spots
+        def toggle_spot(I):
+            dict_data["is_bad_spot"][I] = not dict_data["is_bad_spot"][I]
+            show_page()
+
+        def set_all_spots_page(is_bad_spot):
+            for I in pages[dict_data["page"]]: dict_data["is_bad_spot"][I] = is_bad_spot
+            show_page()
+
+        def key_press(e):
+            if e.char.isdigit() and 1<=int(e.char)<=len(pages[dict_data["page"]]): toggle_spot(pages[dict_data["page"]][int(e.char)-1])
+
+        # define the actions on the pages, writing the decisions of the page at once
+        def accept_page(e=None):
+            for I in pages[dict_data["page"]]: open(validation_files[I], "w").write(str(dict_data["is_bad_spot"][I]))
+            if dict_data["page"]==(len(pages)-1): window.destroy()
+            else:
+                dict_data["page"] += 1
+                show_page()
+
+                # automatic validation
+                if opt.auto_accept is True: window.after(1000, accept_page)
+
+        def previous_page(e):
+            if dict_data["page"]>0:
+                dict_data["page"] -= 1
+                show_page()
+
+        window.bind("<Key>", key_press)
+        window.bind("<b>", lambda e: set_all_spots_page(True))
+        window.bind("<g>", lambda e: set_all_spots_page(False))
+        window.bind("<Return>", accept_page)
+        window.bind("<Left>", previous_page)
+
+        # show the first page
+        show_page()
 
         # automatic validation
-        if opt.auto_accept is True:
-            def close_window(): window.destroy()
-            window.after(1000, close_window)
-            dict_data["is_bad_spot"] = True
-
+        if opt.auto_accept is True: window.after(1000, accept_page)
         elif not opt.auto_accept is False: raise ValueError("auto_accept should be T/F")
 
         # run the window
         window.mainloop() 
 
-        # debug and log
-        if dict_data["is_bad_spot"] is True: pass # print("%s-plate%s spot %s%i IS a bad spot"%(r.plate_batch, r.plate, r.row, r.column))
-        elif dict_data["is_bad_spot"] is False: pass # print("%s-plate%s spot %s%i IS NOT a bad spot"%(r.plate_batch, r.plate, r.row, r.column))
-        else: raise ValueError("you shoud click 'B' or 'G'")
-
-        # write file
-        open(validation_file, "w").write(str(dict_data["is_bad_spot"]))
+        # check that all spots were validated
+        if any([file_is_empty(validation_files[I]) for I in spots_to_validate]): raise ValueError("you shoud accept (with Enter) all the pages of potential bad spots")
 
-        # close window
-        #generate_closing_window("Bad spot validated!")
-
-    # return the boolean of validation_file
-    is_valid_bad_spot = open(validation_file, "r").readlines()[0].strip()
-    if is_valid_bad_spot not in {"True", "False"}: raise ValueError("is_valid_bad_spot should be True/False")
-    return {"True":True, "False":False}[is_valid_bad_spot]
+    # return the boolean of each validation_file
+    is_valid_bad_spots = [open(validation_file, "r").readlines()[0].strip() for validation_file in validation_files]
+    if len(set(is_valid_bad_spots).difference({"True", "False"}))>0: raise ValueError("is_valid_bad_spot should be True/False")
+    return [{"True":True, "False":False}[x] for x in is_valid_bad_spots]
 
 def save_df_as_tab(df, file):
 
@@ -1192,14 +1252,9 @@ def generate_df_bad_spots_automatic_validated(outdir):
 
             print_with_runtime("Validating bad spots...")
 
-            for I, (idx,r) in enumerate(df_bad_spots_all_auto.iterrows()):
-                #print("Validating bad spot %i/%i..."%(I+1, len(df_bad_spots_all_auto)))
-
-                # define if this is a true bad spot
-                true_bad_spot = validate_automatic_bad_spot(r, tmpdir)
-
-                # add to df if necessary
-                if true_bad_spot is True: df_bad_spots_validated = pd.concat([df_bad_spots_validated, pd.DataFrame({0 : r}).transpose()]).reset_index(drop=True)
+            # define which are true bad spots, and add them at once
+            true_bad_spots = validate_automatic_bad_spots(df_bad_spots_all_auto, tmpdir)
+            df_bad_spots_validated = pd.concat([df_bad_spots_validated, df_bad_spots_all_auto[true_bad_spots]]).reset_index(drop=True)
 
             # closing windows
             generate_closing_window("Bad spots validated!")
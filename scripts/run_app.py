@@ -26,6 +26,16 @@ import app_functions as fun
 # define the colonyzer parameters
 fun.parms_colonyzer = tuple(sorted(os.environ["PARMS_COLONYZER"].split(",")))
 
+# define the cache of fits
+if str(os.environ["FIT_CACHE_DIR"])!="None": fun.fit_cache_dir = str(os.environ["FIT_CACHE_DIR"])
+fun.fit_cache_max_mb = float(os.environ["FIT_CACHE_MAX_MB"])
+
+# define whether the intermediate tables are validated
+fun.trusted_mode = {"True":True, "False":False}[str(os.environ["TRUSTED_MODE"])]
+
+# define the number of spots of each plate
+fun.plate_format = int(os.environ["plate_format"])
+
 # get the start time
 start_time = time.time()
 
@@ -49,6 +59,23 @@ if reference_plate=="None": reference_plate = None
 elif len(reference_plate.split("-"))==2 and reference_plate.split("-")[1].startswith("plate"): reference_plate = (reference_plate.split("-")[0], int(reference_plate.split("-")[1][-1]))
 else: raise ValueError("The argument passed to --reference_plate (%s) should have the format <plate_batch>-plate<plateID>. For example 'SC1-plate1'."%reference_plate)
 
+# define the interim fitness times
+if str(os.environ["interim_fitness_hours"])=="none": interim_fitness_hours = []
+else: interim_fitness_hours = [float(x) for x in str(os.environ["interim_fitness_hours"]).split(",")]
+
+# define the formats of the large tables (apart from .csv)
+if str(os.environ["extra_table_formats"])=="none": extra_table_formats = []
+else: extra_table_formats = str(os.environ["extra_table_formats"]).split(",")
+
+# define the scale of the images in the plots with growth curves and images
+montage_image_scale = float(os.environ["montage_image_scale"])
+
+# define the plots rendered in the final step ('summary' or 'all')
+plots = str(os.environ["plots"])
+
+# define the fitness estimates used to detect potential bad spots
+bad_spot_features = str(os.environ["bad_spot_features"]).split(",")
+
 # process images
 if os.environ["MODULE"]=="analyze_images_process_images": fun.run_analyze_images_process_images("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["enhance_image_contrast"])], reference_plate, str(os.environ["contrast_enhancement_image"]))
 
@@ -56,10 +83,16 @@ if os.environ["MODULE"]=="analyze_images_process_images": fun.run_analyze_images
 elif os.environ["MODULE"]=="analyze_images_run_colonyzer_subset_images": fun.run_analyze_images_run_colonyzer_subset_images(OutDir, reference_plate)
 
 # perform fitness measurements
-elif os.environ["MODULE"]=="get_fitness_measurements": fun.run_analyze_images_get_fitness_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, float(os.environ["min_nAUC_to_beConsideredGrowing"]), reference_plate, float(os.environ["hours_experiment"]))
+elif os.environ["MODULE"]=="get_fitness_measurements": fun.run_analyze_images_get_fitness_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, float(os.environ["min_nAUC_to_beConsideredGrowing"]), reference_plate, float(os.environ["hours_experiment"]), str(os.environ["timepoint_subsampling"]), str(os.environ["fitness_engine"]), str(os.environ["growth_curve_plots"]), interim_fitness_hours, bad_spot_features)
+
+# compare the python and R fitness engines
+elif os.environ["MODULE"]=="compare_fitness_engines": fun.run_compare_fitness_engines(OutDir, float(os.environ["hours_experiment"]))
 
 # final tables and plots
-elif os.environ["MODULE"]=="get_rel_fitness_and_susceptibility_measurements": fun.run_analyze_images_get_rel_fitness_and_susceptibility_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["KEEP_TMP_FILES"])], float(os.environ["min_nAUC_to_beConsideredGrowing"]), float(os.environ["hours_experiment"]))
+elif os.environ["MODULE"]=="get_rel_fitness_and_susceptibility_measurements": fun.run_analyze_images_get_rel_fitness_and_susceptibility_measurements("%s/plate_layout.xlsx"%SmallInputs, ImagesDir, OutDir, bool_dict[str(os.environ["KEEP_TMP_FILES"])], float(os.environ["min_nAUC_to_beConsideredGrowing"]), float(os.environ["hours_experiment"]), str(os.environ["fitness_engine"]), str(os.environ["growth_curve_plots"]), extra_table_formats, montage_image_scale, plots)
+
+# render plots of a finished run
+elif os.environ["MODULE"]=="render_plots": fun.run_render_plots(OutDir, str(os.environ["render_plots"]), float(os.environ["min_nAUC_to_beConsideredGrowing"]), float(os.environ["hours_experiment"]), montage_image_scale)
 
 else: raise ValueError("The module is incorrect")
 
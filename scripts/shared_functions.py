@@ -0,0 +1,30 @@
+# Functions and variables shared by main_functions.py (run in any OS) and app_functions.py (run in the docker image), so that both use the same implementation. They only need the python standard library.
+
+# imports
+import os, hashlib
+
+# define general variables
+plate_format_to_nrows_and_ncols = {96:(8, 12), 384:(16, 24), 1536:(32, 48)} # number of spots to (rows, columns) of each plate
+
+# functions
+
+def get_md5_file(filename):
+
+    """Returns the md5 hash of the content of filename"""
+
+    return hashlib.md5(open(filename, "rb").read()).hexdigest()
+
+def get_colonyzer_subset_run_is_up_to_date(processed_images_dir_each_plate, colonyzer_runs_subset_dir, d):
+
+    """Returns whether the colonyzer subset run of plate d (<plate_batch>_plate<plate>) was generated with the current Colonyzer.txt of the plate"""
+
+    # define files
+    colonyzer_coords = os.path.join(processed_images_dir_each_plate, d, "Colonyzer.txt")
+    coords_md5_file = os.path.join(colonyzer_runs_subset_dir, d, "Colonyzer.txt.md5")
+
+    # no run or no coordinates
+    for f in [colonyzer_coords, coords_md5_file]:
+        if not os.path.isfile(f) or os.stat(f).st_size==0: return False
+
+    # compare the hash of the coordinates used in the run with the current ones
+    return open(coords_md5_file, "r").readlines()[0].strip()==get_md5_file(colonyzer_coords)
@@ -0,0 +1,88 @@
+# This is a python script to benchmark the detection of potential bad spots (generate_df_w_potential_bad_spots), which calculates the quartiles of each strain and plate once. It checks that the results are equal to the ones of the per-spot detection (with is_outlier for each spot) on a synthetic experiment
+
+# It should be run in the environment of the docker image (with the dependencies of app_functions). For example: python benchmark_bad_spot_detection.py 200 # the number of plates
+
+# imports
+import os, sys
+import numpy as np
+import pandas as pd
+
+# import app functions
+CurDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, "%s/../../scripts"%CurDir)
+import app_functions as fun
+import benchmark_helpers as helpers
+
+# get args
+if len(sys.argv)>1: nplates = int(sys.argv[1])
+else: nplates = 200
+
+def get_synthetic_df_fitness_measurements(nplates, seed=0):
+
+    """Returns a synthetic df_fitness_measurements (as the one passed to generate_df_w_potential_bad_spots) with nplates of 96 spots, with 24 strains of 4 replicates each. Some strains are not growing, some spots are outliers and some are manually-defined bad spots"""
+
+    rng = np.random.RandomState(seed)
+    df = helpers.get_synthetic_df_spots(nplates)
+    nspots = len(df)
+    df["strain"] = ["strain%i"%(((r-1)//2)*6 + (c-1)//2) for r,c in df[["row", "column"]].values]
+    df["drug"] = "drugA"
+    df["concentration"] = (df.plate%4).astype(float)
+
+    strain_nAUC = rng.uniform(0, 1, nspots//4).repeat(4)
+    strain_nAUC[rng.uniform(0, 1, len(strain_nAUC))<0.2] = 0.001
+    df["nAUC"] = strain_nAUC*rng.uniform(0.9, 1.1, nspots)
+    df["DT_h"] = rng.uniform(2, 3, nspots)
+    df["K"] = rng.uniform(0.5, 1.5, nspots)
+    for f in ["nAUC", "DT_h", "K"]: df.loc[rng.uniform(0, 1, nspots)<0.03, f] *= rng.uniform(0, 10, nspots)[0]
+
+    df["bad_spot"] = rng.uniform(0, 1, nspots)<0.01
+    return df
+
+def generate_df_w_potential_bad_spots_per_spot(df_fitness_measurements, min_nAUC_to_beConsideredGrowing, bad_spot_features):
+
+    """Returns the potential bad spots, calling is_outlier for each spot"""
+
+    num_to_letter = dict(zip(range(1, 9), "ABCDEFGH"))
+    fields_spot = ["plate_batch", "plate", "drug", "concentration", "row", "column", "strain", "bad_spot_reason"]
+    df_bad_spots = df_fitness_measurements[df_fitness_measurements.bad_spot==True].copy()
+    df_bad_spots["row"] = df_bad_spots.row.apply(lambda x: num_to_letter[x])
+    df_bad_spots["bad_spot_reason"] = "manual setting in plate layout"
+
+    def get_bad_spot_reason_one_spot(r, df):
+
+        if np.median(df.nAUC)<min_nAUC_to_beConsideredGrowing and r.nAUC<min_nAUC_to_beConsideredGrowing: return ""
+
+        reasons_bad_spot = []
+        for f in bad_spot_features:
+            outlier, range_f = fun.is_outlier(list(df[f]), r[f])
+            if outlier==True: reasons_bad_spot.append("%s=%.2f outside (%.2f, %.2f)"%(f, r[f], range_f[0], range_f[1]))
+
+        return "; ".join(reasons_bad_spot)
+
+    def get_df_bad_spots_one_strain_and_plate(df):
+
+        if len(df)<3: return pd.DataFrame(columns=fields_spot)
+        df = df.copy()
+        df["bad_spot_reason"] = df.apply(get_bad_spot_reason_one_spot, df=df, axis=1)
+        return df[df.bad_spot_reason!=""][fields_spot]
+
+    df_bad_spots_automatic = df_fitness_measurements[df_fitness_measurements.bad_spot==False].groupby(["plate_batch", "plate", "strain"]).apply(get_df_bad_spots_one_strain_and_plate)
+    df_bad_spots_automatic["row"] = df_bad_spots_automatic.row.apply(lambda x: num_to_letter[x])
+
+    return pd.concat([df_bad_spots[fields_spot], df_bad_spots_automatic[fields_spot]], sort=False).sort_values(by=["plate_batch", "plate", "strain", "row", "column"])
+
+# get the bad spots with both approaches
+df_fitness_measurements = get_synthetic_df_fitness_measurements(nplates)
+print("Benchmarking the detection of bad spots in %i plates..."%nplates)
+
+for bad_spot_features in [["nAUC"], ["nAUC", "DT_h", "K"]]:
+
+    df_bad_spots, elapsed_time_vectorized = helpers.run_timed(fun.generate_df_w_potential_bad_spots, df_fitness_measurements, 0.02, bad_spot_features=bad_spot_features)
+    print("vectorized detection (%s): %.2f seconds"%(",".join(bad_spot_features), elapsed_time_vectorized))
+
+    df_bad_spots_per_spot, elapsed_time_per_spot = helpers.run_timed(generate_df_w_potential_bad_spots_per_spot, df_fitness_measurements, 0.02, bad_spot_features)
+    print("per-spot detection (%s): %.2f seconds (%.1fx slower)"%(",".join(bad_spot_features), elapsed_time_per_spot, elapsed_time_per_spot/elapsed_time_vectorized))
+
+    # check that the results are equal (the per-spot df has object columns when some strains have <3 replicates)
+    pd.testing.assert_frame_equal(df_bad_spots.reset_index(drop=True), df_bad_spots_per_spot.reset_index(drop=True), check_dtype=False)
+    print("The vectorized bad spots (%i) are equal to the per-spot ones."%len(df_bad_spots))
@@ -0,0 +1,69 @@
+# This is a python script to benchmark the table preparation of STEP 3 (get_df_fitness_measurements_from_fits_all_plates) on synthetic experiments of increasing size, checking that the runtime scales linearly with the number of spots
+
+# It should be run in the environment of the docker image (with the dependencies of app_functions). For example: python benchmark_fitness_table_preparation.py 10000 # the maximum number of plates
+
+# imports
+import os, sys
+import numpy as np
+import pandas as pd
+
+# import app functions
+CurDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, "%s/../../scripts"%CurDir)
+import app_functions as fun
+import benchmark_helpers as helpers
+
+# get args
+if len(sys.argv)>1: max_nplates = int(sys.argv[1])
+else: max_nplates = 10000
+
+def get_synthetic_fits_and_plate_layout(nplates, nstrains=24, seed=0):
+
+    """Returns a synthetic df with the logRegression_fits of nplates 96-well plates (with plate_batch and plate) and the corresponding plate layout (with integer keys)"""
+
+    rng = np.random.RandomState(seed)
+
+    # define the spots
+    df_spots = helpers.get_synthetic_df_spots(nplates, nplates_per_batch=4)
+    nspots = len(df_spots)
+
+    # define the layout
+    df_plate_layout = df_spots.copy()
+    df_plate_layout["strain"] = np.array(["strain%i"%I for I in range(nstrains)], dtype=object)[(df_plate_layout.row*12 + df_plate_layout.column) % nstrains]
+    df_plate_layout["drug"] = np.array(["drug%i"%I for I in range(8)], dtype=object)[np.repeat(np.arange(nplates) % 8, 96)]
+    df_plate_layout["concentration"] = np.repeat((np.arange(nplates) % 5).astype(float), 96)
+    df_plate_layout["bad_spot"] = False
+    df_plate_layout = fun.add_integer_keys_to_df(df_plate_layout, df_plate_layout)
+
+    # define the fits
+    df_fits_all = df_spots.rename(columns={"row":"Row", "column":"Column"})
+    df_fits_all["Inoc.Time"] = "2022-01-01_00-00-00"
+    df_fits_all["Gene"] = df_plate_layout.strain.values
+    for f in ['XOffset', 'YOffset', 'K', 'r', 'g', 'v', 'objval', 'd0', 'nAUC', 'nSTP', 'nr', 'nr_t', 'maxslp', 'maxslp_t', 'MDP', 'MDR', 'MDRMDP', 'glog_maxslp', 'DT', 'AUC']: df_fits_all[f] = rng.uniform(0.01, 100, nspots)
+    df_fits_all["rsquare"] = rng.uniform(-0.2, 1, nspots)
+    df_fits_all.loc[rng.uniform(0, 1, nspots)<0.01, "rsquare"] = np.nan
+    df_fits_all["DT_h"] = rng.uniform(1, 25, nspots)
+
+    return df_fits_all, df_plate_layout
+
+# check that the vectorized fields are equal to the element-wise functions
+df_fits_all, df_plate_layout = get_synthetic_fits_and_plate_layout(8)
+df_fitness_measurements = fun.get_df_fitness_measurements_from_fits_all_plates(df_fits_all, df_plate_layout, 0.5)
+expected_rsquare = df_fits_all.rsquare.apply(fun.get_rsquare_to0).values
+if any(df_fitness_measurements.rsquare.values!=expected_rsquare): raise ValueError("rsquare is not as expected")
+if any(df_fitness_measurements.DT_h_goodR2.values!=np.array([fun.get_DT_good_rsq(DT_h, rsq) for DT_h, rsq in zip(df_fits_all.DT_h, expected_rsquare)])): raise ValueError("DT_h_goodR2 is not as expected")
+if any(df_fitness_measurements.replicateID.values!=helpers.get_replicateIDs(df_fitness_measurements)): raise ValueError("replicateID is not as expected")
+
+# benchmark
+print("Benchmarking the table preparation of STEP 3...")
+nplates_to_seconds_per_spot = {}
+for nplates in sorted({max([1, int(max_nplates/x)]) for x in [8, 4, 2, 1]}):
+
+    df_fits_all, df_plate_layout = get_synthetic_fits_and_plate_layout(nplates)
+    df_fitness_measurements, elapsed_time = helpers.run_timed(fun.get_df_fitness_measurements_from_fits_all_plates, df_fits_all, df_plate_layout, 0.5)
+
+    nplates_to_seconds_per_spot[nplates] = elapsed_time / len(df_fitness_measurements)
+    print("%i plates (%i spots): %.2f seconds (%.2f microseconds per spot)"%(nplates, len(df_fitness_measurements), elapsed_time, nplates_to_seconds_per_spot[nplates]*1e6))
+
+# check the scaling
+helpers.check_linear_scaling(nplates_to_seconds_per_spot, "table preparation of STEP 3")
@@ -0,0 +1,45 @@
+# Functions shared by the benchmarks of this folder: the synthetic spots of the fixtures, the timing of functions and the checks of the results and scaling
+
+# imports
+import time
+import numpy as np
+import pandas as pd
+
+def get_synthetic_df_spots(nplates, nplates_per_batch=None):
+
+    """Returns a df with the plate_batch, plate, row and column of each spot of nplates synthetic 96-spot plates. If nplates_per_batch is provided, the plates are split into plate batches (batch0, batch1...) of nplates_per_batch plates each (numbered from 1). Otherwise, all plates are in batch1 (numbered from 1 to nplates)."""
+
+    # define the plates
+    if nplates_per_batch is None:
+        plate_batches = np.array(["batch1"]*nplates, dtype=object)
+        plates = np.arange(1, nplates+1)
+
+    else:
+        nplate_batches = int(np.ceil(nplates/nplates_per_batch))
+        plate_batches = np.repeat(np.array(["batch%i"%I for I in range(nplate_batches)], dtype=object), nplates_per_batch)[0:nplates]
+        plates = np.tile(np.arange(1, nplates_per_batch+1), nplate_batches)[0:nplates]
+
+    # define the spots (sorted by plate, row and column)
+    return pd.DataFrame({"plate_batch":np.repeat(plate_batches, 96), "plate":np.repeat(plates, 96), "row":np.tile(np.repeat(np.arange(1, 9), 12), nplates), "column":np.tile(np.arange(1, 13), nplates*8)})
+
+def get_replicateIDs(df_spots):
+
+    """Returns the replicateID (e.g. A1) of each spot of df_spots"""
+
+    return np.array(["%s%i"%("ABCDEFGH"[row-1], column) for row, column in df_spots[["row", "column"]].values], dtype=object)
+
+def run_timed(function, *args, **kwargs):
+
+    """Runs function and returns its result and the runtime (in seconds)"""
+
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+def check_linear_scaling(size_to_seconds_per_item, description, max_ratio=2.0):
+
+    """Takes a dict that maps each size of a benchmark to the runtime per item (e.g. per spot), and raises an error if the runtime per item of the largest size is >max_ratio times the one of the smallest size"""
+
+    ratio_time_per_item = size_to_seconds_per_item[max(size_to_seconds_per_item)] / size_to_seconds_per_item[min(size_to_seconds_per_item)]
+    print("%s: the time per item of the largest size is %.2fx the one of the smallest size."%(description, ratio_time_per_item))
+    if ratio_time_per_item>max_ratio: raise ValueError("The %s does not scale linearly with the number of items (the time per item grows %.2fx, which is >%.2fx)"%(description, ratio_time_per_item, max_ratio))
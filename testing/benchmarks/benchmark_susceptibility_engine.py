@@ -0,0 +1,119 @@
+# This is a python script to benchmark the susceptibility measurements of STEP 5 (get_susceptibility_df), which are calculated with arrays of samples x concentrations. It checks that the results are equal to the ones of the per-sample functions (get_MIC_for_EUCASTreplicate, get_SMG_for_EUCASTreplicate and get_AUC_for_EUCASTreplicate) on a synthetic experiment
+
+# It should be run in the environment of the docker image (with the dependencies of app_functions). For example: python benchmark_susceptibility_engine.py 2000 # the number of samples
+
+# imports
+import os, sys
+import numpy as np
+import pandas as pd
+
+# import app functions
+CurDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, "%s/../../scripts"%CurDir)
+import app_functions as fun
+import benchmark_helpers as helpers
+
+# get args
+if len(sys.argv)>1: nsamples = int(sys.argv[1])
+else: nsamples = 2000
+
+# define the tmp dir
+tmpdir = "%s/tmp_benchmark_susceptibility_engine"%CurDir
+fun.delete_folder(tmpdir); fun.make_folder(tmpdir)
+
+def get_synthetic_fitness_df(nsamples, fitness_estimates, seed=0):
+
+    """Returns a synthetic fitness df (as the one passed to get_susceptibility_df) with nsamples, one drug with 11 concentrations and one with 3. Some spots are missing and some raw estimates are NaN"""
+
+    rng = np.random.RandomState(seed)
+    drug_to_concentrations = {"drugA":[0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512], "drugB":[1, 2, 4]}
+
+    # define the spots, with one sample in each spot of synthetic plates
+    df_spots = helpers.get_synthetic_df_spots(int(np.ceil(nsamples/96))).iloc[0:nsamples]
+    df_spots["replicateID"] = helpers.get_replicateIDs(df_spots)
+
+    fitness_table = fun.init_table()
+    for I, (row, column, replicateID) in enumerate(df_spots[["row", "column", "replicateID"]].values):
+
+        sample_dict = {"sampleID":"sample%05i"%I, "strain":"strain%i"%(I//96), "replicateID":replicateID, "row":row, "column":column}
+        fun.add_row_to_table(fitness_table, dict(sample_dict, drug="drugA", concentration=0.0, spotID=("batch1", 1, row, column), idx_correct_rel_estimates=True, is_growing=True))
+
+        for drug, concentrations in drug_to_concentrations.items():
+            for conc in concentrations: fun.add_row_to_table(fitness_table, dict(sample_dict, drug=drug, concentration=float(conc), spotID=("batch1", 2, row, column), idx_correct_rel_estimates=(rng.uniform()>0.08), is_growing=(rng.uniform()>0.3)))
+
+    fitness_df = fun.get_df_from_table(fitness_table, reset_index=True)
+
+    # define the fitness estimates, with relative values that decrease after a random MIC
+    nspots = len(fitness_df)
+    for fe in fitness_estimates:
+
+        fitness_df[fe] = rng.uniform(0.1, 2.1, nspots)
+        fitness_df.loc[(rng.uniform(0, 1, nspots)<0.02) & (fitness_df.concentration>0), fe] = np.nan
+
+        rel_values = np.where(fitness_df.concentration<(2.0**(rng.randint(0, 13, nspots)-3)), 1.0, rng.uniform(0, 0.2, nspots))
+        rel_values = np.where(rng.uniform(0, 1, nspots)<0.5, rng.uniform(0, 1, nspots), rel_values)
+        rel_values[rng.uniform(0, 1, nspots)<0.03] = 0.0
+        fitness_df["%s_rel"%fe] = np.where(fitness_df.concentration==0, 1.0, rel_values)
+
+    return fitness_df
+
+def get_susceptibility_df_per_sample(fitness_df, fitness_estimates, min_points_to_calculate_auc):
+
+    """Returns the susceptibility df calculated for each sample with the per-sample functions"""
+
+    table_all = fun.init_table()
+    for drug in sorted(set(fitness_df[fitness_df.concentration!=0.0].drug)):
+
+        # get the df and the concentrations of this drug
+        fitness_df_d = fitness_df[(fitness_df.drug==drug) | (fitness_df.concentration==0.0)].copy()
+        sorted_concentrations = sorted(set(fitness_df_d.concentration))
+        pseudocount_log2_concentration = sorted_concentrations[1]/2
+        fitness_df_d["log2_concentration"] = np.log2(fitness_df_d.concentration + pseudocount_log2_concentration)
+        fitness_df_d = fitness_df_d[fitness_df_d.idx_correct_rel_estimates]
+
+        sorted_log2_concentrations = [np.log2(c + pseudocount_log2_concentration) for c in sorted_concentrations]
+        concentrations_dict = {"max_conc":max(sorted_concentrations), "zero_conc":sorted_concentrations[0], "first_conc":sorted_concentrations[1], "conc_to_previous_conc":{c:sorted_concentrations[I-1] for I,c in enumerate(sorted_concentrations) if I>0}}
+        concentrations_dict_log2 = {"max_conc":max(sorted_log2_concentrations), "zero_conc":sorted_log2_concentrations[0], "first_conc":sorted_log2_concentrations[1], "conc_to_previous_conc":{c:sorted_log2_concentrations[I-1] for I,c in enumerate(sorted_log2_concentrations) if I>0}}
+
+        for fitness_estimate in ["%s_rel"%f for f in fitness_estimates]:
+            raw_fitness_estimate = fitness_estimate.replace("_rel", "")
+            grouped_df = fitness_df_d[["sampleID", "concentration", "is_growing", "log2_concentration", fitness_estimate, raw_fitness_estimate]].sort_values(by=["sampleID", "concentration"]).groupby("sampleID")
+
+            df_f = pd.DataFrame()
+            for mic_fraction in [0.25, 0.5, 0.75, 0.9]:
+                mic_field = "MIC_%i"%(mic_fraction*100)
+                df_f[mic_field] = grouped_df.apply(lambda x: fun.get_MIC_for_EUCASTreplicate(x, fitness_estimate, concentrations_dict, mic_fraction))
+                sample_to_mic = dict(df_f[mic_field])
+                df_f["SMG_MIC_%i"%(mic_fraction*100)] = grouped_df.apply(lambda x: fun.get_SMG_for_EUCASTreplicate(x, raw_fitness_estimate, sample_to_mic[x.name], mic_fraction, "spot"))
+
+            for conc_estimate, conc_info_dict in [("concentration", concentrations_dict), ("log2_concentration", concentrations_dict_log2)]:
+                df_f["rAUC_%s"%conc_estimate] = grouped_df.apply(lambda x: fun.get_AUC_for_EUCASTreplicate(x, fitness_estimate, conc_info_dict, conc_estimate, min_points_to_calculate_auc=min_points_to_calculate_auc))
+
+            df_f["drug"] = drug
+            df_f["fitness_estimate"] = fitness_estimate
+            fun.add_df_to_table(table_all, df_f)
+
+    return fun.get_df_from_table(table_all, reset_index=True)
+
+# get the susceptibility df with both approaches
+fitness_estimates = ["K", "r", "nAUC"]
+fitness_df = get_synthetic_fitness_df(nsamples, fitness_estimates)
+print("Benchmarking the susceptibility measurements of %i samples..."%nsamples)
+
+df_susceptibility, elapsed_time_arrays = helpers.run_timed(fun.get_susceptibility_df, fitness_df, fitness_estimates, 4, "%s/susceptibility.tab"%tmpdir, "benchmark")
+print("array-based susceptibility measurements: %.2f seconds"%elapsed_time_arrays)
+
+df_susceptibility_per_sample, elapsed_time_per_sample = helpers.run_timed(get_susceptibility_df_per_sample, fitness_df, fitness_estimates, 4)
+print("per-sample susceptibility measurements: %.2f seconds (%.1fx slower)"%(elapsed_time_per_sample, elapsed_time_per_sample/elapsed_time_arrays))
+
+# check that the results are equal (with the same NaNs)
+if len(df_susceptibility)!=len(df_susceptibility_per_sample): raise ValueError("The number of rows is not as expected")
+for f in ["MIC_25", "MIC_50", "MIC_75", "MIC_90", "SMG_MIC_25", "SMG_MIC_50", "SMG_MIC_75", "SMG_MIC_90", "rAUC_concentration", "rAUC_log2_concentration"]:
+
+    values = df_susceptibility[f].values
+    expected_values = df_susceptibility_per_sample[f].values
+    if any(pd.isna(values)!=pd.isna(expected_values)): raise ValueError("The NaNs of %s are not as expected"%f)
+    if not np.allclose(values[~pd.isna(values)], expected_values[~pd.isna(values)], rtol=1e-12, atol=0): raise ValueError("The values of %s are not as expected"%f)
+
+print("The array-based susceptibility measurements are equal to the per-sample ones.")
+fun.delete_folder(tmpdir)
@@ -0,0 +1,165 @@
+# This is a python script to test the parity of the python fitness engine (get_df_fitness_python) with the R one (get_fitness_measurements.R, with qfa.fit). It compares the python fits with the stored output of the R engine for the plates of testing/testing_subsets, which is in <subset>/fitness_engine_parity_reference/<plate> (the qfa inputs and the logRegression_fits.tbl of get_fitness_measurements.R). It can also run an extra test on synthetic growth curves, which checks that the logistic parameters of growing spots are recovered, that the slow and not growing spots get the fits of checkSlow in qfa.fit, and that the parity check fails on missing spots, NaN mismatches and diverging spots.
+
+# It should be run in the environment of the docker image (with the dependencies of app_functions). For example:
+# python check_fitness_engine_parity.py record AST_48h_subset <output of testing_script.py for AST_48h_subset, run with keep_tmp> # store the R fits of a subset
+# python check_fitness_engine_parity.py reference # compare the python engine with the stored R fits of all subsets
+# python check_fitness_engine_parity.py synthetic 960 # the extra test with 960 synthetic spots
+
+# imports
+import os, sys
+import numpy as np
+import pandas as pd
+
+# import app functions
+CurDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, "%s/../../scripts"%CurDir)
+import app_functions as fun
+import benchmark_helpers as helpers
+
+# define the dirs and the experiment (as in testing_script.py)
+testing_subsets_dir = "%s/../testing_subsets"%CurDir
+hours_experiment = 24.0
+
+# get args
+if len(sys.argv)<2 or sys.argv[1] not in {"record", "reference", "synthetic"}: raise ValueError("The first argument should be 'record', 'reference' or 'synthetic'")
+mode = sys.argv[1]
+
+####### RECORD THE R FITS #######
+
+if mode=="record":
+
+    # define the inputs, which are the run of one subset with --keep_tmp_files
+    subset, outdir = sys.argv[2], sys.argv[3]
+    outdir_growth_calculations = "%s/tmp/growth_calculations"%outdir
+    if not os.path.isdir(outdir_growth_calculations): raise ValueError("%s should exist. Run the subset with --keep_tmp_files"%outdir_growth_calculations)
+
+    # copy the qfa inputs and R fits of each plate
+    reference_dir = "%s/%s/fitness_engine_parity_reference"%(testing_subsets_dir, subset)
+    reference_dir_tmp = "%s_tmp"%reference_dir; fun.delete_folder(reference_dir_tmp); fun.make_folder(reference_dir_tmp)
+    for plate in sorted([d for d in os.listdir(outdir_growth_calculations) if not d.startswith(".")]):
+
+        R_dirs = [d for d in os.listdir("%s/%s"%(outdir_growth_calculations, plate)) if d.startswith("output_")]
+        if len(R_dirs)!=1: raise ValueError("There should be one output dir of colonyzer in %s/%s"%(outdir_growth_calculations, plate))
+
+        fun.make_folder("%s/%s"%(reference_dir_tmp, plate))
+        for f in ["all_images_data.dat", "ExptDescription.txt", "LibraryDescriptions.txt", "ORF2GENE.txt", "logRegression_fits.tbl"]: fun.copy_file("%s/%s/%s/%s"%(outdir_growth_calculations, plate, R_dirs[0], f), "%s/%s/%s"%(reference_dir_tmp, plate, f))
+
+    fun.delete_folder(reference_dir); os.rename(reference_dir_tmp, reference_dir)
+    print("The R fits of %s are stored in %s"%(subset, reference_dir))
+
+#################################
+
+####### PARITY WITH THE STORED R FITS #######
+
+elif mode=="reference":
+
+    # get the stored R fits of each subset
+    subset_to_reference_dir = {subset : "%s/%s/fitness_engine_parity_reference"%(testing_subsets_dir, subset) for subset in sorted(os.listdir(testing_subsets_dir)) if os.path.isdir("%s/%s/fitness_engine_parity_reference"%(testing_subsets_dir, subset))}
+    if len(subset_to_reference_dir)==0: raise ValueError("There are no stored R fits in %s/<subset>/fitness_engine_parity_reference. Store them with the 'record' mode"%testing_subsets_dir)
+
+    # compare the python engine with all the stored plates
+    plate_to_R_dir = {"%s-%s"%(subset, plate) : "%s/%s"%(reference_dir, plate) for subset, reference_dir in subset_to_reference_dir.items() for plate in sorted(os.listdir(reference_dir)) if not plate.startswith(".")}
+    print("Comparing the python fitness engine with the stored R fits of %i plates..."%len(plate_to_R_dir))
+
+    df_parity, elapsed_time = helpers.run_timed(fun.get_df_fitness_engine_parity_plates, plate_to_R_dir, "%s/fitness_engine_parity_tmp"%CurDir, hours_experiment)
+    print("python fitness engine: %.2f seconds"%elapsed_time)
+    fun.delete_folder("%s/fitness_engine_parity_tmp"%CurDir)
+
+    fun.check_fitness_engine_parity(df_parity, fun.fitness_estimates_engine_parity)
+    print("The python fitness engine matches the R one in all %i spots."%len(df_parity))
+
+#############################################
+
+####### SYNTHETIC GROWTH CURVES #######
+
+elif mode=="synthetic":
+
+    if len(sys.argv)>2: nspots = int(sys.argv[2])
+    else: nspots = 960
+
+    def get_synthetic_df_growth_all(nspots, days_experiment, seed=0):
+
+        """Returns a synthetic growth df of all plates (as the one passed to get_df_fitness_python), with nspots in plates of 96 spots imaged every hour. Each spot has a logistic growth curve (with an initial growth equal to the pseudocount, as in get_df_growth_qfa_python) and a 'type_spot' field ('growing', 'slow' or 'not_growing'). It also returns the df with the real K and r of each spot."""
+
+        rng = np.random.RandomState(seed)
+        times = np.linspace(0, days_experiment, int(days_experiment*24)+1)
+        pseudocount_g = 0.001
+
+        # define the spots
+        df_spots = helpers.get_synthetic_df_spots(int(np.ceil(nspots/96))).iloc[0:nspots]
+        df_spots = pd.DataFrame({"outdir_colonyzer":"plate" + df_spots.plate.apply(str), "Barcode":"plate" + df_spots.plate.apply(str), "Row":df_spots.row, "Column":df_spots.column}).reset_index(drop=True)
+        df_spots["type_spot"] = rng.choice(["growing", "slow", "not_growing"], nspots, p=[0.8, 0.1, 0.1])
+        df_spots["real_K"] = rng.uniform(1e4, 1e5, nspots)
+        df_spots["real_r"] = np.where(df_spots.type_spot=="growing", rng.uniform(30, 60, nspots), rng.uniform(5, 10, nspots))
+
+        # get the growth of each spot and time
+        df_growth_all = df_spots.loc[df_spots.index.repeat(len(times))].reset_index(drop=True)
+        df_growth_all["Expt.Time"] = np.tile(times, nspots)
+        df_growth_all["Growth"] = df_growth_all.real_K / (1 + (df_growth_all.real_K/pseudocount_g - 1)*np.exp(-df_growth_all.real_r*df_growth_all["Expt.Time"]))
+        df_growth_all.loc[df_growth_all.type_spot=="not_growing", "Growth"] = pseudocount_g*rng.uniform(1, 1.5, sum(df_growth_all.type_spot=="not_growing"))
+        df_growth_all.loc[df_growth_all["Expt.Time"]==0, "Growth"] = pseudocount_g
+
+        for f in ["Treatments", "Medium", "Screen.Name", "ORF", "Gene", "Inoc.Time"]: df_growth_all[f] = "synthetic"
+        df_growth_all["X.Offset"] = df_growth_all.Column*100
+        df_growth_all["Y.Offset"] = df_growth_all.Row*100
+
+        return df_growth_all.drop(columns=["type_spot", "real_K", "real_r"]), df_spots
+
+    # fit the synthetic growth curves
+    days_experiment = 1.0
+    df_growth_all, df_spots = get_synthetic_df_growth_all(nspots, days_experiment)
+    print("Fitting %i synthetic growth curves..."%nspots)
+
+    df_fit, elapsed_time = helpers.run_timed(fun.get_df_fitness_python, df_growth_all, days_experiment)
+    df_fit = df_fit.merge(df_spots, on=["outdir_colonyzer", "Barcode", "Row", "Column"], how="left", validate="one_to_one")
+    df_fit = df_fit.merge(df_growth_all.groupby(["outdir_colonyzer", "Barcode", "Row", "Column"]).Growth.max().reset_index().rename(columns={"Growth":"max_growth"}), on=["outdir_colonyzer", "Barcode", "Row", "Column"], how="left", validate="one_to_one")
+    print("python fitness engine: %.2f seconds"%elapsed_time)
+
+    # check that the growing spots are recovered
+    df_growing = df_fit[df_fit.type_spot=="growing"]
+    for f in ["K", "r"]:
+        max_rel_diff = max(abs(df_growing[f] - df_growing["real_%s"%f]) / df_growing["real_%s"%f])
+        print("Maximum relative difference between the fitted and real %s of growing spots: %.2e"%(f, max_rel_diff))
+        if max_rel_diff>0.01: raise ValueError("The fitted %s is not as expected"%f)
+
+    # check that the other spots are flagged, with the fits of checkSlow
+    for type_spot, expected_fit_flag in [("growing", ""), ("slow", "slow"), ("not_growing", "not_growing")]:
+        strange_spots = df_fit[(df_fit.type_spot==type_spot) & (df_fit.fit_flag!=expected_fit_flag)]
+        if len(strange_spots)>0: raise ValueError("There are %i %s spots that are not flagged as '%s'"%(len(strange_spots), type_spot, expected_fit_flag))
+
+    df_flagged = df_fit[df_fit.fit_flag!=""]
+    if any(df_flagged.K!=df_flagged.max_growth): raise ValueError("The K of the flagged spots should be the maximum growth")
+    if any(df_fit[df_fit.fit_flag=="not_growing"].r!=0): raise ValueError("The r of the not growing spots should be 0")
+    if any(df_fit[df_fit.fit_flag=="slow"].r<=0): raise ValueError("The r of the slow spots should be re-estimated")
+    print("The python fitness engine recovers the growing spots and replaces the fits of the %i slow and %i not growing spots."%(sum(df_fit.fit_flag=="slow"), sum(df_fit.fit_flag=="not_growing")))
+
+    # check that the parity check fails on different fits. The reference are the python fits, so this only tests check_fitness_engine_parity (the parity with R is tested in the 'reference' mode)
+    def get_df_parity_all_plates(df_R, df_python):
+
+        """Returns the df of get_df_fitness_engine_parity for all plates"""
+
+        return pd.concat([fun.get_df_fitness_engine_parity(df_R[df_R.outdir_colonyzer==plate], df_python[df_python.outdir_colonyzer==plate], fun.fitness_estimates_engine_parity).assign(plate=plate) for plate in sorted(set(df_R.outdir_colonyzer))]).reset_index(drop=True)
+
+    def check_parity_fails(df_R, df_python, description):
+
+        """Checks that check_fitness_engine_parity fails for df_R and df_python"""
+
+        try: fun.check_fitness_engine_parity(get_df_parity_all_plates(df_R, df_python), fun.fitness_estimates_engine_parity)
+        except ValueError:
+            print("The parity check fails as expected with %s."%description)
+            return
+
+        raise ValueError("The parity check should fail with %s"%description)
+
+    check_parity_fails(df_fit.iloc[1:], df_fit, "a spot missing in the R fits")
+
+    df_R_nan = df_fit.copy(); df_R_nan.loc[df_R_nan.index[0], "DT"] = np.nan
+    check_parity_fails(df_R_nan, df_fit, "a NaN in only one engine")
+
+    df_R_diverging = df_fit.copy(); df_R_diverging.loc[df_R_diverging.index[0], "K"] *= 1.1
+    check_parity_fails(df_R_diverging, df_fit, "one diverging spot")
+
+    df_R_diverging_flagged = df_fit.copy(); df_R_diverging_flagged.loc[df_R_diverging_flagged[df_R_diverging_flagged.fit_flag!=""].index[0], "r"] += 1
+    check_parity_fails(df_R_diverging_flagged, df_fit, "one diverging flagged spot")
+
+#######################################
@@ -0,0 +1,78 @@
+# This is a python script to compare the plots and images of a run of testing_script.py with the ones of a baseline run (e.g. of the tree before a change in the plotting code). It compares all the .pdf, .png, .jpg and .tif files of each subset output (including <output>/tmp if the runs were done with keep_tmp, which has the merged images of the potential bad spots). It fails if a baseline file is missing, if the number or size of the pages of a pdf are different, or if the size (resolution) of an image is different. It also reports the images with the largest pixel differences, which should be inspected by eye.
+
+# It should be run in the environment of the docker image (with PIL). For example:
+# python testing_script.py keep_tmp plots_all # in the baseline tree, then move the output_Q-PHAST of each subset to <baseline dir>/<subset>
+# python testing_script.py keep_tmp plots_all # in the new tree
+# python compare_plots_with_baseline.py <baseline dir> # compare the output_Q-PHAST of each subset with <baseline dir>/<subset>
+
+# imports
+import os, sys, re
+import numpy as np
+from PIL import Image
+
+# define the dirs
+CurDir = os.path.dirname(os.path.realpath(__file__))
+testing_subsets_dir = "%s/../testing_subsets"%CurDir
+plot_extensions = {"pdf", "png", "jpg", "tif"}
+
+# get args
+if len(sys.argv)!=2: raise ValueError("The only argument should be the baseline dir, with the output of each subset in <baseline dir>/<subset>")
+baseline_dir = sys.argv[1]
+
+def get_plot_files(outdir):
+
+    """Returns the set of plot files (relative to outdir) of outdir"""
+
+    return {os.path.relpath("%s/%s"%(d, f), outdir) for d, subdirs, files in os.walk(outdir) for f in files if f.split(".")[-1].lower() in plot_extensions}
+
+def get_pdf_page_sizes(pdf_file):
+
+    """Returns the (width, height) of each page of a pdf (from the MediaBox of each page)"""
+
+    pdf_text = open(pdf_file, "rb").read().decode("latin-1")
+    return [tuple(round(float(x), 1) for x in m.split()[2:4]) for m in re.findall(r"/Type\s*/Page[^s].*?/MediaBox\s*\[([^\]]+)\]", pdf_text, flags=re.DOTALL)]
+
+def get_mean_pixel_difference(image_file, baseline_image_file):
+
+    """Returns the mean absolute difference (0-255) between the pixels of two images of the same size"""
+
+    images = [np.array(Image.open(f).convert("RGB"), dtype=float) for f in [image_file, baseline_image_file]]
+    return np.mean(abs(images[0]-images[1]))
+
+# compare each subset
+errors = []
+image_to_pixel_difference = {}
+for subset in ["AST_48h_subset", "Classic_spottest_subset", "Fitness_only_subset", "Stress_plates_subset"]:
+
+    # define the outputs
+    outdir = "%s/%s/output_Q-PHAST"%(testing_subsets_dir, subset)
+    baseline_outdir = "%s/%s"%(baseline_dir, subset)
+    for d in [outdir, baseline_outdir]:
+        if not os.path.isdir(d): raise ValueError("%s should exist"%d)
+
+    # compare the files
+    plot_files, baseline_plot_files = get_plot_files(outdir), get_plot_files(baseline_outdir)
+    print("%s: %i plot files (%i in the baseline)"%(subset, len(plot_files), len(baseline_plot_files)))
+    for f in sorted(baseline_plot_files.difference(plot_files)): errors.append("%s: %s is missing"%(subset, f))
+    for f in sorted(plot_files.difference(baseline_plot_files)): print("WARNING: %s: %s is not in the baseline"%(subset, f))
+
+    # compare the pages and resolution of each file
+    for f in sorted(plot_files.intersection(baseline_plot_files)):
+        file, baseline_file = "%s/%s"%(outdir, f), "%s/%s"%(baseline_outdir, f)
+
+        if f.endswith(".pdf"):
+            page_sizes, baseline_page_sizes = get_pdf_page_sizes(file), get_pdf_page_sizes(baseline_file)
+            if page_sizes!=baseline_page_sizes: errors.append("%s: %s has pages %s, and %s in the baseline"%(subset, f, page_sizes, baseline_page_sizes))
+
+        else:
+            size, baseline_size = Image.open(file).size, Image.open(baseline_file).size
+            if size!=baseline_size: errors.append("%s: %s has size %s, and %s in the baseline"%(subset, f, size, baseline_size))
+            else: image_to_pixel_difference["%s/%s"%(subset, f)] = get_mean_pixel_difference(file, baseline_file)
+
+# report the images that changed the most
+changed_images = sorted([(d, f) for f, d in image_to_pixel_difference.items() if d>0], reverse=True)
+print("%i of %i images have different pixels. These are the ones with the largest mean differences (0-255), which should be inspected by eye:"%(len(changed_images), len(image_to_pixel_difference)))
+for d, f in changed_images[0:20]: print("%.3f\t%s"%(d, f))
+
+if len(errors)>0: raise ValueError("The plots are different from the baseline:\n%s"%("\n".join(errors)))
+print("All the plots of the baseline are generated, with the same pages and resolution.")
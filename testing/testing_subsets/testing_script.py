@@ -1,6 +1,6 @@
 # This is a python script to test that all the subsets testing work
 
-# for testing run python testing_script.py out_in_desktop  keep_tmp # auto, skip_enhance_image_contrast
+# for testing run python testing_script.py out_in_desktop  keep_tmp # auto, skip_enhance_image_contrast, fitness_engine_parity, plots_all (render all plots, e.g. to compare them with a baseline using ../benchmarks/compare_plots_with_baseline.py)
 
 # imports
 import os, sys, platform
@@ -23,7 +23,7 @@ import main_functions as fun
 # get args
 if len(sys.argv)>1: all_args = set(sys.argv[1:])
 else: all_args = set()
-strange_args = all_args.difference({"out_in_desktop", "auto", "keep_tmp", "sudo", "skip_enhance_image_contrast"})
+strange_args = all_args.difference({"out_in_desktop", "auto", "keep_tmp", "sudo", "skip_enhance_image_contrast", "fitness_engine_parity", "plots_all"})
 if len(strange_args): raise ValueError("invalid args: %s"%strange_args)
 
 # define the python executable
@@ -77,6 +77,8 @@ for d in ["AST_48h_subset", "Classic_spottest_subset", "Fitness_only_subset", "S
         cmd = "%s %s --os %s --input %s --docker_image mikischikora/q-phast:v1 --output %s --min_nAUC_to_beConsideredGrowing 0.02 --enhance_image_contrast %s --hours_experiment 24.0 --parms_colonyzer lc,greenlab,diffims"%(python_exec, main_script, running_os, input_dir, output_dir, enhance_image_contrast) # default --parms_colonyzer greenlab,lc,diffims. Can also be none
         if "auto" in all_args: cmd += " --auto_accept --coords_1st_plate"
         if "keep_tmp" in all_args: cmd += " --keep_tmp_files"
+        if "fitness_engine_parity" in all_args: cmd += " --fitness_engine_parity"
+        if "plots_all" in all_args: cmd += " --plots all"
         fun.run_cmd(cmd)     
         open(finish_file, "w").write("finished")
 